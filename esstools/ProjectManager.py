@@ -235,6 +235,8 @@ class ProjectDialog(QDialog, Ui_ProjectDialog):
         self.datastore_name = None
         self.datastore_path = None
         self.datastore_schema = None
+        # datastore type of each item in the data type combo
+        self.datastore_types = [0, 1, 3]
 
         # set up internal GUI signals
         QObject.connect(self.closeButtonBox,SIGNAL("rejected()"),self.close)
@@ -250,7 +252,7 @@ class ProjectDialog(QDialog, Ui_ProjectDialog):
         if "datastore/type" in self.proj_settings:
             try:
                 idx = int(self.proj_settings["datastore/type"])
-                self.dataTypeCombo.setCurrentIndex(idx)
+                self.dataTypeCombo.setCurrentIndex(self.datastore_types.index(idx))
             except:
                 return
         else:
@@ -258,7 +260,7 @@ class ProjectDialog(QDialog, Ui_ProjectDialog):
         self.selectDatastoreType()
 
     def selectDatastoreType(self):
-        self.datastore_type = self.dataTypeCombo.currentIndex()
+        self.datastore_type = self.datastore_types[self.dataTypeCombo.currentIndex()]
         # type 0 - spatialite personal geodatabase # the default
         if self.datastore_type == 0:
             self.dataNewButton.setDisabled(False)
@@ -271,6 +273,12 @@ class ProjectDialog(QDialog, Ui_ProjectDialog):
             self.dataOpenButton.setDisabled(False)
             self.schemaCombo.setDisabled(True)
             self.schemaLabel.setDisabled(True)
+        # type 3 - geopackage file
+        elif self.datastore_type == 3:
+            self.dataNewButton.setDisabled(False)
+            self.dataOpenButton.setDisabled(False)
+            self.schemaCombo.setDisabled(True)
+            self.schemaLabel.setDisabled(True)
         # type 2 - PostGIS geodatabase # not available for now...
         elif self.datastore_type == 2:
             self.dataNewButton.setDisabled(True)
@@ -287,6 +295,8 @@ class ProjectDialog(QDialog, Ui_ProjectDialog):
             self.datastores = listSpatialiteConnections()
         elif self.datastore_type == 1:
             self.datastores = listShapeFolders()
+        elif self.datastore_type == 3:
+            self.datastores = listGeopackages()
         elif self.datastore_type == 2:
             #newfeature: get list of PostGIS connections
             pass
@@ -296,7 +306,7 @@ class ProjectDialog(QDialog, Ui_ProjectDialog):
         except:
             idx = 0
         if self.datastore_type == idx:
-            if self.datastore_type == 1:
+            if self.datastore_type in (1, 3):
                 self.appendDatastoreList(self.proj_settings["datastore/name"],self.proj_settings["datastore/path"])
             try:
                 self.datastores['idx'] = self.datastores['path'].index(self.proj_settings["datastore/path"])
@@ -384,6 +394,11 @@ class ProjectDialog(QDialog, Ui_ProjectDialog):
             if path.strip()!="":
                 path = unicode(path)
                 name = os.path.basename(path)
+        elif self.datastore_type == 3:
+            path = QFileDialog.getOpenFileName(self, "Open GeoPackage", lastDir, "GeoPackage (*.gpkg)")
+            if path.strip()!="":
+                path = unicode(path)
+                name = os.path.basename(path)
         if name != "" and path != "":
             self.appendDatastoreList(name,path)
             self.setDatastore()
@@ -411,6 +426,12 @@ class ProjectDialog(QDialog, Ui_ProjectDialog):
             if path.strip()!="":
                 path = unicode(path)
                 name = os.path.basename(path)
+        if self.datastore_type == 3:
+            path = QFileDialog.getSaveFileName(self, "Create GeoPackage", lastDir, "GeoPackage (*.gpkg)")
+            if path.strip()!="":
+                path = unicode(path)
+                name = os.path.basename(path)
+                createGeopackage(path)
 
         self.appendDatastoreList(name,path)
         self.setDatastore()
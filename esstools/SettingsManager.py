@@ -37,6 +37,10 @@ class SettingsManager(QObject):
 
         self.iface = iface
         self.dlg = SettingsDialog()
+        self.dlg.engineHostEdit.setText(self.getDepthmapEndpointsText())
+        self.dlg.engineHostEdit.editingFinished.connect(self.updateDepthmapEndpoints)
+        self.dlg.analysisProcessesSpin.setValue(self.getAnalysisProcesses())
+        self.dlg.analysisProcessesSpin.valueChanged.connect(self.setAnalysisProcesses)
 
     def showDialog(self):
         self.dlg.show()
@@ -49,6 +53,42 @@ class SettingsManager(QObject):
         settings = QSettings()
         settings.setValue("/esst/lastUsedDir", QFileInfo(path).filePath())
 
+    def getAnalysisProcesses(self):
+        # number of processes used by the built-in analysis engine, 0 uses all cores
+        settings = QSettings()
+        return int(settings.value("/esst/analysisProcesses", 0))
+
+    def setAnalysisProcesses(self, processes):
+        settings = QSettings()
+        settings.setValue("/esst/analysisProcesses", int(processes))
+
+    def getDepthmapEndpointsText(self):
+        # comma separated list of host:port depthmapXnet endpoints
+        settings = QSettings()
+        return settings.value("/esst/depthmapEndpoints", "localhost:31337")
+
+    def getDepthmapEndpoints(self):
+        endpoints = []
+        for endpoint in self.getDepthmapEndpointsText().split(','):
+            endpoint = endpoint.strip()
+            if endpoint == '':
+                continue
+            if ':' in endpoint:
+                host, port = endpoint.rsplit(':', 1)
+                if not port.isdigit():
+                    continue
+                endpoints.append((host, int(port)))
+            else:
+                endpoints.append((endpoint, 31337))
+        return endpoints
+
+    def setDepthmapEndpoints(self, text):
+        settings = QSettings()
+        settings.setValue("/esst/depthmapEndpoints", text)
+
+    def updateDepthmapEndpoints(self):
+        self.setDepthmapEndpoints(self.dlg.engineHostEdit.text())
+
 class SettingsDialog(QDialog, Ui_SettingsDialog):
     def __init__(self):
 
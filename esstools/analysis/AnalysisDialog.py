@@ -255,7 +255,8 @@ class AnalysisDialog(QtGui.QDockWidget, Ui_AnalysisDialog):
         self.axial_verify_report[self.layers_tab]['filter'] = self.axialReportFilterCombo.currentIndex()
         if self.layers_tab == 0:
             self.filterAxialProblems()
-        elif self.layers_tab == 1:
+        elif self.layers_tab in (1, 2):
+            # links problems are listed with their line ids, as unlinks
             self.filterUnlinkProblems()
 
     def getAxialProblemsFilter(self):
@@ -426,6 +427,10 @@ class AnalysisDialog(QtGui.QDockWidget, Ui_AnalysisDialog):
         self.axialDepthmapSettingsButton.setDisabled(onoff)
         self.axialDepthmapCancelButton.setDisabled(not onoff)
 
+    def lockAxialDepthmapQueue(self, onoff):
+        # more analyses can be queued while depthmapX runs, only cancelling changes
+        self.axialDepthmapCancelButton.setDisabled(not onoff)
+
     def clearAxialDepthmapTab(self):
         self.axialDepthmapRadiusText.clear()
         self.axialDepthmapOutputText.clear()
@@ -523,6 +528,9 @@ class AnalysisDialog(QtGui.QDockWidget, Ui_AnalysisDialog):
     def getAxialDepthmapRadiusType(self):
         return self.dlg_depthmap.axialRadiusCombo.currentIndex()
 
+    def getAxialDepthmapEngine(self):
+        return self.dlg_depthmap.axialEngineCombo.currentIndex()
+
     def getAxialDepthmapFullset(self):
         if self.dlg_depthmap.axialCalculateFullCheck.isChecked():
             return 1
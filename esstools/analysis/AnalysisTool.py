@@ -32,12 +32,14 @@ from UnlinksVerification import *
 from LinksVerification import *
 from OriginsVerification import *
 from DepthmapAnalysis import *
+from DepthmapQueue import *
+from NetworkAnalysis import *
 
 from ..utility_functions import *
+from ..network_functions import getPythonExecutable
 
-import socket
 import datetime
-import select
+from itertools import izip
 
 
 class AnalysisTool(QObject):
@@ -56,7 +58,10 @@ class AnalysisTool(QObject):
 
         # initialise axial analysis classes
         self.verificationThread = None
+        self.verificationSession = AxialVerificationSession(self)
+        self.analysisThread = None
         self.depthmapAnalysis = DepthmapAnalysis(self.iface)
+        self.depthmapQueue = DepthmapQueue(self)
 
         # connect signal/slots with main program
         self.project.settingsUpdated.connect(self.setDatastore)
@@ -78,6 +83,11 @@ class AnalysisTool(QObject):
         self.dlg.axialReportList.itemSelectionChanged.connect(self.zoomAxialProblem)
         self.dlg.axialDepthmapCalculateButton.clicked.connect(self.runDepthmapAnalysis)
         self.dlg.axialDepthmapCancelButton.clicked.connect(self.cancelDepthmapAnalysis)
+        self.depthmapQueue.jobStarted.connect(self.startDepthmapJob)
+        self.depthmapQueue.jobProgress.connect(self.updateDepthmapAnalysisProgress)
+        self.depthmapQueue.jobFinished.connect(self.processDepthmapAnalysisResults)
+        self.depthmapQueue.jobError.connect(self.depthmapAnalysisError)
+        self.depthmapQueue.queueFinished.connect(self.finishDepthmapQueue)
 
         # initialise internal globals
         self.isVisible = False
@@ -85,20 +95,17 @@ class AnalysisTool(QObject):
         self.running_analysis = ''
         self.start_time = None
         self.end_time = None
-        self.analysis_nodes = 0
         self.current_layer = QgsVectorLayer()
         self.user_id = ''
         self.axial_id = ''
-        self.all_ids = []
-
-        # timer to check for analysis result
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.checkDepthmapAnalysisProgress)
+        self.current_index = None
+        self.current_fids = []
+        self.network_job = None
 
         # define analysis data structures
         self.analysis_layers = {'map':'','unlinks':'','links':'','origins':''}
         self.axial_analysis_settings = {'type':0,'distance':0,'radius':0,'rvalues':'n','output':'',
-                                        'fullset':0,'betweenness':1,'newnorm':1,'weight':0,'weightBy':''}
+                                        'fullset':0,'betweenness':1,'newnorm':1,'weight':0,'weightBy':'','engine':0}
         self.analysis_output = ''
 
 
@@ -110,6 +117,7 @@ class AnalysisTool(QObject):
             self.iface.projectRead.disconnect(self.updateLayers)
             self.iface.newProjectCreated.disconnect(self.updateLayers)
             self.project.getProject().instance().layerLoaded.disconnect(self.getProjectSettings)
+        self.verificationSession.unwatchLayer()
         self.isVisible = False
 
     def onShow(self):
@@ -132,6 +140,7 @@ class AnalysisTool(QObject):
             self.iface.projectRead.disconnect(self.updateLayers)
             self.iface.newProjectCreated.disconnect(self.updateLayers)
             self.project.getProject().instance().layerLoaded.disconnect(self.getProjectSettings)
+        self.verificationSession.unwatchLayer()
         self.isVisible = False
 
     ##
@@ -153,6 +162,7 @@ class AnalysisTool(QObject):
         self.dlg.dlg_depthmap.setCalculateFull(self.axial_analysis_settings['fullset'])
         self.dlg.dlg_depthmap.setCalculateChoice(self.axial_analysis_settings['betweenness'])
         self.dlg.dlg_depthmap.setCalculateNorm(self.axial_analysis_settings['newnorm'])
+        self.dlg.dlg_depthmap.setAnalysisEngine(self.axial_analysis_settings['engine'])
 
     def updateProjectSettings(self):
         self.project.writeSettings(self.analysis_layers,"analysis")
@@ -170,6 +180,8 @@ class AnalysisTool(QObject):
         new_datastore['crs'] = layer.crs().postgisSrid()
         if 'SpatiaLite' in layer.storageType():
             new_datastore['type'] = 0
+        elif isGeopackageLayer(layer):
+            new_datastore['type'] = 3
         elif 'Shapefile' in layer.storageType():
             new_datastore['type'] = 1
         elif 'PostGIS' in layer.storageType():
@@ -199,6 +211,8 @@ class AnalysisTool(QObject):
                         txt = 'SF: '
                     elif self.datastore['type'] == 2:
                         txt = 'PG: '
+                    elif self.datastore['type'] == 3:
+                        txt = 'GP: '
                 txt += self.datastore['name']
                 path = self.datastore['path']
         self.dlg.setDatastore(txt, path)
@@ -304,6 +318,8 @@ class AnalysisTool(QObject):
     ##
     def runAxialVerification(self):
         self.edit_mode = self.dlg.getLayerTab()
+        # the layer ids may change, index them again when zooming
+        self.current_index = None
         self.analysis_layers = self.dlg.getAnalysisLayers()
         axial = getLayerByName(self.analysis_layers['map'])
         unlinks = getLayerByName(self.analysis_layers['unlinks'])
@@ -319,7 +335,12 @@ class AnalysisTool(QObject):
             self.user_id = self.axial_id
             if axial.geometryType() == QGis.Line:
                 caps = axial.dataProvider().capabilities()
-                self.verificationThread = AxialVerification(self.iface.mainWindow(), self, settings, axial, self.user_id, unlinks, links)
+                if axial.providerType() == 'postgres' and not testPostgisSpatialIndex(axial):
+                    self.iface.messageBar().pushMessage("Warning", "The axial layer has no spatial index. Verifying it in QGIS, which is slower than in PostGIS.", level=1, duration=5)
+                # edits of the axial layer are verified again on their own
+                self.verificationSession.watchLayer(axial)
+                self.verificationThread = AxialVerification(self.iface.mainWindow(), self, settings, axial, self.user_id,
+                                                            unlinks, links, self.verificationSession)
             else:
                 self.iface.messageBar().pushMessage("Error","Select an axial lines map layer.", level=1, duration=5)
                 return False
@@ -333,6 +354,8 @@ class AnalysisTool(QObject):
                 self.iface.messageBar().pushMessage("Warning", "The unlinks layer has invalid or duplicate values in the ID column. Using feature ids instead.", level=1, duration=5)
             if unlinks.fieldNameIndex("line1") == -1 or unlinks.fieldNameIndex("line2") == -1:
                 self.iface.messageBar().pushMessage("Warning", "The unlinks layer is missing the line1 and line2 ID columns. Update IDs to complete the verification.", level=1, duration=5)
+            if unlinks.providerType() == 'postgres' and not (testPostgisSpatialIndex(unlinks) and testPostgisSpatialIndex(axial)):
+                self.iface.messageBar().pushMessage("Warning", "The unlinks or axial layer has no spatial index. Verifying them in QGIS, which is slower than in PostGIS.", level=1, duration=5)
             self.verificationThread = UnlinksVerification( self.iface.mainWindow(), self, settings, axial, self.axial_id, unlinks, self.user_id)
         elif self.edit_mode == 2:
             if links and (axial.storageType() != links.storageType()):
@@ -344,7 +367,7 @@ class AnalysisTool(QObject):
                 self.iface.messageBar().pushMessage("Warning", "The links layer has invalid or duplicate values in the ID column. Using feature ids instead.", level=1, duration=5)
             if links.fieldNameIndex("line1") == -1 or links.fieldNameIndex("line2") == -1:
                 self.iface.messageBar().pushMessage("Warning", "The links layer is missing the line1 and line2 ID columns. Update IDs to complete the verification.", level=1, duration=5)
-            # newfeature: check links validity
+            self.verificationThread = LinksVerification(self.iface.mainWindow(), self, settings, axial, self.axial_id, links, self.user_id)
         elif self.edit_mode == 3:
             if origins and (axial.storageType() != origins.storageType()):
                 self.iface.messageBar().pushMessage("Error","All layers must be in the same file format.", level=1, duration=5)
@@ -371,6 +394,8 @@ class AnalysisTool(QObject):
 
     def runAxialUpdate(self):
         self.edit_mode = self.dlg.getLayerTab()
+        # the layer ids may change, index them again when zooming
+        self.current_index = None
         self.analysis_layers = self.dlg.getAnalysisLayers()
         axial = getLayerByName(self.analysis_layers['map'])
         unlinks = getLayerByName(self.analysis_layers['unlinks'])
@@ -521,15 +546,15 @@ class AnalysisTool(QObject):
             if name != self.current_layer.name():
                 layer = getLayerByName(name)
                 self.current_layer = layer
+                self.current_index = None
             else:
                 layer = self.current_layer
         if layer:
-            # get layer ids
+            # get layer ids, indexed once for the current layer
             #self.user_id = getIdField(layer)
-            if self.user_id == '':
-                self.all_ids = layer.allFeatureIds()
-            else:
-                self.all_ids = getFieldValues(layer, self.user_id)
+            if self.current_index is None:
+                self.current_index, self.current_fids = getLayerIdIndex(layer, self.user_id)
+            if self.user_id != '':
                 layer.setDisplayField(self.user_id)
             # set display field for axial map (always)
             if idx != 0:
@@ -543,21 +568,15 @@ class AnalysisTool(QObject):
             items = self.dlg.getAxialVerifyProblems()
             # select features and zoom
             for id in items:
-                if type(id) == list:
-                    for i in id:
-                        if int(i) in self.all_ids:
-                            features.append(int(i))
-                else:
-                    if int(id) in self.all_ids:
-                        features.append(int(id))
-            if features:
-                if self.user_id == '':
-                    layer.setSelectedFeatures(features)
-                else:
-                    ids = getFeatureListIds(layer,self.user_id,features)
-                    layer.setSelectedFeatures(ids.values())
-            else:
-                layer.setSelectedFeatures([])
+                if type(id) != list:
+                    id = [id]
+                for i in id:
+                    if i is None or i == NULL:
+                        continue
+                    row = self.current_index.get(i)
+                    if row is not None:
+                        features.append(self.current_fids[row])
+            layer.setSelectedFeatures(features)
             if layer.selectedFeatureCount() > 0:
                 self.iface.mapCanvas().setCurrentLayer(layer)
                 l = self.iface.legendInterface()
@@ -573,168 +592,189 @@ class AnalysisTool(QObject):
     ##
     ## Depthmap analysis functions
     ##
-    def getDepthmapConnection(self):
-        # todo: get these settings from settings manager
-        connection = {'host':'localhost','port':31337}
-        return connection
-
-    def connectDepthmapNet(self):
-        connected = False
-        connection = self.getDepthmapConnection()
-        self.socket = MySocket()
-        # connect socket
-        result = self.socket.connectSocket(connection['host'],connection['port'])
-        # if connection fails give warning and stop analysis
-        if result != '':
-            self.iface.messageBar().pushMessage("Warning","Make sure depthmapX is running.", level=1, duration=4)
-            connected = False
-            self.socket.closeSocket()
-        else:
-            connected = True
-        return connected
-
     def runDepthmapAnalysis(self):
         # check if there's a datastore defined
         if not self.isDatastoreSet():
             return
-        # try to connect to the analysis engine
-        if self.connectDepthmapNet():
+        # the built-in engine runs one analysis at a time, depthmapX analyses are queued
+        self.axial_analysis_settings['engine'] = self.dlg.getAxialDepthmapEngine()
+        if self.depthmapQueue.isRunning():
+            if self.axial_analysis_settings['engine'] == 1:
+                self.dlg.writeAxialDepthmapReport("Please wait for the depthmapX analyses to finish.")
+                return
+        else:
             self.dlg.clearAxialDepthmapReport()
-            # get selected layers
-            self.analysis_layers = self.dlg.getAnalysisLayers()
-            # get the basic analysis settings
-            self.axial_analysis_settings['type'] = self.dlg.getDepthmapAnalysisType()
-            self.axial_analysis_settings['weight'] = self.dlg.getDepthmapWeighted()
-            self.axial_analysis_settings['weightBy'] = self.dlg.getDepthmapWeightAttribute()
-            txt = self.depthmapAnalysis.parseRadii(self.dlg.getDepthmapRadiusText())
-            if txt == '':
-                self.dlg.writeAxialDepthmapReport("Please verify the radius values.")
+        # get selected layers
+        self.analysis_layers = self.dlg.getAnalysisLayers()
+        # get the basic analysis settings
+        self.axial_analysis_settings['type'] = self.dlg.getDepthmapAnalysisType()
+        self.axial_analysis_settings['weight'] = self.dlg.getDepthmapWeighted()
+        self.axial_analysis_settings['weightBy'] = self.dlg.getDepthmapWeightAttribute()
+        txt = self.depthmapAnalysis.parseRadii(self.dlg.getDepthmapRadiusText())
+        if txt == '':
+            self.dlg.writeAxialDepthmapReport("Please verify the radius values.")
+            return
+        else:
+            self.axial_analysis_settings['rvalues'] = txt
+        self.axial_analysis_settings['output'] = self.dlg.getAxialDepthmapOutputTable()
+        self.analysis_output = self.axial_analysis_settings['output']
+        # get the advanced analysis settings
+        self.axial_analysis_settings['distance'] = self.dlg.getAxialDepthmapDistanceType()
+        self.axial_analysis_settings['radius'] = self.dlg.getAxialDepthmapRadiusType()
+        self.axial_analysis_settings['fullset'] = self.dlg.getAxialDepthmapFullset()
+        self.axial_analysis_settings['betweenness'] = self.dlg.getAxialDepthmapChoice()
+        self.axial_analysis_settings['newnorm'] = self.dlg.getAxialDepthmapNormalised()
+
+        # check if output file/table already exists
+        table_exists = False
+        if self.datastore['type'] == 0:
+            connection = getSpatialiteConnection(self.datastore['path'])
+            if connection:
+                table_exists = testSpatialiteTableExists(connection,self.axial_analysis_settings['output'])
+            connection.close()
+        elif self.datastore['type'] == 1:
+            table_exists = testShapeFileExists(self.datastore['path'],self.axial_analysis_settings['output'])
+        elif self.datastore['type'] == 3:
+            table_exists = testGeopackageTableExists(self.datastore['path'],self.axial_analysis_settings['output'])
+        if table_exists:
+            action = QMessageBox.question(None, "Overwrite table", "The output table already exists in:\n %s.\nOverwrite?"% self.datastore['path'],"Ok","Cancel","",1,1)
+            if action == 0:
+                pass
+            elif action == 1:
                 return
             else:
-                self.axial_analysis_settings['rvalues'] = txt
-            self.axial_analysis_settings['output'] = self.dlg.getAxialDepthmapOutputTable()
-            self.analysis_output = self.axial_analysis_settings['output']
-            # get the advanced analysis settings
-            self.axial_analysis_settings['distance'] = self.dlg.getAxialDepthmapDistanceType()
-            self.axial_analysis_settings['radius'] = self.dlg.getAxialDepthmapRadiusType()
-            self.axial_analysis_settings['fullset'] = self.dlg.getAxialDepthmapFullset()
-            self.axial_analysis_settings['betweenness'] = self.dlg.getAxialDepthmapChoice()
-            self.axial_analysis_settings['newnorm'] = self.dlg.getAxialDepthmapNormalised()
-
-            # check if output file/table already exists
-            table_exists = False
-            if self.datastore['type'] == 0:
-                connection = getSpatialiteConnection(self.datastore['path'])
-                if connection:
-                    table_exists = testSpatialiteTableExists(connection,self.axial_analysis_settings['output'])
-                connection.close()
-            elif self.datastore['type'] == 1:
-                table_exists = testShapeFileExists(self.datastore['path'],self.axial_analysis_settings['output'])
-            if table_exists:
-                action = QMessageBox.question(None, "Overwrite table", "The output table already exists in:\n %s.\nOverwrite?"% self.datastore['path'],"Ok","Cancel","",1,1)
-                if action == 0:
-                    pass
-                elif action == 1:
-                    return
-                else:
-                    return
-            # run the analysis
-            command = self.depthmapAnalysis.setupAnalysis(self.analysis_layers, self.axial_analysis_settings)
-            if command and command != '':
-                self.updateProjectSettings()
-                self.start_time = datetime.datetime.now()
-                message = u"Running analysis for %s...\nStart: %s" % (self.analysis_layers["map"], self.start_time.strftime("%d/%m/%Y %H:%M:%S"))
-                # print message in results window
-                self.dlg.writeAxialDepthmapReport(message)
-                self.dlg.lockAxialDepthmapTab(True)
-                self.iface.messageBar().pushMessage("Info","Do not close QGIS or depthmapX while the analysis is running!", level=0, duration=5)
-                # start the analysis by sending the command and starting the timer
-                bytessent = self.socket.sendData(command)
-                #timer to check if results are ready, in milliseconds
-                self.timer.start(1000)
-                self.running_analysis = 'axial'
-            else:
-                self.dlg.writeAxialDepthmapReport("Unable to run this analysis. Please check the analysis settings.")
-                #self.iface.messageBar().pushMessage("Error","Unable to run this space syntax analysis.", level=2, duration=4)
+                return
+        # run the analysis with the built-in engine
+        if self.axial_analysis_settings['engine'] == 1:
+            self.runNetworkAnalysis()
+            return
+        # queue the analysis, it runs when a depthmapX endpoint is free
+        command = self.depthmapAnalysis.setupAnalysis(self.analysis_layers, self.axial_analysis_settings)
+        if command and command != '':
+            self.updateProjectSettings()
+            job = self.getAnalysisJob()
+            job['command'] = command
+            message = u"Queued analysis for %s...\nStart: %s" % (self.analysis_layers["map"], job['start_time'].strftime("%d/%m/%Y %H:%M:%S"))
+            # print message in results window
+            self.dlg.writeAxialDepthmapReport(message)
+            self.dlg.lockAxialDepthmapQueue(True)
+            self.iface.messageBar().pushMessage("Info","Do not close QGIS or depthmapX while the analysis is running!", level=0, duration=5)
+            self.running_analysis = 'axial'
+            self.depthmapQueue.setEndpoints(self.settings.getDepthmapEndpoints())
+            self.depthmapQueue.addJob(job)
+        else:
+            self.dlg.writeAxialDepthmapReport("Unable to run this analysis. Please check the analysis settings.")
+            #self.iface.messageBar().pushMessage("Error","Unable to run this space syntax analysis.", level=2, duration=4)
+
+    def runNetworkAnalysis(self):
+        if self.axial_analysis_settings['type'] not in (0, 1):
+            self.dlg.writeAxialDepthmapReport("The built-in engine only supports axial and segment analysis. Please use depthmapX.")
+            return
+        axial = getLegendLayerByName(self.iface, self.analysis_layers['map'])
+        unlinks = getLegendLayerByName(self.iface, self.analysis_layers['unlinks'])
+        links = getLegendLayerByName(self.iface, self.analysis_layers['links'])
+        self.updateProjectSettings()
+        self.network_job = self.getAnalysisJob()
+        message = u"Running analysis for %s...\nStart: %s" % (self.analysis_layers["map"], self.network_job['start_time'].strftime("%d/%m/%Y %H:%M:%S"))
+        self.dlg.writeAxialDepthmapReport(message)
+        if self.axial_analysis_settings['weight']:
+            self.dlg.writeAxialDepthmapReport("The built-in engine ignores the weight attribute.")
+        processes = self.settings.getAnalysisProcesses()
+        if processes != 1 and getPythonExecutable() is None:
+            self.dlg.writeAxialDepthmapReport("The python interpreter wasn't found, the built-in engine runs in one process.")
+        self.dlg.lockAxialDepthmapTab(True)
+        self.analysisThread = NetworkAnalysis(self.iface.mainWindow(), self, self.network_job['settings'], axial, getIdField(axial),
+                                              unlinks, links, processes)
+        self.analysisThread.analysisFinished.connect(self.processNetworkAnalysisResults)
+        self.analysisThread.analysisProgress.connect(self.dlg.updateAxialDepthmapProgressbar)
+        self.analysisThread.analysisError.connect(self.cancelNetworkAnalysis)
+        self.analysisThread.analysisWarning.connect(self.dlg.writeAxialDepthmapReport)
+        self.running_analysis = 'axial'
+        self.analysisThread.start()
+
+    def cancelNetworkAnalysis(self, txt=""):
+        if self.analysisThread:
+            self.analysisThread.stop()
+            try:
+                self.analysisThread.analysisFinished.disconnect(self.processNetworkAnalysisResults)
+                self.analysisThread.analysisProgress.disconnect(self.dlg.updateAxialDepthmapProgressbar)
+                self.analysisThread.analysisError.disconnect(self.cancelNetworkAnalysis)
+                self.analysisThread.analysisWarning.disconnect(self.dlg.writeAxialDepthmapReport)
+            except:
+                pass
+            self.analysisThread = None
+        if txt:
+            self.dlg.setAxialDepthmapProgressbar(0, 100)
+            self.dlg.lockAxialDepthmapTab(False)
+            self.dlg.writeAxialDepthmapReport(txt)
+            self.running_analysis = ''
+
+    def processNetworkAnalysisResults(self, attributes, types, columns):
+        self.cancelNetworkAnalysis()
+        dt = datetime.datetime.now()
+        feedback = u"Finish: %s" % dt.strftime("%d/%m/%Y %H:%M:%S")
+        self.dlg.writeAxialDepthmapReport(feedback)
+        job = self.network_job
+        self.depthmapAnalysis.settings = job['settings']
+        attributes, types, columns, coords = self.depthmapAnalysis.formatAnalysisResult(job['datastore'], attributes, columns, types)
+        self.dlg.setAxialDepthmapProgressbar(100, 100)
+        self.writeAnalysisResults(job, attributes, types, columns, coords)
+        self.dlg.lockAxialDepthmapTab(False)
+        self.running_analysis = ''
+
+    def getAnalysisJob(self):
+        # copy of the current analysis settings, so that more analyses can be set up while it runs
+        job = {'layers': dict(self.analysis_layers), 'settings': dict(self.axial_analysis_settings),
+               'datastore': dict(self.datastore), 'output': self.analysis_output,
+               'start_time': datetime.datetime.now()}
+        return job
 
     def cancelDepthmapAnalysis(self):
         if self.running_analysis == 'axial':
             self.dlg.setAxialDepthmapProgressbar(0, 100)
             self.dlg.lockAxialDepthmapTab(False)
+            self.dlg.lockAxialDepthmapQueue(False)
             self.dlg.writeAxialDepthmapReport("Analysis canceled by user.")
-        self.timer.stop()
-        self.socket.closeSocket()
+        self.cancelNetworkAnalysis()
+        self.depthmapQueue.cancel()
         self.running_analysis = ''
 
-    def checkDepthmapAnalysisProgress(self):
-        error = False
-        result = self.socket.isReady()
-        if result:
-            connected, msg = self.socket.checkData(4096)
-            if "--r" in msg or "esult" in msg:
-                self.timer.stop()
-                # retrieve all the remaining data
-                if not msg.endswith("--result--\n"):
-                    received, result = self.socket.receiveData(4096,"--result--\n")
-                    if received:
-                        msg += result
-                self.socket.closeSocket()
-                # update calculation time
-                dt = datetime.datetime.now()
-                feedback = u"Finish: %s" % dt.strftime("%d/%m/%Y %H:%M:%S")
-                self.dlg.writeAxialDepthmapReport(feedback)
-                #process the output in the analysis
-                self.processDepthmapAnalysisResults(msg)
-                self.running_analysis = ''
-            elif "--comm: 3," in msg:
-                prog = self.updateDepthmapAnalysisProgress(msg)
-                if self.running_analysis == 'axial':
-                    self.dlg.updateAxialDepthmapProgressbar(prog)
-            elif not connected:
-                error = True
-        else:
-            error = True
-        if error:
-            if self.running_analysis == 'axial':
-                self.dlg.setAxialDepthmapProgressbar(0, 100)
-                self.dlg.lockAxialDepthmapTab(False)
-                self.dlg.writeAxialDepthmapReport("Analysis error.")
-            self.timer.stop()
-            self.socket.closeSocket()
-            self.running_analysis = ''
+    def startDepthmapJob(self, job_id, endpoint):
+        job = self.depthmapQueue.getJob(job_id)
+        self.dlg.writeAxialDepthmapReport(u"Analysis %d of %s running on %s" % (job_id + 1, job['layers']['map'], endpoint))
 
-    def updateDepthmapAnalysisProgress(self,msg):
-        # calculate percent done and adjust timer
-        relprog = 0
-        # extract number of nodes
-        if "--comm: 2," in msg:
-            pos1 = msg.find("--comm: 2,")
-            pos2 = msg.find(",0 ",pos1)
-            self.analysis_nodes = msg[(pos1 + 10):pos2]
-            step = int(self.analysis_nodes) * 0.2
-            self.timer.start(step)
-        # extract progress info from string
-        progress = msg.split("\n")
-        # calculate progress
-        if self.analysis_nodes > 0:
-            pos1 = progress[-2].find(" 3,")
-            pos2 = progress[-2].find(",0 ")
-            prog = progress[-2][(pos1 + 3):pos2]
-            relprog = (float(prog) / float(self.analysis_nodes)) * 100
-        return relprog
-
-    def processDepthmapAnalysisResults(self, msg):
-        new_layer = None
+    def updateDepthmapAnalysisProgress(self, job_id, prog):
+        if self.running_analysis == 'axial':
+            self.dlg.updateAxialDepthmapProgressbar(self.depthmapQueue.getProgress())
+
+    def depthmapAnalysisError(self, job_id, txt):
+        self.dlg.writeAxialDepthmapReport(u"Analysis %d error: %s" % (job_id + 1, txt))
+
+    def processDepthmapAnalysisResults(self, job_id, result):
+        job = self.depthmapQueue.getJob(job_id)
+        # update calculation time
+        dt = datetime.datetime.now()
+        feedback = u"Analysis %d finish: %s" % (job_id + 1, dt.strftime("%d/%m/%Y %H:%M:%S"))
+        self.dlg.writeAxialDepthmapReport(feedback)
+        # process the output in the analysis
+        self.depthmapAnalysis.settings = job['settings']
+        attributes, types, columns, coords = self.depthmapAnalysis.processAnalysisResult(job['datastore'], result)
+        self.writeAnalysisResults(job, attributes, types, columns, coords)
+        self.dlg.updateAxialDepthmapProgressbar(self.depthmapQueue.getProgress())
+
+    def finishDepthmapQueue(self):
         if self.running_analysis == 'axial':
             self.dlg.setAxialDepthmapProgressbar(100, 100)
-            attributes, types, values, coords = self.depthmapAnalysis.processAnalysisResult(self.datastore, msg)
-            new_layer = self.saveAnalysisResults(attributes, types, values, coords)
-            # update processing time
-            self.end_time = datetime.datetime.now()
-            elapsed = self.end_time - self.start_time
-            message = u"Post-processing: %s\nTotal running time: %s" % (self.end_time.strftime("%d/%m/%Y %H:%M:%S"), elapsed)
-            self.dlg.writeAxialDepthmapReport(message)
-            self.dlg.lockAxialDepthmapTab(False)
+            self.dlg.lockAxialDepthmapQueue(False)
+        self.running_analysis = ''
+
+    def writeAnalysisResults(self, job, attributes, types, columns, coords):
+        new_layer = self.saveAnalysisResults(job, attributes, types, columns, coords)
+        # update processing time
+        self.end_time = datetime.datetime.now()
+        elapsed = self.end_time - job['start_time']
+        message = u"Post-processing: %s\nTotal running time: %s" % (self.end_time.strftime("%d/%m/%Y %H:%M:%S"), elapsed)
+        self.dlg.writeAxialDepthmapReport(message)
         if new_layer:
             existing_names = [layer.name() for layer in getLegendLayers(self.iface)]
             if new_layer.name() in existing_names:
@@ -745,156 +785,148 @@ class AnalysisTool(QObject):
             new_layer.updateExtents()
 
 
-    def saveAnalysisResults(self, attributes, types, values, coords):
+    def updateCopyProgress(self, value):
+        # the layer is copied in the interface thread, keep it responsive so that it can be cancelled
+        self.dlg.setAxialDepthmapProgressbar(value, 100)
+        QApplication.processEvents()
+        return self.running_analysis != ''
+
+    def getResultIds(self, layer, attributes, columns, copied):
+        # the id of the line of each result row, and the table column it matches
+        if 'axial_id' not in attributes:
+            return None, 'rowid'
+        ids = list(columns[attributes.index('axial_id')])
+        id_field = getIdField(layer)
+        if id_field != '' and not (copied and id_field.lower() == 'pk_id'):
+            return ids, id_field
+        if not copied:
+            # spatialite feature ids are the rowid
+            return ids, 'rowid'
+        # copied lines get a new primary key, in the order of the features
+        rows = getLayerIdIndex(layer)[0]
+        return [rows[id] + 1 if id in rows else None for id in ids], 'pk_id'
+
+    def getResultFids(self, layer, target, attributes, columns):
+        # the feature id in the target layer of the line of each result row, copied from layer
+        # the axial id is renamed axid in shapefiles
+        idx = [i for i, attr in enumerate(attributes) if attr.lower() in ('axial_id', 'axid')]
+        if not idx:
+            return None
+        ids = list(columns[idx[0]])
+        id_field = getIdField(layer)
+        if id_field != '' and fieldExists(target, id_field):
+            rows, fids = getLayerIdIndex(target, id_field)
+        else:
+            # without an id field, the copied features keep the order of the features
+            rows = getLayerIdIndex(layer)[0]
+            fids = getLayerIdIndex(target)[1]
+        return [fids[rows[id]] if id in rows else None for id in ids]
+
+    def getResultRows(self, layer, attributes, types, columns):
+        # the geometry and attribute values of each line, followed by its result row, matched by the axial id
+        # returns the attributes and types of the rows, the results replace the layer attributes with the same name
+        layer_fields = layer.dataProvider().fields().toList()
+        fields = [i for i, field in enumerate(layer_fields) if field.name() not in attributes and field.name().lower() != 'fid']
+        idx = [i for i, attr in enumerate(attributes) if attr.lower() in ('axial_id', 'axid')]
+        id_field = getIdField(layer)
+        # position of the result of each id in the columns
+        size = len(columns[0]) if columns else 0
+        results = dict()
+        if idx:
+            results = dict((id, i) for i, id in enumerate(columns[idx[0]]))
+        empty = [None] * len(attributes)
+        rows = []
+        for i, feature in enumerate(layer.getFeatures()):
+            geom = feature.geometry()
+            if not idx:
+                pos = i if i < size else None
+            elif id_field == '':
+                pos = results.get(feature.id())
+            else:
+                pos = results.get(feature.attribute(id_field))
+            result = empty if pos is None else [column[pos] for column in columns]
+            rows.append((geom.asWkb() if geom else None, [feature[j] for j in fields] + result))
+        return ([layer_fields[j].name() for j in fields] + attributes, [layer_fields[j].type() for j in fields] + types, rows)
+
+    def saveAnalysisResults(self, job, attributes, types, columns, coords):
+        # the results are columns, the row based writers read them through izip
         # Save results to output
-        analysis_layer = getLegendLayerByName(self.iface, self.analysis_layers['map'])
+        analysis_layer = getLegendLayerByName(self.iface, job['layers']['map'])
         srid = analysis_layer.crs()
-        path = self.datastore['path']
-        name = self.analysis_output
+        datastore = job['datastore']
+        path = datastore['path']
+        name = job['output']
         # if it's an axial analysis try to update the existing layer
         new_layer = None
-        if self.axial_analysis_settings['type'] == 0:  #this has to be made general...
+        if job['settings']['type'] == 0:  #this has to be made general...
             provider = analysis_layer.storageType()
             create_table = False
             # unless one of these is different: output table name, file type, data store location, number of records
             # this last one is a weak check for changes to the table. making a match of results by id would take ages.
-            if analysis_layer.name() != name or getLayerPath(analysis_layer) != path or len(values) != analysis_layer.featureCount():
+            if analysis_layer.name() != name or getLayerPath(analysis_layer) != path or len(columns[0]) != analysis_layer.featureCount():
                 create_table = True
-            if self.datastore['type'] == 0:
+            if datastore['type'] == 0:
                 connection = getSpatialiteConnection(path)
                 if ('spatialite' not in provider.lower() or create_table):
-                    res = copyLayerToSpatialite(connection, analysis_layer, path, name)
+                    res = copyLayerToSpatialite(connection, analysis_layer, path, name, progress=self.updateCopyProgress)
                     if res:
-                        res = addSpatialiteAttributes(connection, name, attributes, types, values)
+                        ids, idcol = self.getResultIds(analysis_layer, attributes, columns, True)
+                        res = addSpatialiteAttributes(connection, name, attributes, types, izip(*columns), ids, idcol)
                         if res:
                             new_layer = getSpatialiteLayer(connection, path, name)
                 else:
-                    res = addSpatialiteAttributes(connection, name, attributes, types, values)
+                    ids, idcol = self.getResultIds(analysis_layer, attributes, columns, False)
+                    res = addSpatialiteAttributes(connection, name, attributes, types, izip(*columns), ids, idcol)
                     if res:
                         QgsMapLayerRegistry.instance().removeMapLayer(analysis_layer.id())
                         new_layer = getSpatialiteLayer(connection, path, name)
                 connection.close()
-            elif self.datastore['type'] == 1:
+            elif datastore['type'] == 1:
                 if ('shapefile' not in provider.lower() or create_table):
                     new_layer = copyLayerToShapeFile(analysis_layer, path, name)
-                    addShapeFileAttributes(new_layer, attributes, types, values)
+                    if new_layer:
+                        fids = self.getResultFids(analysis_layer, new_layer, attributes, columns)
+                        addShapeFileAttributes(new_layer, attributes, types, izip(*columns), fids)
                 else:
-                    addShapeFileAttributes(analysis_layer, attributes, types, values)
-            elif self.datastore['type'] == 2:
+                    fids = self.getResultFids(analysis_layer, analysis_layer, attributes, columns)
+                    addShapeFileAttributes(analysis_layer, attributes, types, izip(*columns), fids)
+            elif datastore['type'] == 3:
+                # the results are joined to the lines and written as a new table
+                table_attributes, table_types, rows = self.getResultRows(analysis_layer, attributes, types, columns)
+                replace = isGeopackageLayer(analysis_layer) and getLayerPath(analysis_layer) == path and analysis_layer.name() == name
+                if replace:
+                    # release the table before replacing it
+                    QgsMapLayerRegistry.instance().removeMapLayer(analysis_layer.id())
+                res = writeGeopackageTable(path, name, srid.postgisSrid(), table_attributes, table_types, rows, QGis.Line)
+                if res:
+                    new_layer = getGeopackageLayer(path, name)
+                elif replace and testGeopackageTableExists(path, name):
+                    # load the map layer again, as it was left by the failed write
+                    old_layer = getGeopackageLayer(path, name)
+                    if old_layer:
+                        QgsMapLayerRegistry.instance().addMapLayer(old_layer)
+            elif datastore['type'] == 2:
                 if ('postgresql' not in provider.lower() or create_table):
                     # newfeature: implement PostGIS handling
                     pass
         #if it's a segment analysis always create a new layer
-        elif self.axial_analysis_settings['type'] == 1:  #this has to be made general...
-            if self.datastore['type'] == 0:
+        elif job['settings']['type'] == 1:  #this has to be made general...
+            if datastore['type'] == 0:
                 connection = getSpatialiteConnection(path)
                 res = createSpatialiteTable(connection, path, name, srid.postgisSrid(), attributes, types, 'MULTILINESTRING')
                 if res:
-                    res = insertSpatialiteValues(connection, name, attributes, values, coords)
+                    res = insertSpatialiteValues(connection, name, attributes, izip(*columns), coords)
                     if res:
                         new_layer = getSpatialiteLayer(connection, path, name)
                 connection.close()
-            elif self.datastore['type'] == 1:
-                new_layer = createShapeFileFullLayer(path, name, srid, attributes, types, values, coords)
+            elif datastore['type'] == 1:
+                new_layer = createShapeFileFullLayer(path, name, srid, attributes, types, izip(*columns), coords)
+            elif datastore['type'] == 3:
+                rows = ((getLineWkb([(float(val[coords[0]]), float(val[coords[1]])), (float(val[coords[2]]), float(val[coords[3]]))]), val)
+                        for val in izip(*columns))
+                res = writeGeopackageTable(path, name, srid.postgisSrid(), attributes, types, rows, QGis.Line)
+                if res:
+                    new_layer = getGeopackageLayer(path, name)
                 #new_layer = createShapeFileLayer(path, name, srid, attributes, types, 'MULTILINESTRING')
                 #insertShapeFileValues(new_layer, attributes, values, coords)
         return new_layer
-
-
-# socket class with adapted methods and error trapping, derived from QObject to support Signals
-class MySocket(QObject):
-    def __init__(self, s=None):
-        QObject.__init__(self)
-        if s is None:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        else:
-            self.sock = s
-
-    def connectSocket(self, host, port):
-        msg = ''
-        try:
-            self.sock.connect((host, port))
-        except socket.error as errormsg:
-            msg = errormsg.strerror
-            #msg = errormsg.errno
-        return msg
-
-    def sendData(self, data):
-        size = len(data)
-        sent = False
-        totalsent = 0
-        try:
-            while totalsent < size:
-                sent = self.sock.send(data[totalsent:])
-                if sent == False:
-                    raise IOError("Socket connection broken")
-                totalsent = totalsent + sent
-            sent = True
-            msg = totalsent
-        except socket.error as errormsg:
-            #self.closeSocket()
-            sent = False
-            msg = errormsg
-        return sent, str(msg)
-
-    def isReady(self):
-        try:
-            to_read, to_write, exception = select.select([self.sock],[],[self.sock], 0)
-            #print 'r: ' + str(to_read)
-            #print 'w: ' + str(to_write)
-            #print 'x: ' + str(exception)
-            #if to_read or to_write:
-            if exception:
-                waiting = False
-            else:
-                waiting = True
-        except:
-            waiting = False
-        return waiting
-
-    def checkData(self, buff=1):
-        check = False
-        msg = ''
-        try:
-            msg = self.sock.recv(buff)
-            if msg == '':
-                check = False
-            else:
-                check = True
-        except socket.error as errormsg:
-            msg = errormsg
-            check = False
-        return check, msg
-
-    def dumpData(self, buff=1):
-        dump = False
-        msg = ''
-        try:
-            while True:
-                chunk = self.sock.recv(buff)
-                if not chunk: break
-                msg += chunk
-            dump = True
-        except socket.error as errormsg:
-            msg = errormsg
-            dump = False
-        return dump, msg
-
-    def receiveData(self, buff=1024, suffix = ''):
-        receive = False
-        msg = ''
-        try:
-            while True:
-                chunk = self.sock.recv(buff)
-                if not chunk: break
-                msg += chunk
-                if msg.endswith(suffix): break
-            receive = True
-        except socket.error as errormsg:
-            msg = errormsg
-            receive = False
-        return receive, msg
-
-    def closeSocket(self):
-        self.sock.close()
-        #self.sock = None
\ No newline at end of file
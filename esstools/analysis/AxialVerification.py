@@ -26,22 +26,18 @@ from PyQt4.QtGui import *
 from qgis.core import *
 
 from ..utility_functions import *
+from ..network_functions import *
+from SpatialiteQueryPool import *
 
 import time
 
-try:
-    import igraph as ig
-    has_igraph = True
-except ImportError, e:
-    has_igraph = False
-
 
 class AxialVerification(QThread):
     verificationFinished = pyqtSignal(dict, list)
     verificationProgress = pyqtSignal(int)
     verificationError = pyqtSignal(str)
 
-    def __init__( self, parentThread, parentObject, settings, axial, id, unlinks, links):
+    def __init__( self, parentThread, parentObject, settings, axial, id, unlinks, links, session=None):
         QThread.__init__( self, parentThread)
         self.parent = parentObject
         self.running = False
@@ -50,6 +46,7 @@ class AxialVerification(QThread):
         self.unlinks_layer = unlinks
         self.links_layer = links
         self.user_id = id
+        self.session = session
 
         # verification globals
         self.problem_nodes = []
@@ -86,6 +83,7 @@ class AxialVerification(QThread):
             # get the geometry column name and other properties
             start_time = time.time()
             geomname = self.spatialitePreparation(self.connection, axialname)
+            journal = setSpatialiteWAL(self.connection)
             print "Preparing the map: %s"%str(time.time()-start_time)
             self.verificationProgress.emit(5)
             # analyse the geometry
@@ -94,34 +92,60 @@ class AxialVerification(QThread):
             print "Analysing geometry: %s"%str(time.time()-start_time)
             self.verificationProgress.emit(80)
             # build the topology
-            if has_igraph:
-                start_time = time.time()
-                graph_links = self.spatialiteBuildTopology(self.connection, axialname, geomname, unlinkname, linkname)
-                print "Building topology: %s"%str(time.time()-start_time)
+            start_time = time.time()
+            graph_links = self.spatialiteBuildTopology(self.connection, axialname, geomname, unlinkname, linkname)
+            print "Building topology: %s"%str(time.time()-start_time)
             self.verificationProgress.emit(90)
+            resetSpatialiteJournal(self.connection, journal)
             self.connection.close()
-        #elif 'postgresql' in provider.lower():
-            # newfeature: implement for postgis specific functions
-        else:
-            # create spatial index
-            start_time = time.time()
-            index = createIndex(self.axial_layer)
-            print "Creating spatial index: %s"%str(time.time()-start_time)
+        elif 'postgresql' in provider.lower() and testPostgisSpatialIndex(self.axial_layer):
+            # get the relevant layers
+            unlinkname = ''
+            if self.unlinks_layer:
+                unlinkname = getPostgisLayerName(self.unlinks_layer)
+                if not testSameDatabase([self.unlinks_layer, self.axial_layer]):
+                    self.verificationError.emit("The map layer must be in the same database as the unlinks layer.")
+                    return
+            linkname = ''
+            if self.links_layer:
+                linkname = getPostgisLayerName(self.links_layer)
+                if not testSameDatabase([self.links_layer, self.axial_layer]):
+                    self.verificationError.emit("The map layer must be in the same database as the links layer.")
+                    return
+            axialname = getPostgisLayerName(self.axial_layer)
+            geomname = getPostgisGeometryColumn(self.axial_layer)
+            self.connection = getLayerConnection(self.axial_layer)
             self.verificationProgress.emit(5)
+            # analyse the geometry
+            start_time = time.time()
+            self.postgisTestGeometry(self.connection, axialname, geomname)
+            print "Analysing geometry: %s"%str(time.time()-start_time)
+            self.verificationProgress.emit(80)
+            # build the topology
+            start_time = time.time()
+            graph_links = self.postgisBuildTopology(self.connection, unlinkname, linkname)
+            print "Building topology: %s"%str(time.time()-start_time)
+            self.verificationProgress.emit(90)
+            self.connection.close()
+        else:
             # analyse the geometry and topology
             start_time = time.time()
-            graph_links = self.qgisGeometryTopologyTest(self.axial_layer, index, self.unlinks_layer, self.links_layer)
+            self.verificationProgress.emit(5)
+            if self.session and self.session.canUpdate(self.axial_layer, self.user_id, self.verification_settings):
+                graph_links = self.qgisUpdateTopologyTest(self.axial_layer, self.unlinks_layer, self.links_layer)
+            else:
+                graph_links = self.qgisGeometryTopologyTest(self.axial_layer, self.unlinks_layer, self.links_layer)
             print "Analysing geometry and topology: %s"%str(time.time()-start_time)
-        # analyse the topology with igraph
-        if len(graph_links) > 0 and has_igraph:
+        # analyse the topology
+        if graph_links:
             start_time = time.time()
             # get user ids
             if self.user_id == '':
                 axialids = self.axial_layer.allFeatureIds()
             else:
                 axialids = getFieldValues(self.axial_layer, self.user_id)
-            # uses igraph to test islands. look for orphans with the geometry test
-            self.igraphTestTopology(graph_links, axialids)
+            # test islands. look for orphans with the geometry test
+            self.testTopology(graph_links, axialids)
             print "Analysing topology: %s"%str(time.time()-start_time)
         self.verificationProgress.emit(100)
         # return the results
@@ -137,43 +161,36 @@ class AxialVerification(QThread):
         #self.terminate()
 
 
-    def igraphTestTopology(self, graph_links, graph_nodes):
-        # create an igraph graph object and store the axial links
-        try:
-            g = ig.Graph(graph_links)
-        except:
-            return False
-        # ideally g would be created with a list of edges based on 0 indexed and continuous vertices
-        # but sqlite rowid is 1 indexed and might have gaps as it is a unique and persistent numbering
-        # igraph adds 0 and other missing vertices, these must be identified and removed
-        to_delete = []
-        for v in g.vs:
-            if v.index not in graph_nodes:
-                to_delete.append(v.index)
-        g.delete_vertices(to_delete)
-        # deleting 0 reassigns all the indices, and creates a new 0.
-        # the vertex reference to use to identify features must be a fid attribute
-        g.vs["fid"] = graph_nodes
-        if not g.is_connected():
+    def testTopology(self, graph_links, graph_nodes):
+        # ids can be any value with gaps, the components use the row of each id instead
+        n = len(graph_nodes)
+        rows = getIdIndex(graph_nodes)
+        edges = [(rows[a], rows[b]) for a, b in graph_links if a in rows and b in rows]
+        components = getComponents(n, edges)
+        sizes = np.bincount(components, minlength=n)
+        if np.count_nonzero(sizes) > 1:
             start_time = time.time()
-            components = g.components()
-            if components.__len__ > 1:
-                giant = components.giant().vcount()
-                islands = []
-                # get vertex ids
-                for i, cluster in enumerate(components):
-                    if len(cluster) == 1:
-                        node = g.vs[cluster]['fid'][0]
-                        if node not in self.axial_errors['orphan']:
-                            self.axial_errors['orphan'].append(node)
-                            self.problem_nodes.append(node)
-                    elif len(cluster) > 1 and len(cluster) != giant:
-                        nodes = g.vs[cluster]['fid']
-                        islands.append(nodes)
-                        self.problem_nodes.extend(nodes)
-                # add results to the list of problems
-                if islands:
-                    self.axial_errors['island'] = islands
+            giant = sizes.max()
+            orphans = set(self.axial_errors['orphan'])
+            islands = []
+            # components in the order of their first node
+            order = np.argsort(components, kind='mergesort')
+            labels = components[order]
+            starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+            for cluster in np.split(order, starts[1:]):
+                if len(cluster) == 1:
+                    node = graph_nodes[cluster[0]]
+                    if node not in orphans:
+                        orphans.add(node)
+                        self.axial_errors['orphan'].append(node)
+                        self.problem_nodes.append(node)
+                elif len(cluster) != giant:
+                    nodes = [graph_nodes[row] for row in cluster.tolist()]
+                    islands.append(nodes)
+                    self.problem_nodes.extend(nodes)
+            # add results to the list of problems
+            if islands:
+                self.axial_errors['island'] = islands
             print "analyse orphans/islands: %s"%str(time.time()-start_time)
         return True
 
@@ -192,105 +209,95 @@ class AxialVerification(QThread):
 
     def spatialiteTestGeometry(self, connection, axialname, geomname):
         # this function checks the geometric validity of geometry using spatialite
+        # the checks of single lines run in parallel on read only connections, the pair checks use the temp table
         length = self.verification_settings['ax_min']
         threshold = self.verification_settings['ax_dist']
         if self.user_id == '':
             idcol = 'ROWID'
         else:
             idcol = self.user_id
+        tests = []
         # geometry is valid (generally)
-        start_time = time.time()
-        query = """SELECT "%s" FROM %s WHERE NOT ST_IsSimple(%s) OR NOT ST_IsValid(%s)"""%(idcol, axialname, geomname, geomname)
-        header, data, error = executeSpatialiteQuery(connection, query)
-        if data:
-            nodes = list(zip(*data)[0])
-            self.problem_nodes.extend(nodes)
-            self.axial_errors['invalid geometry'] = nodes
-        self.verificationProgress.emit(10)
-        print "analyse valid: %s"%str(time.time()-start_time)
+        tests.append(('invalid geometry', """SELECT "%s" FROM %s WHERE NOT ST_IsSimple(%s) OR NOT ST_IsValid(%s)"""
+                      %(idcol, axialname, geomname, geomname)))
         # geometry is polyline
-        start_time = time.time()
-        query = """SELECT "%s" FROM %s WHERE ST_NPoints(%s) <> 2 """%(idcol, axialname, geomname)
-        header, data, error = executeSpatialiteQuery(connection, query)
-        if data:
-            nodes = list(zip(*data)[0])
-            self.problem_nodes.extend(nodes)
-            self.axial_errors['polyline'] = nodes
-        self.verificationProgress.emit(15)
-        print "analyse polyline: %s"%str(time.time()-start_time)
+        tests.append(('polyline', """SELECT "%s" FROM %s WHERE ST_NPoints(%s) <> 2 """%(idcol, axialname, geomname)))
         # has two coinciding points
-        start_time = time.time()
-        query = """SELECT "%s" FROM %s WHERE ST_Equals(ST_StartPoint(%s),ST_EndPoint(%s))"""%(idcol, axialname, geomname, geomname)
-        header, data, error = executeSpatialiteQuery(connection, query)
-        if data:
-            nodes = list(zip(*data)[0])
-            self.problem_nodes.extend(nodes)
-            self.axial_errors['coinciding points'] = nodes
-        self.verificationProgress.emit(20)
-        print "analyse coinciding: %s"%str(time.time()-start_time)
+        tests.append(('coinciding points', """SELECT "%s" FROM %s WHERE ST_Equals(ST_StartPoint(%s),ST_EndPoint(%s))"""
+                      %(idcol, axialname, geomname, geomname)))
         # small lines, with small length
-        start_time = time.time()
-        query = """SELECT "%s" FROM %s WHERE ST_Length(%s)<%s"""%(idcol, axialname, geomname,length)
-        header, data, error = executeSpatialiteQuery(connection, query)
-        if data:
-            nodes = list(zip(*data)[0])
-            self.problem_nodes.extend(nodes)
-            self.axial_errors['small line'] = nodes
-        self.verificationProgress.emit(25)
-        print "analyse small: %s"%str(time.time()-start_time)
+        tests.append(('small line', """SELECT "%s" FROM %s WHERE ST_Length(%s)<%s"""%(idcol, axialname, geomname,length)))
+        pair_tests = []
         # short lines, just about touch without intersecting
-        start_time = time.time()
-        query = 'SELECT a."%s" FROM %s a, %s b WHERE a."%s" <> b."%s" AND NOT ST_Intersects(a.%s,b.%s) AND'\
-                '(PtDistWithin(ST_StartPoint(a.%s),b.%s,%s) OR PtDistWithin(ST_EndPoint(a.%s),b.%s,%s))'\
-                'AND a.ROWID IN (SELECT ROWID FROM SpatialIndex WHERE f_table_name="%s" AND search_frame=b.%s)'\
-                %(idcol, axialname, axialname, idcol, idcol, geomname, geomname, geomname, geomname, threshold,
-                  geomname, geomname, threshold, axialname, geomname)
-        header, data, error = executeSpatialiteQuery(connection, query)
-        if data:
-            nodes = list(zip(*data)[0])
-            self.problem_nodes.extend(nodes)
-            self.axial_errors['short line'] = nodes
-        self.verificationProgress.emit(35)
-        print "analyse short: %s"%str(time.time()-start_time)
+        pair_tests.append(('short line', """SELECT a_id FROM temp_axial_pairs WHERE NOT intersecting AND near"""))
         # duplicate geometry
-        start_time = time.time()
-        query = 'SELECT a."%s" FROM %s a, %s b WHERE a."%s" <> b."%s" AND ST_Equals(a.%s,b.%s)'\
-                'AND a.ROWID IN (SELECT ROWID FROM SpatialIndex WHERE f_table_name="%s" AND search_frame=b.%s)'\
-                %(idcol, axialname, axialname, idcol, idcol, geomname, geomname, axialname, geomname)
-        header, data, error = executeSpatialiteQuery(connection, query)
-        if data:
-            nodes = list(zip(*data)[0])
-            self.problem_nodes.extend(nodes)
-            self.axial_errors['duplicate geometry'] = nodes
-        self.verificationProgress.emit(40)
-        print "analyse duplicate: %s"%str(time.time()-start_time)
+        pair_tests.append(('duplicate geometry', """SELECT a_id FROM temp_axial_pairs WHERE equal"""))
         # geometry overlaps
-        start_time = time.time()
-        query = 'SELECT a."%s" FROM %s a, %s b WHERE a."%s" <> b."%s" AND NOT ST_Equals(a.%s,b.%s) AND ST_Overlaps(a.%s,b.%s)'\
-            'AND a.ROWID IN (SELECT ROWID FROM SpatialIndex WHERE f_table_name="%s" AND search_frame=b.%s)'\
-            %(idcol, axialname, axialname, idcol, idcol, geomname, geomname, geomname, geomname, axialname, geomname)
-        header, data, error = executeSpatialiteQuery(connection, query)
-        if data:
-            nodes = list(zip(*data)[0])
-            self.problem_nodes.extend(nodes)
-            self.axial_errors['overlap'] = nodes
-        self.verificationProgress.emit(60)
-        print "analyse overlap: %s"%str(time.time()-start_time)
         # the overlap function alone might be too accurate for a GIS
         # an alternative function with buffer is too slow
+        pair_tests.append(('overlap', """SELECT a_id FROM temp_axial_pairs WHERE NOT equal AND overlapping"""))
         # test for orphans
+        pair_tests.append(('orphan', """SELECT "%s" FROM %s WHERE "%s" NOT IN (SELECT a_id FROM temp_axial_pairs WHERE intersecting)"""
+                           %(idcol, axialname, idcol)))
+        names = [name for name, query in tests + pair_tests] + ['axial pairs']
+        pool = SpatialiteQueryPool(getLayerPath(self.axial_layer), names)
+        for name, query in tests:
+            pool.submit(name, query)
+        pool.start()
+        # candidate pairs of lines, from a single pass over the spatial index
         start_time = time.time()
-        query = 'SELECT "%s" FROM %s WHERE "%s" NOT IN (SELECT DISTINCT(a."%s") FROM %s a, %s b ' \
-            'WHERE a."%s" <> b."%s" AND ST_Intersects(a.%s,b.%s) '\
-            'AND a.ROWID IN (SELECT ROWID FROM SpatialIndex WHERE f_table_name="%s" AND search_frame=b.%s))'\
-            %(idcol, axialname, idcol, idcol, axialname, axialname, idcol, idcol, geomname, geomname, axialname, geomname)
-        header, data, error = executeSpatialiteQuery(connection, query)
+        self.spatialiteBuildPairs(connection, axialname, geomname, idcol, threshold)
+        self.verificationProgress.emit(5 + int(75 * pool.finish('axial pairs', time.time()-start_time)))
+        print "analyse pairs: %s"%str(time.time()-start_time)
+        for name, query in pair_tests:
+            start_time = time.time()
+            header, data, error = executeSpatialiteQuery(connection, query)
+            self.addSpatialiteErrors(name, data)
+            self.verificationProgress.emit(5 + int(75 * pool.finish(name, time.time()-start_time)))
+            print "analyse %s: %s"%(name, str(time.time()-start_time))
+        queries = dict(tests)
+        for name, header, data, error in pool.getResults():
+            if error:
+                # the check failed in the pool, run it again on this connection, which reports its errors
+                print "analyse %s failed: %s" % (name, error)
+                header, data, error = executeSpatialiteQuery(connection, queries[name])
+            self.addSpatialiteErrors(name, data)
+            self.verificationProgress.emit(5 + int(75 * pool.getProgress()))
+            print "analyse %s: %s"%(name, str(pool.costs[name]))
+        self.verificationProgress.emit(80)
+
+    def addSpatialiteErrors(self, error, data):
         if data:
             nodes = list(zip(*data)[0])
             self.problem_nodes.extend(nodes)
-            self.axial_errors['orphan'] = nodes
-        print "analyse orphans: %s"%str(time.time()-start_time)
-        self.verificationProgress.emit(80)
+            self.axial_errors[error] = nodes
+
+    def spatialiteBuildPairs(self, connection, axialname, geomname, idcol, threshold):
+        # this function stores every pair of lines with bounding boxes within the threshold distance,
+        # and the result of all the pairwise tests, so that the spatial index is only queried once
+        pairsname = "temp_axial_pairs"
+        header, data, error = executeSpatialiteQuery(connection,"""DROP TABLE IF EXISTS "%s" """ % pairsname)
+        if threshold > 0:
+            frame = 'BuildMbr(MbrMinX(b.%s)-%s, MbrMinY(b.%s)-%s, MbrMaxX(b.%s)+%s, MbrMaxY(b.%s)+%s)'\
+                    %(geomname, threshold, geomname, threshold, geomname, threshold, geomname, threshold)
+            near = '(PtDistWithin(ST_StartPoint(a_geom),b_geom,%s) OR PtDistWithin(ST_EndPoint(a_geom),b_geom,%s))'\
+                   %(threshold, threshold)
+        else:
+            frame = 'b.%s' % geomname
+            near = '0'
+        query = 'CREATE TEMP TABLE %s AS SELECT a_id, b_id, intersecting, '\
+                'CASE WHEN intersecting THEN ST_Equals(a_geom,b_geom) ELSE 0 END AS equal, '\
+                'CASE WHEN intersecting THEN ST_Overlaps(a_geom,b_geom) ELSE 0 END AS overlapping, '\
+                'CASE WHEN intersecting THEN 0 ELSE %s END AS near '\
+                'FROM (SELECT a."%s" a_id, b."%s" b_id, a.%s a_geom, b.%s b_geom, ST_Intersects(a.%s,b.%s) intersecting '\
+                'FROM %s a, %s b WHERE a."%s" <> b."%s" '\
+                'AND a.ROWID IN (SELECT ROWID FROM SpatialIndex WHERE f_table_name="%s" AND search_frame=%s))'\
+                %(pairsname, near, idcol, idcol, geomname, geomname, geomname, geomname, axialname, axialname,
+                  idcol, idcol, axialname, frame)
+        header, data, error = executeSpatialiteQuery(connection, query, commit=True)
+        query = """CREATE INDEX "%s_a_id" ON %s (a_id)"""%(pairsname, pairsname)
+        header, data, error = executeSpatialiteQuery(connection, query, commit=True)
+        return pairsname
 
     def spatialiteBuildTopology(self, connection, axialname, geomname, unlinkname, linkname):
         # this function builds the axial map topology using spatialite. it's much faster.
@@ -305,25 +312,33 @@ class AxialVerification(QThread):
         # create a new temporary table
         query = """CREATE TEMP TABLE %s (pk_id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, a_fid INTEGER, b_fid INTEGER)"""%(graphname)
         header, data, error = executeSpatialiteQuery(connection, query)
-        # calculate edges from intersecting feature pairs
-        query = 'INSERT INTO %s (a_fid, b_fid) SELECT DISTINCT CASE WHEN a."%s" < b."%s" THEN a."%s" ELSE b."%s" END AS least_col, '\
-                'CASE WHEN a."%s" > b."%s" THEN a."%s" ELSE b."%s" END AS greatest_col '\
-                'FROM %s a, %s b WHERE a."%s" <> b."%s" AND Intersects(a.%s,b.%s) '\
-                'AND a.ROWID IN (SELECT ROWID FROM SpatialIndex WHERE f_table_name="%s" AND search_frame=b.%s)'\
-                %(graphname, idcol, idcol, idcol, idcol, idcol, idcol, idcol, idcol, axialname, axialname, idcol, idcol,
-                  geomname, geomname, axialname, geomname)
+        # calculate edges from intersecting feature pairs, found while testing the geometry
+        query = 'INSERT INTO %s (a_fid, b_fid) SELECT DISTINCT CASE WHEN a_id < b_id THEN a_id ELSE b_id END AS least_col, '\
+                'CASE WHEN a_id > b_id THEN a_id ELSE b_id END AS greatest_col '\
+                'FROM temp_axial_pairs WHERE intersecting'%(graphname)
         header, data, error = executeSpatialiteQuery(connection, query, commit=True)
         print "Building the graph: %s"%str(time.time()-start_time)
+        # the edges are (least, greatest) pairs, indexed to join with the unlinks and links
+        query = 'CREATE INDEX "%s_pair" ON %s (a_fid, b_fid)'%(graphname, graphname)
+        header, data, error = executeSpatialiteQuery(connection, query)
         # eliminate unlinks
         if unlinkname:
             if fieldExists(getLayerByName(unlinkname),'line1') and fieldExists(getLayerByName(unlinkname),'line2'):
                 start_time = time.time()
-                query = 'DELETE FROM %s WHERE cast(a_fid as text)||"_"||cast(b_fid as text) in (SELECT cast(line1 as text)||"_"||cast(line2 as text) FROM %s)'\
-                        'OR cast(b_fid as text)||"_"||cast(a_fid as text) in (SELECT cast(line1 as text)||"_"||cast(line2 as text) FROM %s)'\
-                        %(graphname, unlinkname, unlinkname)
+                pairsname = createSpatialiteLinePairs(connection, "temp_axial_unlinks", unlinkname)
+                query = 'DELETE FROM %s WHERE EXISTS (SELECT 1 FROM %s u WHERE u.a_fid = %s.a_fid AND u.b_fid = %s.b_fid)'\
+                        %(graphname, pairsname, graphname, graphname)
                 header, data, error = executeSpatialiteQuery(connection, query, commit=True)
                 print "Unlinking the graph: %s"%str(time.time()-start_time)
-        # newfeature: implement inserting links
+        # add the links, once per pair of lines
+        if linkname:
+            if fieldExists(getLayerByName(linkname),'line1') and fieldExists(getLayerByName(linkname),'line2'):
+                start_time = time.time()
+                pairsname = createSpatialiteLinePairs(connection, "temp_axial_links", linkname)
+                query = 'INSERT INTO %s (a_fid, b_fid) SELECT l.a_fid, l.b_fid FROM %s l WHERE l.a_fid <> l.b_fid AND NOT EXISTS '\
+                        '(SELECT 1 FROM %s g WHERE g.a_fid = l.a_fid AND g.b_fid = l.b_fid)'%(graphname, pairsname, graphname)
+                header, data, error = executeSpatialiteQuery(connection, query, commit=True)
+                print "Linking the graph: %s"%str(time.time()-start_time)
         # return all the links to build the graph
         query = """SELECT a_fid, b_fid FROM %s"""%(graphname)
         header, data, error = executeSpatialiteQuery(connection, query)
@@ -332,124 +347,443 @@ class AxialVerification(QThread):
 
     # QGIS based functions
     #
-    def qgisGeometryTopologyTest(self, axial, index, unlinks, links):
-        # this function checks the geometric validity of geometry using QGIS
-        length = self.verification_settings['ax_min']
+    def qgisGeometryTopologyTest(self, axial, unlinks, links):
+        # this function checks the geometric validity of geometry and builds the topology using numpy
+        threshold = self.verification_settings['ax_dist']
+        if self.session:
+            # edits made from now on are picked up by the next verification
+            self.session.takeEdits()
+        # read all the geometry once
+        lines = self.qgisGetAxialGeometry(axial)
+        if len(lines['ids']) == 0:
+            return []
+        self.verificationProgress.emit(30)
+        # the pairs of an unchanged map are read from the topology cache
+        path = getCachePath('topology')
+        key = getContentKey('axial pairs', lines['vertices'], lines['vptr'], lines['owners'], float(threshold))
+        pairs = loadTopology(path, key)
+        if pairs is None:
+            pairs = self.qgisTestPairs(lines, threshold)
+            saveTopology(path, key, pairs)
+        self.verificationProgress.emit(75)
+        if self.session:
+            self.session.store(axial, self.user_id, self.verification_settings, lines, pairs)
+        return self.qgisReportErrors(lines, pairs, unlinks, links)
+
+    def qgisUpdateTopologyTest(self, axial, unlinks, links):
+        # this function tests again only the lines edited since the last verification, and the lines near them
         threshold = self.verification_settings['ax_dist']
-        axial_links = []
-        unlinks_list = []
-        links_list = []
-        # get unlinks pairs
-        if unlinks:
-            if fieldExists(unlinks,'line1') and fieldExists(unlinks,'line2'):
-                features = unlinks.getFeatures(QgsFeatureRequest().setSubsetOfAttributes(['line1','line2'],unlinks.pendingFields()))
-                for feature in features:
-                    unlinks_list.append((feature.attribute('line1'),feature.attribute('line2')))
-        # get links pairs
-        if links:
-            features = links.getFeatures(QgsFeatureRequest().setSubsetOfAttributes(['line1','line2'],links.pendingFields()))
-            for feature in features:
-                links_list.append((feature.attribute('line1'),feature.attribute('line2')))
+        edited = self.session.takeEdits()
+        if edited:
+            self.session.removeLines(edited)
+            # read the edited lines that still exist
+            lines = self.qgisGetAxialGeometry(axial, edited)
+            self.session.addLines(lines)
+            self.verificationProgress.emit(30)
+            subset, active = self.session.getNeighbourLines(edited, threshold)
+            if active.any():
+                pairs = self.qgisTestPairs(subset, threshold, active)
+                self.session.addPairs(subset['fids'], pairs)
+        self.verificationProgress.emit(75)
+        lines = self.session.lines
+        return self.qgisReportErrors(lines, self.session.getPairs(), unlinks, links)
+
+    def qgisGetAxialGeometry(self, axial, fids=None):
+        # read the id, validity and vertices of every line with a single request
+        # lines are returned as packed arrays, with a vertex and segment pointer per line
+        lines = {'fids': [], 'ids': [], 'invalid': [], 'npoints': []}
+        counts = []
+        vertices = []
+        starts = []
+        owners = []
         if self.user_id == '':
-            features = axial.getFeatures(QgsFeatureRequest().setSubsetOfAttributes([]))
+            request = QgsFeatureRequest().setSubsetOfAttributes([])
         else:
-            field = getFieldIndex(axial, self.user_id)
-            features = axial.getFeatures(QgsFeatureRequest().setSubsetOfAttributes([field]))
-        steps = 85.0/float(axial.featureCount())
-        progress = 5.0
-        start_buff = QgsGeometry()
-        end_buff = QgsGeometry()
-        for i, feature in enumerate(features):
-            #row = i+1
-            has_problem = False
+            request = QgsFeatureRequest().setSubsetOfAttributes([getFieldIndex(axial, self.user_id)])
+        if fids is not None:
+            request.setFilterFids(list(fids))
+        for feature in axial.getFeatures(request):
             geom = feature.geometry()
+            lines['fids'].append(feature.id())
             if self.user_id == '':
-                id = feature.id()
+                lines['ids'].append(feature.id())
             else:
-                id = feature.attribute(self.user_id)
-            # geometry is valid (generally)
-            if not geom.isGeosValid() or geom.isGeosEmpty():
-                has_problem = True
-                self.axial_errors['invalid geometry'].append(id)
-            # geometry is polyline
-            if len(geom.asPolyline()) > 2:
-                has_problem = True
-                self.axial_errors['polyline'].append(id)
-            # has two coinciding points
-            if geom.length() == 0:
-                has_problem = True
-                self.axial_errors['coinciding points'].append(id)
-            # small lines, with small length
-            if geom.length() < length:
-                has_problem = True
-                self.axial_errors['small line'].append(id)
-            # testing against other lines in the layer
-            buff = None
-            if threshold > 0:
-                start_buff = QgsGeometry.fromPoint(geom.asPolyline()[0]).buffer(threshold,4)
-                end_buff = QgsGeometry.fromPoint(geom.asPolyline()[1]).buffer(threshold,4)
-                buff = geom.buffer(threshold,4)
-                box = buff.boundingBox()
+                lines['ids'].append(feature.attribute(self.user_id))
+            row = len(counts)
+            if geom is None:
+                lines['invalid'].append(True)
+                lines['npoints'].append(0)
+                counts.append(0)
+                continue
+            lines['invalid'].append(not geom.isGeosValid() or geom.isGeosEmpty())
+            lines['npoints'].append(len(geom.asPolyline()))
+            if geom.isMultipart():
+                parts = geom.asMultiPolyline()
             else:
-                box = geom.boundingBox()
-            request = QgsFeatureRequest()
-            if index:
-                # should be faster to retrieve from index (if available)
-                ints = index.intersects(box)
-                request.setFilterFids(ints)
-            else:
-                # can retrieve objects using bounding box
-                request.setFilterRect(box)
-            if self.user_id == '':
-                request.setSubsetOfAttributes([])
-            else:
-                field = getFieldIndex(axial, self.user_id)
-                request.setSubsetOfAttributes([field])
-            targets = axial.getFeatures(request)
-            orphan = True
-            for target in targets:
-                geom_b = target.geometry()
-                if self.user_id == '':
-                    id_b = target.id()
-                else:
-                    id_b = target.attribute(self.user_id)
-                if not id_b == id:
-                    # duplicate geometry
-                    if geom.isGeosEqual(geom_b):
-                        has_problem = True
-                        self.axial_errors['duplicate geometry'].append(id)
-                    # geometry overlaps
-                    if geom.overlaps(geom_b):
-                        has_problem = True
-                        self.axial_errors['overlap'].append(id)
-                    # short lines, just about touch without intersecting
-                    if (geom_b.intersects(start_buff) or geom_b.intersects(end_buff)) and not geom_b.intersects(geom):
-                        has_problem = True
-                        self.axial_errors['short line'].append(id)
-                    if geom.intersects(geom_b):
-                        # check if in the unlinks
-                        if (id,id_b) not in unlinks_list and (id_b,id) not in unlinks_list:
-                            # build the topology
-                            if has_igraph:
-                                #axial_links.append((convertNumeric(id),convertNumeric(id_b)))
-                                axial_links.append((id,id_b))
-                            # test orphans
-                            if orphan:
-                                orphan = False
-            if orphan:
-                has_problem = True
-                self.axial_errors['orphan'].append(id)
-            if has_problem:
-                self.problem_nodes.append(id)
-            progress += steps
-            self.verificationProgress.emit(int(progress))
+                parts = [geom.asPolyline()]
+            count = 0
+            for part in parts:
+                # segments join consecutive vertices of the same part
+                first = len(vertices)
+                starts.extend(xrange(first, first + len(part) - 1))
+                owners.extend([row] * (len(part) - 1))
+                vertices.extend((point.x(), point.y()) for point in part)
+                count += len(part)
+            counts.append(count)
+        lines['fids'] = np.array(lines['fids'], dtype=np.int64)
+        lines['invalid'] = np.array(lines['invalid'], dtype=bool)
+        lines['npoints'] = np.array(lines['npoints'], dtype=np.int64)
+        lines['vptr'] = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=lines['vptr'][1:])
+        lines['vertices'] = np.array(vertices, dtype=np.float64).reshape(-1, 2)
+        starts = np.array(starts, dtype=np.int64)
+        lines['segments'] = np.hstack((lines['vertices'][starts], lines['vertices'][starts + 1]))
+        lines['owners'] = np.array(owners, dtype=np.int64)
+        seg_lengths = np.hypot(lines['segments'][:, 2] - lines['segments'][:, 0],
+                               lines['segments'][:, 3] - lines['segments'][:, 1])
+        lines['lengths'] = np.bincount(lines['owners'], weights=seg_lengths, minlength=len(counts))
+        return lines
+
+    def qgisTestPairs(self, lines, threshold, active=None):
+        # test every pair of lines within the threshold distance, or only the pairs with an active line
+        # returns arrays (E,2) of line rows
+        n = len(lines['ids'])
+        vertices = lines['vertices']
+        vptr = lines['vptr']
+        segments = lines['segments']
+        owners = lines['owners']
+        # find the segments of other lines within the threshold distance, using a sweep line index
+        seg_a, seg_b, dist = getSegmentPairs(segments, owners, max(threshold, 0.0))
+        if active is not None:
+            keep = active[owners[seg_a]] | active[owners[seg_b]]
+            seg_a = seg_a[keep]
+            seg_b = seg_b[keep]
+            dist = dist[keep]
+        touch = dist == 0
+        keys = np.unique(getEdgeKeys(n, np.column_stack((owners[seg_a[touch]], owners[seg_b[touch]]))))
+        intersects = np.column_stack((keys // n, keys % n))
+        # duplicate geometry
+        duplicates = intersects[testEqualLines(vertices, vptr, intersects)]
+        # geometry overlaps, when the shared length is less than the length of both lines
+        shared = getCollinearOverlaps(segments[seg_a[touch]], segments[seg_b[touch]])
+        overlap_keys = getEdgeKeys(n, np.column_stack((owners[seg_a[touch]], owners[seg_b[touch]])))
+        overlap_keys, inverse = np.unique(overlap_keys[shared > 0], return_inverse=True)
+        shared = np.bincount(inverse, weights=shared[shared > 0])
+        overlaps = np.column_stack((overlap_keys // n, overlap_keys % n))
+        lengths = lines['lengths']
+        margin = 1e-9 * np.maximum(lengths[overlaps[:, 0]], lengths[overlaps[:, 1]])
+        partial = (shared < lengths[overlaps[:, 0]] - margin) & (shared < lengths[overlaps[:, 1]] - margin)
+        overlaps = overlaps[partial]
+        # short lines, just about touch without intersecting
+        short = np.zeros((0, 2), dtype=np.int64)
+        if threshold > 0:
+            short = []
+            for near_a, near_b in ((seg_a, seg_b), (seg_b, seg_a)):
+                line = owners[near_a]
+                ends = np.minimum(
+                    getPointSegmentDistance(vertices[vptr[line]], segments[near_b]),
+                    getPointSegmentDistance(vertices[vptr[line + 1] - 1], segments[near_b]))
+                short.append(np.column_stack((line, owners[near_b]))[ends <= threshold])
+            short = np.vstack(short)
+            short = short[~np.in1d(getEdgeKeys(n, short), keys)]
+            short = np.unique(short[:, 0] * n + short[:, 1])
+            short = np.column_stack((short // n, short % n))
+        return {'intersects': intersects, 'duplicates': duplicates, 'overlaps': overlaps, 'short': short}
+
+    def qgisReportErrors(self, lines, pairs, unlinks, links):
+        # add the errors of every line, returns the topology links
+        length = self.verification_settings['ax_min']
+        ids = lines['ids']
+        n = len(ids)
+        if n == 0:
+            return []
+        # geometry is valid (generally)
+        self.addAxialErrors('invalid geometry', ids, np.flatnonzero(lines['invalid']))
+        # geometry is polyline
+        self.addAxialErrors('polyline', ids, np.flatnonzero(lines['npoints'] > 2))
+        # has two coinciding points
+        self.addAxialErrors('coinciding points', ids, np.flatnonzero(lines['lengths'] == 0))
+        # small lines, with small length
+        self.addAxialErrors('small line', ids, np.flatnonzero(lines['lengths'] < length))
+        # pairs of lines
+        self.addAxialErrors('duplicate geometry', ids, pairs['duplicates'].ravel())
+        self.addAxialErrors('overlap', ids, pairs['overlaps'].ravel())
+        self.addAxialErrors('short line', ids, pairs['short'][:, 0])
+        # remove the unlinks and add the links, as sets of integer edge keys
+        rows = getIdIndex(ids)
+        intersects = updateEdges(n, pairs['intersects'], getLinePairs(unlinks, rows), getLinePairs(links, rows))
+        # build the topology
+        axial_links = [(ids[a], ids[b]) for a, b in intersects.tolist()]
+        # test orphans
+        orphans = np.ones(n, dtype=bool)
+        orphans[intersects.ravel()] = False
+        self.addAxialErrors('orphan', ids, np.flatnonzero(orphans))
+        self.verificationProgress.emit(90)
         return axial_links
 
+    def addAxialErrors(self, error, ids, rows):
+        # add the ids of the lines in rows to the error, once per row
+        nodes = [ids[row] for row in np.sort(rows).tolist()]
+        self.axial_errors[error].extend(nodes)
+        self.problem_nodes.extend(nodes)
+
     # PostGIS based functions
     #
-    def postgisTestGeometry(self):
-        # newfeature: support postgis axial verification
-        pass
+    def postgisTestGeometry(self, connection, axialname, geomname):
+        # this function checks the geometric validity of geometry in the database, only the ids are returned
+        length = self.verification_settings['ax_min']
+        threshold = self.verification_settings['ax_dist']
+        if self.user_id == '':
+            idcol = getPostgisKeyColumn(self.axial_layer)
+        else:
+            idcol = self.user_id
+        tests = []
+        # geometry is valid (generally)
+        tests.append(('invalid geometry', """SELECT "%s" FROM %s WHERE NOT ST_IsSimple("%s") OR NOT ST_IsValid("%s")"""
+                      %(idcol, axialname, geomname, geomname)))
+        # geometry is polyline
+        tests.append(('polyline', """SELECT "%s" FROM %s WHERE ST_NPoints("%s") <> 2"""%(idcol, axialname, geomname)))
+        # has two coinciding points
+        tests.append(('coinciding points', """SELECT "%s" FROM %s WHERE ST_Equals(ST_StartPoint("%s"),ST_EndPoint("%s"))"""
+                      %(idcol, axialname, geomname, geomname)))
+        # small lines, with small length
+        tests.append(('small line', """SELECT "%s" FROM %s WHERE ST_Length("%s") < %s"""%(idcol, axialname, geomname, length)))
+        progress = 5
+        for error, query in tests:
+            start_time = time.time()
+            header, data, error_text = executePostgisQuery(connection, query)
+            if data:
+                nodes = list(zip(*data)[0])
+                self.problem_nodes.extend(nodes)
+                self.axial_errors[error] = nodes
+            progress += 5
+            self.verificationProgress.emit(progress)
+            print "analyse %s: %s"%(error, str(time.time()-start_time))
+        # candidate pairs of lines, from a single join using the spatial index
+        start_time = time.time()
+        self.postgisBuildPairs(connection, axialname, geomname, idcol, threshold)
+        self.verificationProgress.emit(45)
+        print "analyse pairs: %s"%str(time.time()-start_time)
+        tests = []
+        # short lines, just about touch without intersecting
+        tests.append(('short line', """SELECT a_id FROM temp_axial_pairs WHERE NOT intersecting AND near"""))
+        # duplicate geometry
+        tests.append(('duplicate geometry', """SELECT a_id FROM temp_axial_pairs WHERE equal"""))
+        # geometry overlaps
+        tests.append(('overlap', """SELECT a_id FROM temp_axial_pairs WHERE NOT equal AND overlapping"""))
+        # orphans
+        tests.append(('orphan', 'SELECT "%s" FROM %s a WHERE NOT EXISTS '\
+                      '(SELECT 1 FROM temp_axial_pairs p WHERE p.intersecting AND p.a_id = a."%s")'%(idcol, axialname, idcol)))
+        for error, query in tests:
+            start_time = time.time()
+            header, data, error_text = executePostgisQuery(connection, query)
+            if data:
+                nodes = list(zip(*data)[0])
+                self.problem_nodes.extend(nodes)
+                self.axial_errors[error] = nodes
+            progress += 8
+            self.verificationProgress.emit(progress)
+            print "analyse %s: %s"%(error, str(time.time()-start_time))
+        self.verificationProgress.emit(80)
+
+    def postgisBuildPairs(self, connection, axialname, geomname, idcol, threshold):
+        # this function stores every pair of lines within the threshold distance, with all the pairwise tests.
+        # ST_DWithin uses the GiST index of the geometry
+        pairsname = "temp_axial_pairs"
+        header, data, error = executePostgisQuery(connection, """DROP TABLE IF EXISTS pg_temp."%s" """ % pairsname)
+        if threshold > 0:
+            near = '(ST_DWithin(ST_StartPoint(a_geom),b_geom,%s) OR ST_DWithin(ST_EndPoint(a_geom),b_geom,%s))'\
+                   %(threshold, threshold)
+        else:
+            near = 'false'
+        query = 'CREATE TEMP TABLE %s AS SELECT a_id, b_id, intersecting, '\
+                'CASE WHEN intersecting THEN ST_Equals(a_geom,b_geom) ELSE false END AS equal, '\
+                'CASE WHEN intersecting THEN ST_Overlaps(a_geom,b_geom) ELSE false END AS overlapping, '\
+                'CASE WHEN intersecting THEN false ELSE %s END AS near '\
+                'FROM (SELECT a."%s" a_id, b."%s" b_id, a."%s" a_geom, b."%s" b_geom, ST_Intersects(a."%s",b."%s") intersecting '\
+                'FROM %s a JOIN %s b ON ST_DWithin(a."%s",b."%s",%s) AND a."%s" <> b."%s") pairs'\
+                %(pairsname, near, idcol, idcol, geomname, geomname, geomname, geomname, axialname, axialname,
+                  geomname, geomname, max(threshold, 0), idcol, idcol)
+        header, data, error = executePostgisQuery(connection, query, commit=True)
+        query = """CREATE INDEX ON %s (a_id)"""%(pairsname)
+        header, data, error = executePostgisQuery(connection, query, commit=True)
+        return pairsname
+
+    def postgisBuildTopology(self, connection, unlinkname, linkname):
+        # this function returns the axial map topology from the intersecting pairs, without the unlinks and with the links.
+        # only the pairs of ids are returned
+        if unlinkname and fieldExists(self.unlinks_layer,'line1') and fieldExists(self.unlinks_layer,'line2'):
+            unlinks = 'AND NOT EXISTS (SELECT 1 FROM %s u WHERE (u.line1 = a_id AND u.line2 = b_id) '\
+                      'OR (u.line1 = b_id AND u.line2 = a_id))'%(unlinkname)
+        else:
+            unlinks = ''
+        if linkname and fieldExists(self.links_layer,'line1') and fieldExists(self.links_layer,'line2'):
+            # union removes the links between lines that are already joined
+            links = 'UNION SELECT LEAST(line1, line2), GREATEST(line1, line2) FROM %s '\
+                    'WHERE line1 IS NOT NULL AND line2 IS NOT NULL AND line1 <> line2'%(linkname)
+        else:
+            links = ''
+        query = 'SELECT DISTINCT LEAST(a_id, b_id), GREATEST(a_id, b_id) FROM temp_axial_pairs '\
+                'WHERE intersecting %s %s'%(unlinks, links)
+        header, data, error = executePostgisQuery(connection, query)
+        return data
+
+
+# keeps the lines and pair tests of the last verification of an axial layer,
+# and the features edited since then, to verify again only the edited lines
+class AxialVerificationSession(QObject):
+
+    def __init__(self, parent=None):
+        QObject.__init__(self, parent)
+        self.layer = None
+        self.user_id = ''
+        self.settings = None
+        self.lines = None
+        self.pairs = None
+        self.edited = set()
+        self.restructured = False
+
+    def watchLayer(self, layer):
+        # follow the edits of the layer, the results of another layer are discarded
+        if layer is self.layer:
+            return
+        self.unwatchLayer()
+        self.layer = layer
+        if layer:
+            layer.featureAdded.connect(self.addFeature)
+            layer.featureDeleted.connect(self.addFeature)
+            layer.geometryChanged.connect(self.editFeature)
+            layer.attributeValueChanged.connect(self.editFeature)
+            layer.editingStopped.connect(self.stopEditing)
+
+    def unwatchLayer(self):
+        if self.layer:
+            try:
+                self.layer.featureAdded.disconnect(self.addFeature)
+                self.layer.featureDeleted.disconnect(self.addFeature)
+                self.layer.geometryChanged.disconnect(self.editFeature)
+                self.layer.attributeValueChanged.disconnect(self.editFeature)
+                self.layer.editingStopped.disconnect(self.stopEditing)
+            except:
+                pass
+        self.layer = None
+        self.reset()
+
+    def reset(self):
+        self.lines = None
+        self.pairs = None
+        self.edited = set()
+        self.restructured = False
+
+    def editFeature(self, fid, *args):
+        self.edited.add(fid)
+
+    def addFeature(self, fid):
+        # added and deleted features can change the feature ids when saved
+        self.edited.add(fid)
+        self.restructured = True
+
+    def stopEditing(self):
+        if self.restructured:
+            self.reset()
+
+    def canUpdate(self, layer, user_id, settings):
+        # the stored results can be updated if they are from the same layer and settings, with few edits
+        if self.lines is None or layer is not self.layer or user_id != self.user_id:
+            return False
+        if settings['ax_min'] != self.settings['ax_min'] or settings['ax_dist'] != self.settings['ax_dist']:
+            return False
+        return len(self.edited) <= max(100, len(self.lines['ids']) / 10)
+
+    def takeEdits(self):
+        edited = self.edited
+        self.edited = set()
+        return edited
+
+    def store(self, layer, user_id, settings, lines, pairs):
+        # pairs are stored with feature ids, as the rows change with every update
+        self.user_id = user_id
+        self.settings = dict(settings)
+        self.lines = lines
+        self.pairs = dict((k, lines['fids'][v].reshape(-1, 2)) for k, v in pairs.iteritems())
+
+    def removeLines(self, fids):
+        fids = np.array(list(fids), dtype=np.int64)
+        self.lines = self.getLines(np.flatnonzero(~np.in1d(self.lines['fids'], fids)))
+        for k, v in self.pairs.iteritems():
+            self.pairs[k] = v[~(np.in1d(v[:, 0], fids) | np.in1d(v[:, 1], fids))]
+
+    def addLines(self, lines):
+        old = self.lines
+        n = len(old['ids'])
+        self.lines = {'fids': np.concatenate((old['fids'], lines['fids'])),
+                      'ids': old['ids'] + lines['ids'],
+                      'invalid': np.concatenate((old['invalid'], lines['invalid'])),
+                      'npoints': np.concatenate((old['npoints'], lines['npoints'])),
+                      'lengths': np.concatenate((old['lengths'], lines['lengths'])),
+                      'vertices': np.vstack((old['vertices'], lines['vertices'])),
+                      'vptr': np.concatenate((old['vptr'], lines['vptr'][1:] + old['vptr'][-1])),
+                      'segments': np.vstack((old['segments'], lines['segments'])),
+                      'owners': np.concatenate((old['owners'], lines['owners'] + n))}
+
+    def getLines(self, rows):
+        # packed arrays of the lines in rows, in increasing order
+        lines = self.lines
+        rows = np.asarray(rows, dtype=np.int64)
+        counts = np.diff(lines['vptr'])[rows]
+        vptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=vptr[1:])
+        offset = np.arange(vptr[-1]) - np.repeat(vptr[:-1], counts)
+        remap = np.empty(len(lines['ids']), dtype=np.int64)
+        remap.fill(-1)
+        remap[rows] = np.arange(len(rows))
+        owners = remap[lines['owners']]
+        keep = owners >= 0
+        return {'fids': lines['fids'][rows],
+                'ids': [lines['ids'][row] for row in rows.tolist()],
+                'invalid': lines['invalid'][rows],
+                'npoints': lines['npoints'][rows],
+                'lengths': lines['lengths'][rows],
+                'vertices': lines['vertices'][np.repeat(lines['vptr'][rows], counts) + offset].reshape(-1, 2),
+                'vptr': vptr,
+                'segments': lines['segments'][keep].reshape(-1, 4),
+                'owners': owners[keep]}
+
+    def getNeighbourLines(self, fids, threshold):
+        # the edited lines and the lines with bounding boxes within the threshold distance
+        # returns their packed arrays and which of them are edited
+        lines = self.lines
+        n = len(lines['ids'])
+        segments = lines['segments']
+        owners = lines['owners']
+        xmin = np.empty(n)
+        ymin = np.empty(n)
+        xmin.fill(np.inf)
+        ymin.fill(np.inf)
+        xmax = -xmin
+        ymax = -ymin
+        np.minimum.at(xmin, owners, np.minimum(segments[:, 0], segments[:, 2]))
+        np.minimum.at(ymin, owners, np.minimum(segments[:, 1], segments[:, 3]))
+        np.maximum.at(xmax, owners, np.maximum(segments[:, 0], segments[:, 2]))
+        np.maximum.at(ymax, owners, np.maximum(segments[:, 1], segments[:, 3]))
+        edited = np.in1d(lines['fids'], np.array(list(fids), dtype=np.int64))
+        near = edited.copy()
+        threshold = max(threshold, 0.0)
+        for row in np.flatnonzero(edited).tolist():
+            near |= (xmin <= xmax[row] + threshold) & (xmax >= xmin[row] - threshold) & \
+                    (ymin <= ymax[row] + threshold) & (ymax >= ymin[row] - threshold)
+        rows = np.flatnonzero(near)
+        return self.getLines(rows), edited[rows]
+
+    def addPairs(self, fids, pairs):
+        for k, v in pairs.iteritems():
+            self.pairs[k] = np.vstack((self.pairs[k], fids[v].reshape(-1, 2)))
 
-    def postgisBuildTopology(self):
-        pass
+    def getPairs(self):
+        # pairs of rows of the current lines
+        fids = self.lines['fids']
+        order = np.argsort(fids)
+        rows = {}
+        for k, v in self.pairs.iteritems():
+            rows[k] = order[np.searchsorted(fids[order], v)].reshape(-1, 2)
+        return rows
@@ -51,4 +51,7 @@ class DepthmapAdvancedDialog(QtGui.QDialog, Ui_DepthmapAdvancedDialog):
         self.axialCalculateFullCheck.setChecked(onoff)
 
     def setCalculateChoice(self,onoff):
-        self.axialCalculateChoiceCheck.setChecked(onoff)
\ No newline at end of file
+        self.axialCalculateChoiceCheck.setChecked(onoff)
+
+    def setAnalysisEngine(self, idx):
+        self.axialEngineCombo.setCurrentIndex(idx)
\ No newline at end of file
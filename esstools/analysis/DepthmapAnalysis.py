@@ -25,9 +25,10 @@ from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 from qgis.core import *
 
-import math
+from array import array
 
 from ..utility_functions import *
+from ..network_functions import calcNormalisedSegment
 
 class DepthmapAnalysis(QObject):
 
@@ -80,6 +81,8 @@ class DepthmapAnalysis(QObject):
         # look for user defined ID
         self.user_id = getIdField(self.axial_layer)
         axial_data = self.prepareAxialMap(self.user_id, weight_by)
+        if not axial_data:
+            return ''
         if self.unlinks_layer:
             unlinks_data = self.prepareUnlinks()
         else:
@@ -115,7 +118,7 @@ class DepthmapAnalysis(QObject):
                 footer += "acp.unlinkid:-1\n"
                 footer += "acp.unlinks:" + str(unlinks_data) + "\n"
             footer += "--end--\n"
-            command = header + axial_data + footer
+            command = [header] + axial_data + [footer]
         # segment analysis settings
         elif self.settings['type'] == 1:
             footer = "--layer--\ntype:3\n"
@@ -144,48 +147,25 @@ class DepthmapAnalysis(QObject):
                 footer += "acp.unlinkid:-1\n"
                 footer += "acp.unlinks:" + str(unlinks_data) + "\n"
             footer += "--end--\n"
-            command = header + axial_data + footer
+            command = [header] + axial_data + [footer]
         elif self.settings['type'] == 2:
             command = ''
         return command
 
     def prepareAxialMap(self, ref='', weight=''):
-        axial_data = ''
+        # the export is a list of text chunks, to be sent to depthmapX one by one
         try:
-            features = self.axial_layer.getFeatures()
             defaults = [""]
             if self.settings['type'] == 0:
                 defaults.extend(self.axial_default)
             elif self.settings['type'] == 1:
                 defaults.extend(self.segment_default)
-            if ref != '':
-                if weight not in defaults:
-                    for f in features:
-                        axial_data += str(f.attribute(ref)) + "\t"
-                        axial_data += str(f.geometry().vertexAt(0).x()) + "\t" + str(f.geometry().vertexAt(0).y()) + "\t"
-                        axial_data += str(f.geometry().vertexAt(1).x()) + "\t" + str(f.geometry().vertexAt(1).y()) + "\t"
-                        axial_data += str(f.attribute(weight)) + "\n"
-                else:
-                    for f in features:
-                        axial_data += str(f.attribute(ref)) + "\t"
-                        axial_data += str(f.geometry().vertexAt(0).x()) + "\t" + str(f.geometry().vertexAt(0).y()) + "\t"
-                        axial_data += str(f.geometry().vertexAt(1).x()) + "\t" + str(f.geometry().vertexAt(1).y()) + "\n"
-            else:
-                if weight not in defaults:
-                    for f in features:
-                        axial_data += str(f.id()) + "\t"
-                        axial_data += str(f.geometry().vertexAt(0).x()) + "\t" + str(f.geometry().vertexAt(0).y()) + "\t"
-                        axial_data += str(f.geometry().vertexAt(1).x()) + "\t" + str(f.geometry().vertexAt(1).y()) + "\t"
-                        axial_data += str(f.attribute(weight)) + "\n"
-                else:
-                    for f in features:
-                        axial_data += str(f.id()) + "\t"
-                        axial_data += str(f.geometry().vertexAt(0).x()) + "\t" + str(f.geometry().vertexAt(0).y()) + "\t"
-                        axial_data += str(f.geometry().vertexAt(1).x()) + "\t" + str(f.geometry().vertexAt(1).y()) + "\n"
-            return axial_data
+            if weight in defaults:
+                weight = ''
+            return list(getAxialMapChunks(self.axial_layer, ref, weight))
         except:
             self.showMessage("Exporting axial map failed.",'Error',lev=3, dur=5)
-            return ''
+            return []
 
     def prepareUnlinks(self):
         unlinks_data = ''
@@ -196,20 +176,25 @@ class DepthmapAnalysis(QObject):
         elif fieldHasNullValues(self.unlinks_layer, 'line1') or fieldHasNullValues(self.unlinks_layer, 'line2'):
             self.showMessage("Unlinks layer not ready for analysis: update and verify first.",'Warning',lev=2, dur=5)
             return unlinks_data
-        # get axial ids
-        axialids = getFieldValues(self.axial_layer, self.user_id)
-        # assign row number by id
-        try:
-            features = self.unlinks_layer.getFeatures()
-            for f in features:
-                row1 = axialids.index(f.attribute('line1'))
-                row2 = axialids.index(f.attribute('line2'))
-                unlinks_data += str(row1) + ',' + str(row2) + ';'
-        except:
-            self.showMessage("Exporting unlinks failed.",'Error',lev=3, dur=5)
-            return unlinks_data
-        if unlinks_data != '':
-            unlinks_data = unlinks_data[:-1]
+        # assign row number by id, using the index of the axial map ids
+        axial_index = getLayerIdIndex(self.axial_layer, self.user_id)[0]
+        unlinks = set()
+        missing = []
+        request = QgsFeatureRequest().setSubsetOfAttributes(['line1', 'line2'], self.unlinks_layer.pendingFields())
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        for f in self.unlinks_layer.getFeatures(request):
+            row1 = axial_index.get(f.attribute('line1'))
+            row2 = axial_index.get(f.attribute('line2'))
+            if row1 is None or row2 is None:
+                missing.append(f.id())
+            else:
+                # each pair of lines once, as (least, greatest) rows
+                unlinks.add((min(row1, row2), max(row1, row2)))
+        # report the unlinks that refer to lines not in the axial map
+        if missing:
+            self.showMessage("%d unlinks refer to missing axial lines and were not exported: %s" %
+                             (len(missing), ', '.join([str(id) for id in missing[:10]])), 'Warning', lev=1, dur=5)
+        unlinks_data = ';'.join(["%s,%s" % pair for pair in sorted(unlinks)])
         return unlinks_data
 
     def prepareLinks(self):
@@ -266,18 +251,16 @@ class DepthmapAnalysis(QObject):
         return radii
 
     def processAnalysisResult(self, datastore, result):
-        # parse the results, splitting rows and then columns
-        new_result = result.split("\n")
-        #discard the first row if it has garbage from comm:
-        while "--result100" not in new_result[0]:
-            new_result.pop(0)
-        #collect result in rows
-        final_result = []
-        for line in new_result:
-            if "--result" not in line and "--comm" not in line and line != '':
-                final_result.append(line.split(","))
-        attributes = final_result[0]
-        values = final_result[1:len(final_result)]
+        # parse the results into typed columns, unless they were read while receiving
+        if not isinstance(result, DepthmapResultReader):
+            reader = DepthmapResultReader()
+            reader.feed(result)
+            reader.close()
+            result = reader
+        attributes, types, columns = result.getResult()
+        return self.formatAnalysisResult(datastore, attributes, columns, types)
+
+    def formatAnalysisResult(self, datastore, attributes, columns, types=None):
         # Process the attributes, renaming them and selecting only relevant ones
         exclusions = []
         # keep only most important attributes
@@ -290,14 +273,15 @@ class DepthmapAnalysis(QObject):
             weight_by = self.settings['weightBy'].title() + ' 1'
             if weight_by.title() in attributes:
                 exclusions.append(attributes.index(weight_by))
-        # remove attributes and values from lists
+        # remove attributes and their columns from lists
         if len(exclusions) > 0:
             exclusions.sort(reverse=True)
-            values = zip(*values)
+            columns = list(columns)
             for i in exclusions:
                 attributes.pop(i)
-                values.pop(i)
-            values = zip(*values)
+                columns.pop(i)
+                if types:
+                    types.pop(i)
         # replace axial ref by axial id
         if "Axial Ref" in attributes:
             idx = attributes.index("Axial Ref")
@@ -323,25 +307,27 @@ class DepthmapAnalysis(QObject):
                 attr.append(x)
             attributes = attr
         # get data type of attributes
-        types = []
-        data_sample = [convertNumeric(x) for x in values[0]]
-        for data in data_sample:
-            data_type = None
-            # get the data types
-            if type(data).__name__ == 'int': data_type = QVariant.Int
-            elif type(data).__name__ == 'long': data_type = QVariant.LongLong
-            elif type(data).__name__ == 'str': data_type = QVariant.String
-            elif type(data).__name__ == 'float': data_type = QVariant.Double
-            # define the attributes, using name and type
-            types.append(data_type)
+        if not types:
+            types = []
+            data_sample = [convertNumeric(column[0]) for column in columns]
+            for data in data_sample:
+                data_type = None
+                # get the data types
+                if type(data).__name__ == 'int': data_type = QVariant.Int
+                elif type(data).__name__ == 'long': data_type = QVariant.LongLong
+                elif type(data).__name__ == 'str': data_type = QVariant.String
+                elif type(data).__name__ == 'float': data_type = QVariant.Double
+                # define the attributes, using name and type
+                types.append(data_type)
         coords = [attributes.index('x1'),attributes.index('y1'),attributes.index('x2'),attributes.index('y2')]
         if self.settings['type'] == 1 and self.settings['newnorm'] == 1:
-            new_attributes, values = self.calculateNormalisedSegment(attributes, values)
+            new_attributes, new_columns = self.calculateNormalisedSegment(attributes, columns)
             attributes.extend(new_attributes)
+            columns = list(columns) + new_columns
             new_types = [QVariant.Double] * len(new_attributes)
             types.extend(new_types)
             #addShapeFileAttributes(new_layer, new_attributes, new_types, new_values)
-        return attributes, types, values, coords
+        return attributes, types, columns, coords
 
     def excludeDepthmapResults(self,attributes):
         # list of attributes to exclude
@@ -352,43 +338,8 @@ class DepthmapAnalysis(QObject):
                 attributes_to_remove.append(i)
         return attributes_to_remove
 
-    def calculateNormalisedSegment(self, attributes, values):
-        choice = []
-        nc = []
-        td = []
-        nach = []
-        nain = []
-        # identify new attributes that need to be calculated
-        for i, attr in enumerate(attributes):
-            if 'CH' in attr:
-                choice.append(i)
-                nach.append(attr.replace('CH','NACH'))
-            if 'NC' in attr:
-                nc.append(i)
-            if 'TD' in attr:
-                td.append(i)
-                nain.append(attr.replace('TD','NAIN'))
-        new_attributes = []
-        new_attributes.extend(nach)
-        new_attributes.extend(nain)
-        #attributes.extend(new_attributes)
-        # calculate new values
-        all_values = []
-        for feat in values:
-            feat = list(feat)
-            calc_values = []
-            for i, j in enumerate(choice):
-                val = math.log(float(feat[j])+1.0)/math.log(float(feat[td[i]])+3.0)
-                calc_values.append(val)
-            for i, j in enumerate(td):
-                if i < len(nc):
-                    val = (float(feat[nc[i]])**1.2)/float(feat[j])
-                else:
-                    val = (float(feat[nc[i-len(nc)]])**1.2)/float(feat[j])
-                calc_values.append(val)
-            feat.extend(calc_values)
-            all_values.append(feat)
-        return new_attributes, all_values
+    def calculateNormalisedSegment(self, attributes, columns):
+        return calcNormalisedSegment(attributes, columns)
 
     def fixDepthmapNames(self,names):
         #proper conversion makes short version based on real name
@@ -456,6 +407,38 @@ class DepthmapAnalysis(QObject):
         self.axial_thread.result.connect(self.prepareAxialAnalysis)
         self.axial_thread.start()
 
+#####
+# export of the axial map for depthmapX, reading only the needed attributes and each geometry once
+def getAxialMapRows(layer, ref='', weight=''):
+    # tab separated rows with id, x1, y1, x2, y2 and the weight if given
+    attributes = [name for name in (ref, weight) if name != '']
+    request = QgsFeatureRequest().setSubsetOfAttributes(attributes, layer.pendingFields())
+    for f in layer.getFeatures(request):
+        geometry = f.geometry()
+        start = geometry.vertexAt(0)
+        end = geometry.vertexAt(1)
+        if ref != '':
+            row_id = f.attribute(ref)
+        else:
+            row_id = f.id()
+        if weight != '':
+            yield "%s\t%s\t%s\t%s\t%s\t%s\n" % (row_id, start.x(), start.y(), end.x(), end.y(), f.attribute(weight))
+        else:
+            yield "%s\t%s\t%s\t%s\t%s\n" % (row_id, start.x(), start.y(), end.x(), end.y())
+
+
+def getAxialMapChunks(layer, ref='', weight='', size=10000):
+    # join the rows in chunks of text, instead of one string for the whole map
+    rows = []
+    for row in getAxialMapRows(layer, ref, weight):
+        rows.append(row)
+        if len(rows) == size:
+            yield ''.join(rows)
+            rows = []
+    if rows:
+        yield ''.join(rows)
+
+
 #####
 #class to extract the model geometry for input in Depthmap.
 # can be slow with large models and need to run it in separate thread
@@ -465,37 +448,14 @@ class ExportAxialMap(QThread):
         self.parent = parentObject
         self.layer = layer
         self.abort = False
-        self.id = id
+        self.id = ref
         self.weight = weight
 
     def run(self):
-        axialLayer = ''
         try:
-            features = self.layer.getFeatures()
-            if self.id in self.layer.dataProvider().fields():
-                if self.weight != '':
-                    for f in features:
-                        axialLayer += str(f.attribute(self.id)) + "\t"
-                        axialLayer += str(f.geometry().vertexAt(0).x()) + "\t" + str(f.geometry().vertexAt(0).y()) + "\t"
-                        axialLayer += str(f.geometry().vertexAt(1).x()) + "\t" + str(f.geometry().vertexAt(1).y()) + "\t"
-                        axialLayer += str(f.attribute(self.weight)) + "\n"
-                else:
-                    for f in features:
-                        axialLayer += str(f.attribute(self.id)) + "\t"
-                        axialLayer += str(f.geometry().vertexAt(0).x()) + "\t" + str(f.geometry().vertexAt(0).y()) + "\t"
-                        axialLayer += str(f.geometry().vertexAt(1).x()) + "\t" + str(f.geometry().vertexAt(1).y()) + "\n"
-            else:
-                if self.weight != '':
-                    for f in features:
-                        axialLayer += str(f.id()) + "\t"
-                        axialLayer += str(f.geometry().vertexAt(0).x()) + "\t" + str(f.geometry().vertexAt(0).y()) + "\t"
-                        axialLayer += str(f.geometry().vertexAt(1).x()) + "\t" + str(f.geometry().vertexAt(1).y()) + "\t"
-                        axialLayer += str(f.attribute(self.weight)) + "\n"
-                else:
-                    for f in features:
-                        axialLayer += str(f.id()) + "\t"
-                        axialLayer += str(f.geometry().vertexAt(0).x()) + "\t" + str(f.geometry().vertexAt(0).y()) + "\t"
-                        axialLayer += str(f.geometry().vertexAt(1).x()) + "\t" + str(f.geometry().vertexAt(1).y()) + "\n"
+            if self.id not in self.layer.dataProvider().fields():
+                self.id = ''
+            axialLayer = ''.join(getAxialMapChunks(self.layer, self.id, self.weight))
             self.status.emit('Model exported for analysis.')
             self.result.emit(axialLayer)
         except:
@@ -510,3 +470,108 @@ class ExportAxialMap(QThread):
     result = pyqtSignal(str)
     error = pyqtSignal(str)
     killed = pyqtSignal()
+
+
+# incremental reader of the depthmapX result block, parsing the rows into typed columns as the data arrives
+class DepthmapResultReader(object):
+    # largest value of the integer columns
+    int_max = 2 ** (8 * array('l').itemsize - 1) - 1
+
+    def __init__(self):
+        self.attributes = []
+        self.kinds = []
+        self.columns = []
+        self.started = False
+        self.finished = False
+        self.remainder = ''
+        # rows that don't have a value for every attribute
+        self.dropped = 0
+
+    def feed(self, data):
+        # parse the complete lines, keeping the incomplete last line for the next chunk
+        lines = (self.remainder + data).split("\n")
+        self.remainder = lines.pop()
+        for line in lines:
+            self.parseLine(line)
+            if self.finished:
+                break
+        return self.finished
+
+    def close(self):
+        # parse the last line if the data didn't end with a line break
+        if self.remainder:
+            self.parseLine(self.remainder)
+            self.remainder = ''
+
+    def parseLine(self, line):
+        line = line.rstrip("\r")
+        if self.finished or line == '':
+            return
+        # discard everything before the result block, like comm: messages
+        if not self.started:
+            self.started = "--result100" in line
+            return
+        if "--result--" in line:
+            self.finished = True
+            return
+        if "--result" in line or "--comm" in line:
+            return
+        cells = line.split(",")
+        if not self.attributes:
+            self.attributes = cells
+            return
+        if len(cells) != len(self.attributes):
+            self.dropped += 1
+            return
+        if not self.kinds:
+            self.setColumnTypes(cells)
+        # convert the whole row before adding it, so that the columns keep the same length
+        row = [self.convertCell(i, cell) for i, cell in enumerate(cells)]
+        for i, value in enumerate(row):
+            self.columns[i].append(value)
+
+    def convertCell(self, i, cell):
+        # promote the column until the value fits, any value fits a string column
+        while True:
+            try:
+                if self.kinds[i] == 'int':
+                    value = int(cell)
+                    if not -self.int_max - 1 <= value <= self.int_max:
+                        raise OverflowError
+                    return value
+                elif self.kinds[i] == 'float':
+                    return float(cell)
+                return cell
+            except (ValueError, OverflowError):
+                self.promoteColumn(i)
+
+    def setColumnTypes(self, cells):
+        # get data type of attributes from the first row
+        for cell in cells:
+            data_type = type(convertNumeric(cell)).__name__
+            if data_type == 'int':
+                self.kinds.append('int')
+                self.columns.append(array('l'))
+            elif data_type == 'float':
+                self.kinds.append('float')
+                self.columns.append(array('d'))
+            else:
+                self.kinds.append('str')
+                self.columns.append([])
+
+    def promoteColumn(self, i):
+        # a value doesn't fit the column type, use the next more general type
+        if self.kinds[i] == 'int':
+            self.kinds[i] = 'float'
+            self.columns[i] = array('d', self.columns[i])
+        else:
+            self.kinds[i] = 'str'
+            self.columns[i] = [str(x) for x in self.columns[i]]
+
+    def getResult(self):
+        type_map = {'int': QVariant.Int, 'float': QVariant.Double, 'str': QVariant.String}
+        types = [type_map[kind] for kind in self.kinds]
+        # hand over the column buffers, one per attribute even without rows
+        columns = self.columns or [[] for attr in self.attributes]
+        self.columns = []
+        return list(self.attributes), types, columns
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ essTools
+                                 A QGIS plugin
+ Set of tools for space syntax network analysis and results exploration
+                              -------------------
+        begin                : 2014-04-01
+        copyright            : (C) 2014 by Jorge Gil, UCL
+        email                : jorge.gil@ucl.ac.uk
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+"""
+# Import the PyQt and QGIS libraries
+from PyQt4.QtCore import *
+from PyQt4.QtNetwork import QTcpSocket, QAbstractSocket
+
+from DepthmapAnalysis import DepthmapResultReader
+
+
+# asynchronous depthmapXnet client, reports progress and the result as they arrive from the socket
+class DepthmapClient(QObject):
+    analysisConnected = pyqtSignal()
+    analysisProgress = pyqtSignal(int)
+    analysisFinished = pyqtSignal(object)
+    analysisError = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        QObject.__init__(self, parent)
+        self.socket = QTcpSocket(self)
+        self.socket.connected.connect(self.socketConnected)
+        self.socket.readyRead.connect(self.readData)
+        self.socket.error.connect(self.socketError)
+        self.socket.disconnected.connect(self.socketDisconnected)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.connectTimeout)
+        self.connecting = False
+        self.running = False
+        self.reader = None
+        self.remainder = ''
+        self.nodes = 0
+
+    def connectSocket(self, host, port, timeout=3000):
+        # connects without blocking, reports analysisConnected or analysisError
+        self.connecting = True
+        self.socket.connectToHost(host, port)
+        self.timer.start(timeout)
+
+    def socketConnected(self):
+        if self.connecting:
+            self.connecting = False
+            self.timer.stop()
+            self.analysisConnected.emit()
+
+    def connectTimeout(self):
+        if self.connecting:
+            self.connecting = False
+            self.socket.abort()
+            self.analysisError.emit("Connection to depthmapX timed out.")
+
+    def sendData(self, data):
+        self.reader = DepthmapResultReader()
+        self.remainder = ''
+        self.nodes = 0
+        self.running = True
+        # the command can be a list of chunks, written one by one
+        if isinstance(data, basestring):
+            data = [data]
+        size = 0
+        for chunk in data:
+            written = self.socket.write(chunk)
+            if written == -1:
+                self.running = False
+                return False, self.socket.errorString()
+            size += written
+        return True, str(size)
+
+    def readData(self):
+        data = str(self.socket.readAll())
+        if not self.running:
+            return
+        if not self.reader.started:
+            # handle comm: messages until the result block starts
+            lines = (self.remainder + data).split("\n")
+            self.remainder = lines.pop()
+            for i, line in enumerate(lines):
+                if "--result100" in line:
+                    lines.append(self.remainder)
+                    data = "\n".join(lines[i:])
+                    self.remainder = ''
+                    break
+                self.parseMessage(line)
+            else:
+                return
+        if self.reader.feed(data):
+            self.running = False
+            self.socket.abort()
+            self.analysisFinished.emit(self.reader)
+
+    def parseMessage(self, line):
+        # extract number of nodes
+        if "--comm: 2," in line:
+            pos1 = line.find("--comm: 2,")
+            pos2 = line.find(",0 ", pos1)
+            try:
+                self.nodes = int(line[(pos1 + 10):pos2])
+            except ValueError:
+                pass
+        # extract progress info
+        elif "--comm: 3," in line and self.nodes > 0:
+            pos1 = line.find("--comm: 3,")
+            pos2 = line.find(",0 ", pos1)
+            try:
+                prog = float(line[(pos1 + 10):pos2])
+            except ValueError:
+                return
+            self.analysisProgress.emit(int((prog / self.nodes) * 100))
+
+    def socketError(self, error):
+        if self.connecting:
+            self.connecting = False
+            self.timer.stop()
+            self.analysisError.emit(self.socket.errorString())
+        elif self.running and error != QAbstractSocket.RemoteHostClosedError:
+            self.running = False
+            self.analysisError.emit(self.socket.errorString())
+
+    def socketDisconnected(self):
+        if self.running:
+            # the result must be complete when depthmapX closes the connection
+            self.readData()
+            if self.running:
+                self.running = False
+                self.reader.close()
+                if self.reader.finished:
+                    self.analysisFinished.emit(self.reader)
+                else:
+                    self.analysisError.emit("Connection closed by depthmapX.")
+
+    def closeSocket(self):
+        self.connecting = False
+        self.running = False
+        self.timer.stop()
+        self.socket.abort()
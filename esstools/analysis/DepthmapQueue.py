@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ essTools
+                                 A QGIS plugin
+ Set of tools for space syntax network analysis and results exploration
+                              -------------------
+        begin                : 2014-04-01
+        copyright            : (C) 2014 by Jorge Gil, UCL
+        email                : jorge.gil@ucl.ac.uk
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+"""
+# Import the PyQt and QGIS libraries
+from PyQt4.QtCore import *
+
+from DepthmapClient import DepthmapClient
+
+from collections import deque
+from functools import partial
+
+
+# queue of analysis jobs, dispatched to a pool of depthmapXnet endpoints as they become free
+class DepthmapQueue(QObject):
+    jobStarted = pyqtSignal(int, str)
+    jobProgress = pyqtSignal(int, int)
+    jobFinished = pyqtSignal(int, object)
+    jobError = pyqtSignal(int, str)
+    queueFinished = pyqtSignal()
+
+    def __init__(self, parent=None):
+        QObject.__init__(self, parent)
+        self.endpoints = []
+        # endpoints set while the queue runs, taking effect when it is idle
+        self.new_endpoints = None
+        self.jobs = []
+        self.pending = deque()
+        self.running = dict()
+        self.offline = set()
+
+    def setEndpoints(self, endpoints):
+        # list of (host, port) tuples. the running and offline endpoints are kept by position,
+        # so the list only changes when no job is running
+        self.new_endpoints = list(endpoints)
+        if not self.isRunning():
+            self.applyEndpoints()
+
+    def applyEndpoints(self):
+        if self.new_endpoints is not None:
+            self.endpoints = self.new_endpoints
+            self.new_endpoints = None
+        self.offline = set()
+
+    def isRunning(self):
+        return len(self.pending) > 0 or len(self.running) > 0
+
+    def addJob(self, job):
+        # the job is a dict with the analysis 'command' and the data needed to save its results
+        if not self.isRunning():
+            self.jobs = []
+            self.applyEndpoints()
+        job['id'] = len(self.jobs)
+        job['status'] = 'pending'
+        job['progress'] = 0
+        self.jobs.append(job)
+        self.pending.append(job['id'])
+        self.dispatch()
+        if not self.isRunning():
+            self.queueFinished.emit()
+        return job['id']
+
+    def getJob(self, job_id):
+        return self.jobs[job_id]
+
+    def getProgress(self):
+        # overall progress of the current batch of jobs
+        if not self.jobs:
+            return 0
+        return int(sum(job['progress'] for job in self.jobs) / len(self.jobs))
+
+    def dispatch(self):
+        # start pending jobs on the free endpoints
+        for endpoint, (host, port) in enumerate(self.endpoints):
+            if not self.pending:
+                break
+            if endpoint in self.running or endpoint in self.offline:
+                continue
+            job_id = self.pending.popleft()
+            client = DepthmapClient(self)
+            client.analysisConnected.connect(partial(self.startJob, endpoint, "%s:%s" % (host, port)))
+            client.analysisProgress.connect(partial(self.updateJob, endpoint))
+            client.analysisFinished.connect(partial(self.finishJob, endpoint))
+            client.analysisError.connect(partial(self.failJob, endpoint))
+            self.jobs[job_id]['status'] = 'connecting'
+            self.running[endpoint] = (job_id, client)
+            client.connectSocket(host, port)
+        # without endpoints the remaining jobs can't run
+        if self.pending and not self.running and len(self.offline) == len(self.endpoints):
+            while self.pending:
+                job_id = self.pending.popleft()
+                self.jobs[job_id]['status'] = 'error'
+                self.jobs[job_id]['progress'] = 100
+                self.jobError.emit(job_id, "Unable to connect to depthmapX.")
+
+    def startJob(self, endpoint, address):
+        if endpoint not in self.running:
+            return
+        job_id, client = self.running[endpoint]
+        job = self.jobs[job_id]
+        self.jobStarted.emit(job_id, address)
+        sent, msg = client.sendData(job['command'])
+        # the command isn't needed anymore
+        job['command'] = None
+        if sent:
+            job['status'] = 'running'
+        else:
+            self.running.pop(endpoint)
+            self.releaseClient(client)
+            self.offline.add(endpoint)
+            job['status'] = 'error'
+            job['progress'] = 100
+            self.jobError.emit(job_id, msg)
+            self.dispatch()
+            if not self.isRunning():
+                self.queueFinished.emit()
+
+    def updateJob(self, endpoint, prog):
+        if endpoint in self.running:
+            job_id = self.running[endpoint][0]
+            self.jobs[job_id]['progress'] = prog
+            self.jobProgress.emit(job_id, prog)
+
+    def finishJob(self, endpoint, result):
+        if endpoint not in self.running:
+            return
+        job_id, client = self.running.pop(endpoint)
+        self.releaseClient(client)
+        self.jobs[job_id]['status'] = 'finished'
+        self.jobs[job_id]['progress'] = 100
+        if result.dropped > 0:
+            self.jobError.emit(job_id, "%d result rows without a value for every attribute were skipped." % result.dropped)
+        # start the next job on the free endpoint before saving the results
+        self.dispatch()
+        self.jobFinished.emit(job_id, result)
+        if not self.isRunning():
+            self.queueFinished.emit()
+
+    def failJob(self, endpoint, msg):
+        if endpoint not in self.running:
+            return
+        job_id, client = self.running.pop(endpoint)
+        self.releaseClient(client)
+        if self.jobs[job_id]['status'] == 'connecting':
+            # the endpoint is offline, the job goes back to the queue for the other endpoints
+            self.offline.add(endpoint)
+            self.pending.appendleft(job_id)
+            self.jobs[job_id]['status'] = 'pending'
+        else:
+            self.jobs[job_id]['status'] = 'error'
+            self.jobs[job_id]['progress'] = 100
+            self.jobError.emit(job_id, msg)
+        self.dispatch()
+        if not self.isRunning():
+            self.queueFinished.emit()
+
+    def cancel(self):
+        for job_id, client in self.running.values():
+            self.jobs[job_id]['status'] = 'canceled'
+            self.releaseClient(client)
+        for job_id in self.pending:
+            self.jobs[job_id]['status'] = 'canceled'
+        self.running = dict()
+        self.pending = deque()
+
+    def releaseClient(self, client):
+        client.closeSocket()
+        client.deleteLater()
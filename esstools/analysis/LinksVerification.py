@@ -26,11 +26,129 @@ from PyQt4.QtGui import *
 from qgis.core import *
 
 from ..utility_functions import *
+from ..network_functions import *
 
-class LinksVerification(QObject):
+import time
 
-    def __init__(self, iface):
-        QObject.__init__(self)
 
-        self.iface = iface
+class LinksVerification(QThread):
+    verificationFinished = pyqtSignal(dict, list)
+    verificationProgress = pyqtSignal(int)
+    verificationError = pyqtSignal(str)
 
+    def __init__(self, parentThread, parentObject, settings, axial, axial_id, links, id):
+        QThread.__init__( self, parentThread)
+        self.parent = parentObject
+        self.running = False
+        self.verification_settings = settings
+        self.axial_layer = axial
+        self.links_layer = links
+        self.user_id = id
+        self.axial_id = axial_id
+
+        # verification globals
+        self.problem_nodes = []
+        # error types to identify:
+        self.link_errors = {'invalid geometry':[],'no line id':[],'unmatched line id':[],'same line id':[],
+                            'duplicate link':[],'intersecting lines':[]}
+
+    def run(self):
+        self.running = True
+        # reset all the errors
+        self.problem_nodes = []
+        for k, v in self.link_errors.iteritems():
+            self.link_errors[k]=[]
+        # index the axial lines by id, with a single request
+        start_time = time.time()
+        rows, fids = getLayerIdIndex(self.axial_layer, self.axial_id)
+        print "Preparing the map: %s"%str(time.time()-start_time)
+        self.verificationProgress.emit(10)
+        # analyse the links
+        start_time = time.time()
+        self.qgisTestLinks(rows, fids)
+        print "Analysing links: %s"%str(time.time()-start_time)
+        self.verificationProgress.emit(100)
+        # return the results
+        self.problem_nodes = list(set(self.problem_nodes))
+        self.verificationFinished.emit(self.link_errors, self.problem_nodes)
+        return
+
+    def stop(self):
+        self.running = False
+        self.terminate()
+
+
+    # QGIS based functions
+    #
+    def qgisTestLinks(self, rows, fids):
+        # this function checks the validity of links, using the row of each line id
+        # links are few, even in multi level models, any datastore is read through QGIS
+        n = len(fids)
+        links = []
+        pairs = []
+        has_ids = fieldExists(self.links_layer, 'line1') and fieldExists(self.links_layer, 'line2')
+        fields = []
+        if has_ids:
+            fields = [getFieldIndex(self.links_layer, 'line1'), getFieldIndex(self.links_layer, 'line2')]
+        if self.user_id != '':
+            fields.append(getFieldIndex(self.links_layer, self.user_id))
+        request = QgsFeatureRequest().setSubsetOfAttributes(fields)
+        for feature in self.links_layer.getFeatures(request):
+            if self.user_id == '':
+                id = feature.id()
+            else:
+                id = feature.attribute(self.user_id)
+            if has_ids:
+                id1 = feature.attribute('line1')
+                id2 = feature.attribute('line2')
+            else:
+                id1 = id2 = NULL
+            links.append((id, id1, id2))
+            problems = []
+            # geometry is valid (generally)
+            geom = feature.geometry()
+            if geom is None or not geom.isGeosValid() or geom.isGeosEmpty():
+                problems.append('invalid geometry')
+            # no line id
+            if id1 is NULL or id2 is NULL:
+                problems.append('no line id')
+            # same line id
+            elif id1 == id2:
+                problems.append('same line id')
+            # line id not in the map
+            elif id1 not in rows or id2 not in rows:
+                problems.append('unmatched line id')
+            else:
+                pairs.append((len(links) - 1, rows[id1], rows[id2]))
+            self.addLinkErrors(problems, links[-1])
+        self.verificationProgress.emit(50)
+        if not pairs:
+            return
+        pairs = np.array(pairs, dtype=np.int64)
+        # duplicate links join the same lines, in any order
+        keys, inverse = np.unique(getEdgeKeys(n, pairs[:, 1:]), return_inverse=True)
+        repeated = np.bincount(inverse)[inverse] > 1
+        for link in pairs[repeated, 0].tolist():
+            self.addLinkErrors(['duplicate link'], links[link])
+        self.verificationProgress.emit(60)
+        # linked lines that intersect are joined without the link
+        lines = np.unique(pairs[:, 1:])
+        request = QgsFeatureRequest().setFilterFids([fids[row] for row in lines.tolist()])
+        request.setSubsetOfAttributes([])
+        geometries = dict()
+        for feature in self.axial_layer.getFeatures(request):
+            if feature.geometry():
+                geometries[feature.id()] = QgsGeometry(feature.geometry())
+        self.verificationProgress.emit(80)
+        for link, a, b in pairs.tolist():
+            geom_a = geometries.get(fids[a])
+            geom_b = geometries.get(fids[b])
+            if geom_a and geom_b and geom_a.intersects(geom_b):
+                self.addLinkErrors(['intersecting lines'], links[link])
+
+    def addLinkErrors(self, problems, link):
+        # add the id of the link to each error, the link and its lines to the problems
+        for error in problems:
+            self.link_errors[error].append(link[0])
+        if problems:
+            self.problem_nodes.append(link)
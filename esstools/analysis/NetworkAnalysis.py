@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ essTools
+                                 A QGIS plugin
+ Set of tools for space syntax network analysis and results exploration
+                              -------------------
+        begin                : 2014-04-01
+        copyright            : (C) 2014 by Jorge Gil, UCL
+        email                : jorge.gil@ucl.ac.uk
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+"""
+# Import the PyQt and QGIS libraries
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+from qgis.core import *
+
+from ..utility_functions import *
+from ..network_functions import *
+
+import time
+
+
+# built-in analysis engine, runs the axial or segment analysis in process instead of depthmapX
+class NetworkAnalysis(QThread):
+    analysisFinished = pyqtSignal(list, list, list)
+    analysisProgress = pyqtSignal(int)
+    analysisError = pyqtSignal(str)
+    analysisWarning = pyqtSignal(str)
+
+    def __init__(self, parentThread, parentObject, settings, axial, id, unlinks, links, processes=1):
+        QThread.__init__(self, parentThread)
+        self.parent = parentObject
+        self.running = False
+        self.analysis_settings = settings
+        self.processes = processes
+        self.axial_layer = axial
+        self.unlinks_layer = unlinks
+        self.links_layer = links
+        self.user_id = id
+
+    def run(self):
+        self.running = True
+        try:
+            self.runAnalysis()
+        except Exception, e:
+            self.analysisError.emit("The built-in analysis failed: %s" % e)
+
+    def runAnalysis(self):
+        # read the map geometry
+        start_time = time.time()
+        ids, coords = self.getAxialCoords()
+        if len(ids) == 0:
+            self.analysisError.emit("Exporting axial map failed.")
+            return
+        n = len(ids)
+        rows = getIdIndex(ids)
+        unlinks = getLinePairs(self.unlinks_layer, rows)
+        links = getLinePairs(self.links_layer, rows)
+        print "Preparing the map: %s"%str(time.time()-start_time)
+        self.analysisProgress.emit(5)
+        # build the graph
+        start_time = time.time()
+        # the intersections of an unchanged map are read from the topology cache
+        edges = getCachedLineIntersections(coords, getCachePath('topology'))
+        if self.analysis_settings['type'] == 1:
+            # links join lines that don't touch, they can't split segments
+            edges = updateEdges(n, edges, unlinks)
+            segments = buildSegmentGraph(coords, edges)
+        else:
+            edges = updateEdges(n, edges, unlinks, links)
+            indptr, indices = buildAdjacency(n, edges)
+        print "Building the graph: %s"%str(time.time()-start_time)
+        self.analysisProgress.emit(10)
+        # calculate the measures
+        start_time = time.time()
+        radii = [float(r) for r in self.analysis_settings['rvalues'].split(',')]
+        radii = [int(r) if r.is_integer() else r for r in radii]
+        betweenness = self.analysis_settings['betweenness'] == 1
+        if self.analysis_settings['type'] == 1:
+            measures = calcSegmentMeasures(segments, radii, self.analysis_settings['radius'], betweenness,
+                                           self.updateProgress, processes=self.processes)
+        else:
+            measures = calcAxialMeasures(indptr, indices, radii, betweenness, self.analysis_settings['fullset'] == 1,
+                                         self.updateProgress, processes=self.processes)
+        print "Analysing the graph: %s"%str(time.time()-start_time)
+        if measures is None:
+            return
+        if self.analysis_settings['type'] == 1:
+            attributes, types, values = self.getSegmentTable(ids, segments, measures)
+        else:
+            attributes, types, values = self.getAnalysisTable(ids, coords, measures)
+        self.analysisProgress.emit(100)
+        self.analysisFinished.emit(attributes, types, values)
+        return
+
+    def stop(self):
+        self.running = False
+
+    def updateProgress(self, value):
+        self.analysisProgress.emit(10 + int(value * 0.85))
+        return self.running
+
+    def getAxialCoords(self):
+        # get the id and end points of every line
+        ids = []
+        coords = []
+        if self.user_id == '':
+            request = QgsFeatureRequest().setSubsetOfAttributes([])
+        else:
+            request = QgsFeatureRequest().setSubsetOfAttributes([getFieldIndex(self.axial_layer, self.user_id)])
+        empty = 0
+        multipart = 0
+        for f in self.axial_layer.getFeatures(request):
+            geometry = f.geometry()
+            if geometry is None:
+                empty += 1
+                continue
+            if geometry.isMultipart():
+                parts = geometry.asMultiPolyline()
+                if len(parts) > 1:
+                    multipart += 1
+                    continue
+                line = parts[0] if parts else []
+            else:
+                line = geometry.asPolyline()
+            if len(line) < 2:
+                empty += 1
+                continue
+            if self.user_id == '':
+                ids.append(f.id())
+            else:
+                ids.append(f.attribute(self.user_id))
+            coords.append((line[0].x(), line[0].y(), line[1].x(), line[1].y()))
+        if empty > 0:
+            self.analysisWarning.emit("%d lines without geometry were left out of the analysis." % empty)
+        if multipart > 0:
+            self.analysisWarning.emit("%d multipart lines were left out of the analysis. Split them into single lines first." % multipart)
+        return ids, np.array(coords, dtype=np.float64).reshape(-1, 4)
+
+    def getAnalysisTable(self, ids, coords, measures):
+        # compose the result table with the same attribute names as depthmapX
+        attributes = ['Id', 'x1', 'y1', 'x2', 'y2', 'Line Length']
+        types = [QVariant.Int, QVariant.Double, QVariant.Double, QVariant.Double, QVariant.Double, QVariant.Double]
+        columns = [ids, coords[:, 0].tolist(), coords[:, 1].tolist(), coords[:, 2].tolist(), coords[:, 3].tolist(),
+                   np.hypot(coords[:, 2] - coords[:, 0], coords[:, 3] - coords[:, 1]).tolist()]
+        return self.addMeasureColumns(attributes, types, columns, measures)
+
+    def getSegmentTable(self, ids, segments, measures):
+        # segments keep the id of the axial line they come from
+        coords = segments['coords']
+        attributes = ['Axial Ref', 'x1', 'y1', 'x2', 'y2', 'Segment Length', 'Connectivity']
+        types = [QVariant.Int, QVariant.Double, QVariant.Double, QVariant.Double, QVariant.Double, QVariant.Double,
+                 QVariant.Int]
+        columns = [[ids[row] for row in segments['rows'].tolist()], coords[:, 0].tolist(), coords[:, 1].tolist(),
+                   coords[:, 2].tolist(), coords[:, 3].tolist(), segments['lengths'].tolist(),
+                   segments['connectivity'].tolist()]
+        return self.addMeasureColumns(attributes, types, columns, measures)
+
+    def addMeasureColumns(self, attributes, types, columns, measures):
+        for name in sorted(measures.keys()):
+            attributes.append(name)
+            if measures[name].dtype.kind in 'iu':
+                types.append(QVariant.Int)
+            else:
+                types.append(QVariant.Double)
+            columns.append(measures[name].tolist())
+        return attributes, types, columns
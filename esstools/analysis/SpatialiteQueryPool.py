@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ essTools
+                                 A QGIS plugin
+ Set of tools for space syntax network analysis and results exploration
+                              -------------------
+        begin                : 2014-04-01
+        copyright            : (C) 2014 by Jorge Gil, UCL
+        email                : jorge.gil@ucl.ac.uk
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+"""
+from pyspatialite import dbapi2 as sqlite
+
+import multiprocessing
+import threading
+import Queue
+import time
+
+
+# independent read only queries, run at the same time on a pool of connections to the same database.
+# the progress of a set of named checks is weighted by the time each check took the last time it ran
+class SpatialiteQueryPool(object):
+    # measured duration of each check, shared by all the pools
+    costs = dict()
+
+    def __init__(self, path, checks, threads=0):
+        self.path = path
+        self.threads = threads
+        self.tasks = Queue.Queue()
+        self.results = Queue.Queue()
+        self.workers = []
+        self.submitted = 0
+        # weight of each check in the progress, the checks never measured get the average cost
+        known = [self.costs[name] for name in checks if name in self.costs]
+        default = sum(known) / len(known) if known else 1.0
+        costs = dict((name, max(self.costs.get(name, default), 0.000001)) for name in checks)
+        total = sum(costs.values())
+        self.weights = dict((name, cost / total) for name, cost in costs.iteritems())
+        self.done = 0.0
+
+    def submit(self, name, query):
+        self.tasks.put((name, query))
+        self.submitted += 1
+
+    def start(self):
+        threads = self.threads
+        if threads < 1:
+            threads = multiprocessing.cpu_count()
+        for i in range(min(threads, self.submitted)):
+            worker = threading.Thread(target=self.runQueries)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def runQueries(self):
+        # every worker has its own read only connection
+        # each task taken gets a result, also when the connection fails, so that getResults doesn't wait for it
+        connection = None
+        cursor = None
+        failure = ''
+        try:
+            connection = sqlite.connect(self.path)
+            cursor = connection.cursor()
+            cursor.execute("PRAGMA query_only = 1")
+        except Exception, e:
+            failure = "Unable to connect to the database: %s" % e
+        while True:
+            try:
+                name, query = self.tasks.get_nowait()
+            except Queue.Empty:
+                break
+            start_time = time.time()
+            header = []
+            data = []
+            error = failure
+            if not failure:
+                try:
+                    cursor.execute(query)
+                    if cursor.description is not None:
+                        header = [item[0] for item in cursor.description]
+                    data = [row for row in cursor]
+                except Exception, e:
+                    error = str(e)
+            self.results.put((name, header, data, error, time.time() - start_time))
+        try:
+            if cursor is not None:
+                cursor.close()
+            if connection is not None:
+                connection.close()
+        except sqlite.Error:
+            pass
+
+    def getResults(self):
+        # results of the submitted queries, in the order they finish
+        # a query that failed has no data and the error message, its check must not be taken as passed
+        for i in range(self.submitted):
+            name, header, data, error, duration = self.results.get()
+            self.finish(name, duration)
+            yield name, header, data, error
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        self.submitted = 0
+
+    def finish(self, name, duration):
+        # record the cost of a check, returns the fraction of the checks done
+        self.costs[name] = duration
+        self.done += self.weights.get(name, 0.0)
+        return min(self.done, 1.0)
+
+    def getProgress(self):
+        return min(self.done, 1.0)
+
+
+def setSpatialiteWAL(connection):
+    # write ahead log, so that readers and a writer can use the database at the same time
+    # the journal mode is stored in the database, returns the previous mode to restore it with resetSpatialiteJournal
+    cursor = connection.cursor()
+    previous = ''
+    try:
+        cursor.execute("PRAGMA journal_mode")
+        mode = cursor.fetchone()
+        if mode is not None and str(mode[0]).lower() != 'wal':
+            cursor.execute("PRAGMA journal_mode = WAL")
+            res = cursor.fetchone()
+            if res is not None and str(res[0]).lower() == 'wal':
+                previous = str(mode[0])
+    except sqlite.Error:
+        pass
+    cursor.close()
+    return previous
+
+
+def resetSpatialiteJournal(connection, mode):
+    # back to the journal mode the database had, removing the write ahead log files
+    if not mode:
+        return True
+    cursor = connection.cursor()
+    try:
+        connection.commit()
+        cursor.execute("PRAGMA journal_mode = %s" % mode)
+        res = cursor.fetchone()
+    except sqlite.Error:
+        res = None
+    cursor.close()
+    return res is not None and str(res[0]).lower() == mode.lower()
@@ -26,6 +26,7 @@ from PyQt4.QtGui import *
 from qgis.core import *
 
 from ..utility_functions import *
+from SpatialiteQueryPool import *
 
 import time
 
@@ -69,6 +70,7 @@ class UnlinksVerification(QThread):
                 self.verificationError.emit("The map layer must be in the same database as the unlinks layer.")
                 return
             connection = getLayerConnection(self.unlinks_layer)
+            journal = setSpatialiteWAL(connection)
             # get the geometry column name and other properties
             unlinkgeom = getSpatialiteGeometryColumn(connection, unlinkname)
             axialgeom = getSpatialiteGeometryColumn(connection, axialname)
@@ -85,9 +87,29 @@ class UnlinksVerification(QThread):
             self.spatialiteTestUnlinks(connection, unlinkname, unlinkgeom, axialname, axialgeom)
             print "Analysing unlinks: %s"%str(time.time()-start_time)
             self.verificationProgress.emit(100)
+            resetSpatialiteJournal(connection, journal)
+            connection.close()
+        elif 'postgresql' in datastore.lower() and testPostgisSpatialIndex(self.unlinks_layer) \
+                and testPostgisSpatialIndex(self.axial_layer):
+            # get the relevant layers names
+            start_time = time.time()
+            unlinkname = getPostgisLayerName(self.unlinks_layer)
+            axialname = getPostgisLayerName(self.axial_layer)
+            if not testSameDatabase([self.unlinks_layer, self.axial_layer]):
+                self.verificationError.emit("The map layer must be in the same database as the unlinks layer.")
+                return
+            # add attributes if necessary
+            addFields(self.unlinks_layer,['line1','line2'], [QVariant.Int,QVariant.Int])
+            connection = getLayerConnection(self.unlinks_layer)
+            unlinkgeom = getPostgisGeometryColumn(self.unlinks_layer)
+            axialgeom = getPostgisGeometryColumn(self.axial_layer)
+            print "Preparing the map: %s"%str(time.time()-start_time)
+            self.verificationProgress.emit(10)
+            # analyse the unlinks
+            start_time = time.time()
+            self.postgisTestUnlinks(connection, unlinkname, unlinkgeom, axialname, axialgeom)
+            print "Analysing unlinks: %s"%str(time.time()-start_time)
             connection.close()
-        #elif 'postgresql' in datastore.lower():
-            # newfeature: implement for postgis specific functions
         else:
             # add attributes if necessary
             addFields(self.unlinks_layer,['line1','line2'], [QVariant.Int,QVariant.Int])
@@ -123,6 +145,7 @@ class UnlinksVerification(QThread):
 
     def spatialiteTestUnlinks(self, connection, unlinkname, unlinkgeom, axialname, axialgeom):
         # this function checks the geometric validity of geometry using spatialite
+        # the checks of the unlinks table run in parallel on read only connections
         threshold = self.verification_settings['unlink_dist']
         if self.user_id == '':
             unlinkid = 'ROWID'
@@ -132,54 +155,37 @@ class UnlinksVerification(QThread):
             axialid = 'ROWID'
         else:
             axialid = self.axial_id
-        steps = 90.0/9.0
-        progress = 10.0
+        tests = []
         # geometry is valid (generally)
-        start_time = time.time()
-        query = """SELECT "%s", line1, line2 FROM %s WHERE NOT ST_IsSimple(%s) OR NOT ST_IsValid(%s)"""%(unlinkid, unlinkname, unlinkgeom, unlinkgeom)
-        header, data, error = executeSpatialiteQuery(connection, query)
-        if data:
-            nodes = list(zip(*data)[0])
-            self.problem_nodes.extend(data)
-            self.unlink_errors['invalid geometry'] = nodes
-        progress += steps
-        self.verificationProgress.emit(progress)
-        print "analyse valid: %s"%str(time.time()-start_time)
+        tests.append(('invalid geometry', """SELECT "%s", line1, line2 FROM %s WHERE NOT ST_IsSimple(%s) OR NOT ST_IsValid(%s)"""
+                      %(unlinkid, unlinkname, unlinkgeom, unlinkgeom)))
         # duplicate geometry
-        start_time = time.time()
-        query = 'SELECT a."%s", a.line1, a.line2 FROM %s a, %s b WHERE a."%s" <> b."%s" AND ST_Equals(a.%s,b.%s)'\
-                'AND a.ROWID IN (SELECT ROWID FROM SpatialIndex WHERE f_table_name="%s" AND search_frame=b.%s)'\
-                %(unlinkid, unlinkname, unlinkname, unlinkid, unlinkid, unlinkgeom, unlinkgeom, unlinkname, unlinkgeom)
-        header, data, error = executeSpatialiteQuery(connection, query)
-        if data:
-            nodes = list(zip(*data)[0])
-            self.problem_nodes.extend(data)
-            self.unlink_errors['duplicate geometry'] = nodes
-        progress += steps
-        self.verificationProgress.emit(progress)
-        print "analyse duplicate: %s"%str(time.time()-start_time)
+        tests.append(('duplicate geometry', 'SELECT a."%s", a.line1, a.line2 FROM %s a, %s b WHERE a."%s" <> b."%s" AND ST_Equals(a.%s,b.%s)'\
+                      'AND a.ROWID IN (SELECT ROWID FROM SpatialIndex WHERE f_table_name="%s" AND search_frame=b.%s)'\
+                      %(unlinkid, unlinkname, unlinkname, unlinkid, unlinkid, unlinkgeom, unlinkgeom, unlinkname, unlinkgeom)))
         # no line id
-        start_time = time.time()
-        query = """SELECT "%s", line1, line2 FROM %s WHERE line1 IS NULL OR line2 IS NULL"""%(unlinkid, unlinkname)
-        header, data, error = executeSpatialiteQuery(connection, query)
-        if data:
-            nodes = list(zip(*data)[0])
-            self.problem_nodes.extend(data)
-            self.unlink_errors['no line id'] = nodes
-        progress += steps
-        self.verificationProgress.emit(progress)
-        print "analyse no id: %s"%str(time.time()-start_time)
+        tests.append(('no line id', """SELECT "%s", line1, line2 FROM %s WHERE line1 IS NULL OR line2 IS NULL"""
+                      %(unlinkid, unlinkname)))
         # same line id
-        start_time = time.time()
-        query = """SELECT "%s", line1, line2 FROM %s WHERE line1 = line2"""%(unlinkid, unlinkname)
-        header, data, error = executeSpatialiteQuery(connection, query)
-        if data:
-            nodes = list(zip(*data)[0])
-            self.problem_nodes.extend(data)
-            self.unlink_errors['same line id'] = nodes
-        progress += steps
-        self.verificationProgress.emit(progress)
-        print "analyse no id: %s"%str(time.time()-start_time)
+        tests.append(('same line id', """SELECT "%s", line1, line2 FROM %s WHERE line1 = line2"""%(unlinkid, unlinkname)))
+        result_tests = []
+        #'multiple lines'
+        result_tests.append(('multiple lines', 'SELECT "%s", line1, line2 FROM %s WHERE %s IN (SELECT unlinkid FROM (SELECT unlinkid, count(unlinkid) freq ' \
+                             'FROM temp_unlinks_result GROUP BY unlinkid) WHERE freq > 2)'%(unlinkid, unlinkname, unlinkid)))
+        #'single line'
+        result_tests.append(('single line', 'SELECT "%s", line1, line2 FROM %s WHERE %s IN (SELECT unlinkid FROM (SELECT unlinkid, count(unlinkid) freq ' \
+                             'FROM temp_unlinks_result GROUP BY unlinkid) WHERE freq = 1)'%(unlinkid, unlinkname, unlinkid)))
+        #'no lines'
+        result_tests.append(('no lines', """SELECT "%s", line1, line2 FROM %s WHERE %s NOT IN (SELECT unlinkid FROM temp_unlinks_result GROUP BY unlinkid)"""\
+                             %(unlinkid, unlinkname, unlinkid)))
+        #'unmatched line id'
+        result_tests.append(('unmatched line id', """SELECT b."%s", b.line1, b.line2 FROM temp_unlinks_result a, %s b WHERE a.unlinkid = b."%s" AND (a.lineid <> b.line1 AND a.lineid <> b.line2)"""\
+                             %(unlinkid, unlinkname, unlinkid)))
+        names = [name for name, query in tests + result_tests] + ['unlinks result']
+        pool = SpatialiteQueryPool(getLayerPath(self.unlinks_layer), names)
+        for name, query in tests:
+            pool.submit(name, query)
+        pool.start()
         # create temp table for intersection results
         if self.unlink_type in (QGis.Polygon, QGis.Line):
             operat_a = 'ST_Intersects'
@@ -191,57 +197,29 @@ class UnlinksVerification(QThread):
         query = """CREATE TEMP TABLE "temp_unlinks_result" AS SELECT a.%s unlinkid, b.%s lineid FROM %s a, %s b WHERE %s(a.%s,b.%s%s)"""\
                 %(unlinkid, axialid, unlinkname, axialname, operat_a, unlinkgeom, axialgeom, operat_b)
         header, data, error = executeSpatialiteQuery(connection, query, commit=True)
-        progress += steps
-        self.verificationProgress.emit(progress)
+        self.verificationProgress.emit(10 + int(90 * pool.finish('unlinks result', time.time()-start_time)))
         print "temp unlinks result: %s"%str(time.time()-start_time)
-        #'multiple lines'
-        start_time = time.time()
-        query = 'SELECT "%s", line1, line2 FROM %s WHERE %s IN (SELECT unlinkid FROM (SELECT unlinkid, count(unlinkid) freq ' \
-                'FROM temp_unlinks_result GROUP BY unlinkid) WHERE freq > 2)'%(unlinkid, unlinkname, unlinkid)
-        header, data, error = executeSpatialiteQuery(connection, query)
-        if data:
-            nodes = list(zip(*data)[0])
-            self.problem_nodes.extend(data)
-            self.unlink_errors['multiple lines'] = nodes
-        progress += steps
-        self.verificationProgress.emit(progress)
-        print "analyse multiple lines: %s"%str(time.time()-start_time)
-        #'single line'
-        start_time = time.time()
-        query = 'SELECT "%s", line1, line2 FROM %s WHERE %s IN (SELECT unlinkid FROM (SELECT unlinkid, count(unlinkid) freq ' \
-                'FROM temp_unlinks_result GROUP BY unlinkid) WHERE freq = 1)'%(unlinkid, unlinkname, unlinkid)
-        header, data, error = executeSpatialiteQuery(connection, query)
-        if data:
-            nodes = list(zip(*data)[0])
-            self.problem_nodes.extend(data)
-            self.unlink_errors['single line'] = nodes
-        progress += steps
-        self.verificationProgress.emit(progress)
-        print "analyse single lines: %s"%str(time.time()-start_time)
-        #'no lines'
-        start_time = time.time()
-        query = """SELECT "%s", line1, line2 FROM %s WHERE %s NOT IN (SELECT unlinkid FROM temp_unlinks_result GROUP BY unlinkid)"""\
-                %(unlinkid, unlinkname, unlinkid)
-        header, data, error = executeSpatialiteQuery(connection, query)
-        if data:
-            nodes = list(zip(*data)[0])
-            self.problem_nodes.extend(data)
-            self.unlink_errors['no lines'] = nodes
-        progress += steps
-        self.verificationProgress.emit(progress)
-        print "analyse no lines: %s"%str(time.time()-start_time)
-        #'unmatched line id'
-        start_time = time.time()
-        query = """SELECT b."%s", b.line1, b.line2 FROM temp_unlinks_result a, %s b WHERE a.unlinkid = b."%s" AND (a.lineid <> b.line1 AND a.lineid <> b.line2)"""\
-                %(unlinkid, unlinkname, unlinkid)
-        header, data, error = executeSpatialiteQuery(connection, query)
+        for name, query in result_tests:
+            start_time = time.time()
+            header, data, error = executeSpatialiteQuery(connection, query)
+            self.addSpatialiteErrors(name, data)
+            self.verificationProgress.emit(10 + int(90 * pool.finish(name, time.time()-start_time)))
+            print "analyse %s: %s"%(name, str(time.time()-start_time))
+        queries = dict(tests)
+        for name, header, data, error in pool.getResults():
+            if error:
+                # the check failed in the pool, run it again on this connection, which reports its errors
+                print "analyse %s failed: %s" % (name, error)
+                header, data, error = executeSpatialiteQuery(connection, queries[name])
+            self.addSpatialiteErrors(name, data)
+            self.verificationProgress.emit(10 + int(90 * pool.getProgress()))
+            print "analyse %s: %s"%(name, str(pool.costs[name]))
+
+    def addSpatialiteErrors(self, error, data):
         if data:
             nodes = list(zip(*data)[0])
             self.problem_nodes.extend(data)
-            self.unlink_errors['unmatched line id'] = nodes
-        progress += steps
-        self.verificationProgress.emit(progress)
-        print "analyse unmatched id: %s"%str(time.time()-start_time)
+            self.unlink_errors[error] = nodes
 
 
     # QGIS based functions
@@ -261,6 +239,24 @@ class UnlinksVerification(QThread):
         chunk = 100.0/float(self.unlinks_layer.featureCount())
         steps = chunk/6.0
         progress = 0.0
+        if self.user_id == '':
+            request = QgsFeatureRequest().setSubsetOfAttributes([])
+        else:
+            field = getFieldIndex(self.unlinks_layer, self.user_id)
+            request = QgsFeatureRequest().setSubsetOfAttributes([field])
+        # duplicate geometry with other unlinks, from a single pass over the unlinks
+        start_time = time.time()
+        geometries = []
+        for feature in self.unlinks_layer.getFeatures(request):
+            if self.user_id == '':
+                id = feature.id()
+            else:
+                id = feature.attribute(self.user_id)
+            if feature.geometry():
+                geometries.append((id, QgsGeometry(feature.geometry())))
+        duplicates = getDuplicateGeometries(geometries, 0.000001)
+        geometries = None
+        print "analyse duplicate: %s"%str(time.time()-start_time)
         if self.user_id == '':
             features = self.unlinks_layer.getFeatures(QgsFeatureRequest().setSubsetOfAttributes([line1,line2]))
         else:
@@ -279,7 +275,7 @@ class UnlinksVerification(QThread):
             # geometry is valid (generally)
             if not geom.isGeosValid() or geom.isGeosEmpty():
                 has_problem = True
-                self.axial_errors['invalid geometry'].append(id)
+                self.unlink_errors['invalid geometry'].append(id)
             progress += steps
             self.verificationProgress.emit(progress)
             # no line id
@@ -295,20 +291,9 @@ class UnlinksVerification(QThread):
             progress += steps
             self.verificationProgress.emit(progress)
             # duplicate geometry with other unlinks
-            if self.user_id == '':
-                request = QgsFeatureRequest().setSubsetOfAttributes([])
-            else:
-                field = getFieldIndex(self.unlinks_layer, self.user_id)
-                request = QgsFeatureRequest().setSubsetOfAttributes([field])
-            targets = self.unlinks_layer.getFeatures(request)
-            for target in targets:
-                if self.user_id == '':
-                    tid = target.id()
-                else:
-                    tid = target.attribute(self.user_id)
-                if tid != id and geom.isGeosEqual(target.geometry()):
-                    has_problem = True
-                    self.unlink_errors['duplicate geometry'].append(id)
+            if id in duplicates:
+                has_problem = True
+                self.unlink_errors['duplicate geometry'].extend([id] * len(duplicates[id]))
             progress += steps
             self.verificationProgress.emit(progress)
             # get intersection results
@@ -365,12 +350,70 @@ class UnlinksVerification(QThread):
 
     # PostGIS based functions
     #
-    def postgisPrepareUnlinks(self):
-        pass
-
-
-    def postgisTestUnlinks(self):
-        pass
+    def postgisTestUnlinks(self, connection, unlinkname, unlinkgeom, axialname, axialgeom):
+        # this function checks the unlinks in the database, only the ids are returned
+        threshold = self.verification_settings['unlink_dist']
+        if self.user_id == '':
+            unlinkid = getPostgisKeyColumn(self.unlinks_layer)
+        else:
+            unlinkid = self.user_id
+        if self.axial_id == '':
+            axialid = getPostgisKeyColumn(self.axial_layer)
+        else:
+            axialid = self.axial_id
+        steps = 90.0/9.0
+        progress = 10.0
+        # lines near each unlink, using the spatial index
+        start_time = time.time()
+        if self.unlink_type in (QGis.Polygon, QGis.Line):
+            operat = 'ST_Intersects(a."%s",b."%s")'%(unlinkgeom, axialgeom)
+        else:
+            operat = 'ST_DWithin(a."%s",b."%s",%s)'%(unlinkgeom, axialgeom, threshold)
+        header, data, error = executePostgisQuery(connection, """DROP TABLE IF EXISTS pg_temp."temp_unlinks_result" """)
+        query = """CREATE TEMP TABLE temp_unlinks_result AS SELECT a."%s" unlinkid, b."%s" lineid FROM %s a JOIN %s b ON %s"""\
+                %(unlinkid, axialid, unlinkname, axialname, operat)
+        header, data, error = executePostgisQuery(connection, query, commit=True)
+        query = """CREATE INDEX ON temp_unlinks_result (unlinkid)"""
+        header, data, error = executePostgisQuery(connection, query, commit=True)
+        progress += steps
+        self.verificationProgress.emit(progress)
+        print "temp unlinks result: %s"%str(time.time()-start_time)
+        tests = []
+        # geometry is valid (generally)
+        tests.append(('invalid geometry', """SELECT "%s", line1, line2 FROM %s WHERE NOT ST_IsSimple("%s") OR NOT ST_IsValid("%s")"""
+                      %(unlinkid, unlinkname, unlinkgeom, unlinkgeom)))
+        # duplicate geometry
+        tests.append(('duplicate geometry', 'SELECT a."%s", a.line1, a.line2 FROM %s a JOIN %s b '\
+                      'ON a."%s" && b."%s" AND a."%s" <> b."%s" AND ST_Equals(a."%s",b."%s")'\
+                      %(unlinkid, unlinkname, unlinkname, unlinkgeom, unlinkgeom, unlinkid, unlinkid, unlinkgeom, unlinkgeom)))
+        # no line id
+        tests.append(('no line id', """SELECT "%s", line1, line2 FROM %s WHERE line1 IS NULL OR line2 IS NULL"""
+                      %(unlinkid, unlinkname)))
+        # same line id
+        tests.append(('same line id', """SELECT "%s", line1, line2 FROM %s WHERE line1 = line2"""%(unlinkid, unlinkname)))
+        #'multiple lines'
+        tests.append(('multiple lines', 'SELECT "%s", line1, line2 FROM %s WHERE "%s" IN (SELECT unlinkid '\
+                      'FROM temp_unlinks_result GROUP BY unlinkid HAVING count(*) > 2)'%(unlinkid, unlinkname, unlinkid)))
+        #'single line'
+        tests.append(('single line', 'SELECT "%s", line1, line2 FROM %s WHERE "%s" IN (SELECT unlinkid '\
+                      'FROM temp_unlinks_result GROUP BY unlinkid HAVING count(*) = 1)'%(unlinkid, unlinkname, unlinkid)))
+        #'no lines'
+        tests.append(('no lines', 'SELECT "%s", line1, line2 FROM %s a WHERE NOT EXISTS '\
+                      '(SELECT 1 FROM temp_unlinks_result r WHERE r.unlinkid = a."%s")'%(unlinkid, unlinkname, unlinkid)))
+        #'unmatched line id'
+        tests.append(('unmatched line id', 'SELECT b."%s", b.line1, b.line2 FROM temp_unlinks_result a, %s b '\
+                      'WHERE a.unlinkid = b."%s" AND (a.lineid <> b.line1 AND a.lineid <> b.line2)'\
+                      %(unlinkid, unlinkname, unlinkid)))
+        for error, query in tests:
+            start_time = time.time()
+            header, data, error_text = executePostgisQuery(connection, query)
+            if data:
+                nodes = list(zip(*data)[0])
+                self.problem_nodes.extend(data)
+                self.unlink_errors[error] = nodes
+            progress += steps
+            self.verificationProgress.emit(progress)
+            print "analyse %s: %s"%(error, str(time.time()-start_time))
 
 
 class UnlinksIdUpdate(QThread):
@@ -398,7 +441,8 @@ class UnlinksIdUpdate(QThread):
         unlinktype = self.unlinks_layer.geometryType()
         datastore = self.unlinks_layer.storageType()
         if 'spatialite' in datastore.lower():
-            self.spatialiteUpdateIDs(unlinktype)
+            if not self.spatialiteUpdateIDs(unlinktype):
+                return
         #elif 'postgresql' in datastore.lower():
             # newfeature: support postgis in unlink id update
         else:
@@ -419,7 +463,7 @@ class UnlinksIdUpdate(QThread):
         axialname = getLayerTableName(self.axial_layer)
         if not testSameDatabase([self.unlinks_layer, self.axial_layer]):
             self.verificationError.emit("The map layer must be in the same database as the unlinks layer.")
-            return
+            return False
         connection = getLayerConnection(self.unlinks_layer)
         # get the geometry column name and other properties
         unlinkgeom = getSpatialiteGeometryColumn(connection, unlinkname)
@@ -428,10 +472,6 @@ class UnlinksIdUpdate(QThread):
         added = addSpatialiteColumns(connection, unlinkname, ['line1','line2'], [QVariant.Int,QVariant.Int])
         self.verificationProgress.emit(33)
         # prepare variables for update query
-        if self.user_id == '':
-            unlinkid = 'ROWID'
-        else:
-            unlinkid = self.user_id
         if self.axial_id == '':
             axialid = 'ROWID'
         else:
@@ -442,85 +482,101 @@ class UnlinksIdUpdate(QThread):
         else:
             operat_a = 'PtDistWithin'
             operat_b = ',%s' % self.threshold
-        # update line id columns
-        query = 'UPDATE %s SET line1 = (SELECT c.line FROM (SELECT b.%s unlink, a.%s line FROM ' \
-                '%s a, %s b WHERE %s(a.%s,b.%s%s) ORDER BY b.%s, a.%s ASC)' \
-                ' c WHERE c.unlink = %s.%s)'\
-                % (unlinkname, unlinkid, axialid, axialname, unlinkname, operat_a, axialgeom, unlinkgeom, operat_b, unlinkid, axialid, unlinkname, unlinkid)
-        header, data, error = executeSpatialiteQuery(connection, query, commit=True)
+        if unlinktype in (QGis.Polygon, QGis.Line) or self.threshold <= 0:
+            frame = 'b.%s' % unlinkgeom
+        else:
+            frame = 'BuildMbr(MbrMinX(b.%s)-%s, MbrMinY(b.%s)-%s, MbrMaxX(b.%s)+%s, MbrMaxY(b.%s)+%s)'\
+                    %(unlinkgeom, self.threshold, unlinkgeom, self.threshold, unlinkgeom, self.threshold, unlinkgeom,
+                      self.threshold)
+        # find the lines of every unlink once, using the spatial index.
+        # the unlinks are matched by ROWID, their id column may have duplicate values
+        header, data, error = executeSpatialiteQuery(connection, """DROP TABLE IF EXISTS "temp_unlinks_lines" """)
+        query = """CREATE TEMP TABLE "temp_unlinks_lines" (unlink INTEGER, line1 INTEGER, line2 INTEGER)"""
+        header, data, error = executeSpatialiteQuery(connection, query)
+        if not error:
+            query = 'INSERT INTO "temp_unlinks_lines" SELECT b.ROWID, MIN(a.%s), MAX(a.%s) FROM %s a, %s b WHERE %s(a.%s,b.%s%s) '\
+                    'AND a.ROWID IN (SELECT ROWID FROM SpatialIndex WHERE f_table_name="%s" AND search_frame=%s) '\
+                    'GROUP BY b.ROWID'\
+                    % (axialid, axialid, axialname, unlinkname, operat_a, axialgeom, unlinkgeom, operat_b,
+                       axialname, frame)
+            header, data, error = executeSpatialiteQuery(connection, query, commit=True)
+        if not error:
+            query = """CREATE INDEX "temp_unlinks_lines_idx" ON "temp_unlinks_lines" (unlink)"""
+            header, data, error = executeSpatialiteQuery(connection, query)
+        if error:
+            connection.close()
+            self.verificationError.emit("Unable to find the lines of the unlinks.")
+            return False
         self.verificationProgress.emit(66)
-        query = 'UPDATE %s SET line2 = (SELECT c.line FROM (SELECT b.%s unlink, a.%s line FROM ' \
-                '%s a, %s b WHERE %s(a.%s,b.%s%s) ORDER BY b.%s, a.%s DESC)' \
-                ' c WHERE c.unlink = %s.%s)'\
-                % (unlinkname, unlinkid, axialid, axialname, unlinkname, operat_a, axialgeom, unlinkgeom, operat_b, unlinkid, axialid, unlinkname, unlinkid)
+        # update line id columns
+        query = 'UPDATE %s SET line1 = (SELECT line1 FROM "temp_unlinks_lines" WHERE unlink = %s.ROWID), '\
+                'line2 = (SELECT line2 FROM "temp_unlinks_lines" WHERE unlink = %s.ROWID)'\
+                % (unlinkname, unlinkname, unlinkname)
         header, data, error = executeSpatialiteQuery(connection, query, commit=True)
         query = """SELECT UpdateLayerStatistics("%s")""" % unlinkname
         header, data, error = executeSpatialiteQuery(connection,query)
         connection.close()
         self.verificationProgress.emit(99)
+        return True
 
 
     def qgisUpdateIDs(self, unlinktype):
-        # create spatial index
-        #unlinksindex = createIndex(unlinks_layer)
-        axialindex = createIndex(self.axial_layer)
         # add line id columns if necessary
         addFields(self.unlinks_layer,['line1','line2'],[QVariant.Int,QVariant.Int])
         line1 = getFieldIndex(self.unlinks_layer, 'line1')
         line2 = getFieldIndex(self.unlinks_layer, 'line2')
-        if self.user_id == '':
-            features = self.unlinks_layer.getFeatures(QgsFeatureRequest().setSubsetOfAttributes([line1,line2]))
+        # read the axial lines once, into a spatial index
+        start_time = time.time()
+        axialindex = QgsSpatialIndex()
+        lines = {}
+        if self.axial_id == '':
+            request = QgsFeatureRequest().setSubsetOfAttributes([])
         else:
-            field = getFieldIndex(self.unlinks_layer, self.user_id)
-            features = self.unlinks_layer.getFeatures(QgsFeatureRequest().setSubsetOfAttributes([field,line1,line2]))
-        # run unlinks tests
-        chunk = 100.0/float(self.unlinks_layer.featureCount())
-        steps = chunk/3.0
-        progress = 0.0
+            request = QgsFeatureRequest().setSubsetOfAttributes([getFieldIndex(self.axial_layer, self.axial_id)])
+        for line in self.axial_layer.getFeatures(request):
+            if not line.geometry():
+                continue
+            if self.axial_id == '':
+                id_b = line.id()
+            else:
+                id_b = line.attribute(self.axial_id)
+            lines[line.id()] = (id_b, QgsGeometry(line.geometry()))
+            axialindex.insertFeature(line)
+        print "Preparing the map: %s"%str(time.time()-start_time)
+        self.verificationProgress.emit(20)
+        # find the lines of every unlink
+        start_time = time.time()
+        changes = {}
+        steps = 70.0/max(1.0, float(self.unlinks_layer.featureCount()))
+        progress = 20.0
+        features = self.unlinks_layer.getFeatures(QgsFeatureRequest().setSubsetOfAttributes([]))
         for feature in features:
             geom = feature.geometry()
+            if not geom:
+                continue
             # get intersection results
             if unlinktype == QGis.Point and self.threshold > 0.0:
                 buff = geom.buffer(self.threshold,4)
             else:
                 buff = geom
-            box = buff.boundingBox()
-            request = QgsFeatureRequest()
-            if axialindex:
-                # should be faster to retrieve from index (if available)
-                ints = axialindex.intersects(box)
-                request.setFilterFids(ints)
-            else:
-                # can retrieve objects using bounding box
-                request.setFilterRect(box)
-            if self.axial_id == '':
-                request.setSubsetOfAttributes([])
-            else:
-                field = getFieldIndex(self.axial_layer, self.axial_id)
-                request.setSubsetOfAttributes([field])
-            axiallines = self.axial_layer.getFeatures(request)
-            progress += steps
-            self.verificationProgress.emit(progress)
-            # parse intersection results
             intersects = []
-            for line in axiallines:
-                if self.axial_id == '':
-                    id_b = line.id()
-                else:
-                    id_b = line.attribute(self.axial_id)
-                if buff.intersects(line.geometry()):
+            for fid in axialindex.intersects(buff.boundingBox()):
+                id_b, line = lines[fid]
+                if buff.intersects(line):
                     intersects.append(id_b)
-            progress += steps
-            self.verificationProgress.emit(progress)
-            # update line ids in unlinks table
+            # line ids in unlinks table
             if len(intersects) > 0:
+                intersects.sort()
                 if len(intersects) == 1:
-                    attrs = {line1:intersects[0]}
-                    #feature.setAttribute(line1,intersects[0])
+                    changes[feature.id()] = {line1:intersects[0]}
                 else:
-                    attrs = {line1:intersects[0],line2:intersects[1]}
-                    #feature.setAttribute(line2,intersects[1])
-                self.unlinks_layer.dataProvider().changeAttributeValues({feature.id():attrs})
+                    changes[feature.id()] = {line1:intersects[0],line2:intersects[1]}
             progress += steps
-            self.verificationProgress.emit(progress)
-        self.unlinks_layer.updateFields()
\ No newline at end of file
+            self.verificationProgress.emit(int(progress))
+        print "Finding lines: %s"%str(time.time()-start_time)
+        # update all the unlinks at once
+        start_time = time.time()
+        if changes:
+            self.unlinks_layer.dataProvider().changeAttributeValues(changes)
+        self.unlinks_layer.updateFields()
+        print "Updating unlinks: %s"%str(time.time()-start_time)
@@ -26,8 +26,8 @@ except AttributeError:
 class Ui_DepthmapAdvancedDialog(object):
     def setupUi(self, DepthmapAdvancedDialog):
         DepthmapAdvancedDialog.setObjectName(_fromUtf8("DepthmapAdvancedDialog"))
-        DepthmapAdvancedDialog.resize(280, 230)
-        DepthmapAdvancedDialog.setMinimumSize(QtCore.QSize(280, 230))
+        DepthmapAdvancedDialog.resize(280, 260)
+        DepthmapAdvancedDialog.setMinimumSize(QtCore.QSize(280, 260))
         self.gridLayout = QtGui.QGridLayout(DepthmapAdvancedDialog)
         self.gridLayout.setObjectName(_fromUtf8("gridLayout"))
         self.axialCalculateFullCheck = QtGui.QCheckBox(DepthmapAdvancedDialog)
@@ -57,11 +57,19 @@ class Ui_DepthmapAdvancedDialog(object):
         self.axialRadiusCombo.addItem(_fromUtf8(""))
         self.axialRadiusCombo.addItem(_fromUtf8(""))
         self.gridLayout.addWidget(self.axialRadiusCombo, 4, 1, 1, 1)
+        self.axialEngineLabel = QtGui.QLabel(DepthmapAdvancedDialog)
+        self.axialEngineLabel.setObjectName(_fromUtf8("axialEngineLabel"))
+        self.gridLayout.addWidget(self.axialEngineLabel, 5, 0, 1, 1)
+        self.axialEngineCombo = QtGui.QComboBox(DepthmapAdvancedDialog)
+        self.axialEngineCombo.setObjectName(_fromUtf8("axialEngineCombo"))
+        self.axialEngineCombo.addItem(_fromUtf8(""))
+        self.axialEngineCombo.addItem(_fromUtf8(""))
+        self.gridLayout.addWidget(self.axialEngineCombo, 5, 1, 1, 1)
         self.closeButtonBox = QtGui.QDialogButtonBox(DepthmapAdvancedDialog)
         self.closeButtonBox.setOrientation(QtCore.Qt.Horizontal)
         self.closeButtonBox.setStandardButtons(QtGui.QDialogButtonBox.Cancel|QtGui.QDialogButtonBox.Ok)
         self.closeButtonBox.setObjectName(_fromUtf8("closeButtonBox"))
-        self.gridLayout.addWidget(self.closeButtonBox, 5, 0, 1, 2)
+        self.gridLayout.addWidget(self.closeButtonBox, 6, 0, 1, 2)
         self.gridLayout.setColumnMinimumWidth(1, 1)
         self.gridLayout.setColumnStretch(1, 1)
 
@@ -83,5 +91,8 @@ class Ui_DepthmapAdvancedDialog(object):
         self.axialRadiusCombo.setItemText(0, _translate("DepthmapAdvancedDialog", "Topological", None))
         self.axialRadiusCombo.setItemText(1, _translate("DepthmapAdvancedDialog", "Angular", None))
         self.axialRadiusCombo.setItemText(2, _translate("DepthmapAdvancedDialog", "Metric", None))
+        self.axialEngineLabel.setText(_translate("DepthmapAdvancedDialog", "Analysis engine:", None))
+        self.axialEngineCombo.setItemText(0, _translate("DepthmapAdvancedDialog", "depthmapX", None))
+        self.axialEngineCombo.setItemText(1, _translate("DepthmapAdvancedDialog", "Built-in", None))
 
 import resources_rc
@@ -79,6 +79,7 @@ class ExplorerTool(QObject):
         self.selection_values = []
         self.selection_ids = []
         self.layer_ids = dict()
+        self.layer_index = dict()
         self.updateActionConnections(0)
         self.isVisible = False
 
@@ -97,6 +98,7 @@ class ExplorerTool(QObject):
             self.attribute_values = []
             self.selection_values = []
             self.layer_ids = dict()
+            self.layer_index = dict()
         self.isVisible = False
 
     def onShow(self):
@@ -124,6 +126,7 @@ class ExplorerTool(QObject):
             self.attribute_values = []
             self.selection_values = []
             self.layer_ids = dict()
+            self.layer_index = dict()
         self.isVisible = False
 
     ##
@@ -458,11 +461,11 @@ class ExplorerTool(QObject):
                         self.attributeCharts.drawScatterplot(values, yvalues, ids, symbols)
                         # plot chart of selected objects
                         if len(self.selection_values) > 0:
-                            all_ids = self.layer_ids[self.current_layer.name()]
+                            all_ids = self.layer_index[self.current_layer.name()]
                             indices = []
                             for id in self.selection_ids:
                                 if id in all_ids:
-                                    indices.append(all_ids.index(id))
+                                    indices.append(all_ids[id])
                             self.attributeCharts.setScatterplotSelection(indices)
                     else:
                         self.dlg.clearDependentValues()
@@ -485,8 +488,9 @@ class ExplorerTool(QObject):
             values = getFieldValues(self.current_layer, attribute["name"], null=True, id=False)
         else:
             values, ids = getFieldValues(self.current_layer, attribute["name"], null=True, id=True)
-            # store retrieved ids for charts
+            # store retrieved ids for charts, with their row index
             self.layer_ids[self.current_layer.name()] = ids
+            self.layer_index[self.current_layer.name()] = getIdIndex(ids)
         nan_values = filter(None,values)
         # calculate the stats
         stats = dict()
@@ -0,0 +1,1300 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ essTools
+                                 A QGIS plugin
+ Set of tools for space syntax network analysis and results exploration
+                              -------------------
+        begin                : 2014-04-01
+        copyright            : (C) 2014 by Jorge Gil, UCL
+        email                : jorge.gil@ucl.ac.uk
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+# Graph construction and analysis functions on NumPy arrays.
+# This module must not import PyQt or QGIS, so that it can run on headless machines.
+
+import numpy as np
+
+import os
+import sys
+import glob
+import shutil
+import hashlib
+import tempfile
+import threading
+import traceback
+import subprocess
+import multiprocessing
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+#------------------------------
+# Graph construction functions
+#------------------------------
+def iterCandidatePairs(coords, tolerance=0.0, chunk=1000000):
+    """Generate batches of index arrays (a, b) of lines with bounding boxes closer than tolerance
+    :param coords: array (N,4) with x1, y1, x2, y2 of each line
+    :param tolerance: distance added around each bounding box
+    :param chunk: maximum number of candidate pairs generated at once
+    """
+    n = len(coords)
+    if n < 2:
+        return
+    xmin = np.minimum(coords[:, 0], coords[:, 2]) - tolerance
+    xmax = np.maximum(coords[:, 0], coords[:, 2]) + tolerance
+    ymin = np.minimum(coords[:, 1], coords[:, 3]) - tolerance
+    ymax = np.maximum(coords[:, 1], coords[:, 3]) + tolerance
+    # sweep along x: each line is paired with the following lines that start before it ends
+    order = np.argsort(xmin, kind='mergesort')
+    sorted_xmin = xmin[order]
+    stop = np.searchsorted(sorted_xmin, xmax[order], side='right')
+    count = stop - np.arange(1, n + 1)
+    count[count < 0] = 0
+    start = 0
+    while start < n:
+        # group sweep positions so that each batch has at most chunk candidates
+        cum = np.cumsum(count[start:])
+        end = start + max(1, int(np.searchsorted(cum, chunk, side='right')))
+        cnt = count[start:end]
+        total = int(cnt.sum())
+        if total > 0:
+            pos = np.repeat(np.arange(start, end), cnt)
+            offset = np.arange(total) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+            a = order[pos]
+            b = order[pos + 1 + offset]
+            # bounding box filter on y
+            keep = (ymin[a] <= ymax[b]) & (ymin[b] <= ymax[a])
+            yield a[keep], b[keep]
+        start = end
+
+
+def getLineIntersections(coords, tolerance=0.0, chunk=1000000):
+    """Return array (E,2) of index pairs (i < j) of two point lines that intersect or touch
+    :param coords: array (N,4) with x1, y1, x2, y2 of each line
+    :param tolerance: distance below which lines are considered touching
+    :param chunk: maximum number of candidate pairs tested at once
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    n = len(coords)
+    edges = []
+    for a, b in iterCandidatePairs(coords, tolerance, chunk):
+        hit = testSegmentsIntersect(coords[a], coords[b], tolerance)
+        if hit.any():
+            edges.append(np.column_stack((np.minimum(a[hit], b[hit]), np.maximum(a[hit], b[hit]))))
+    if edges:
+        keys = np.unique(getEdgeKeys(n, np.vstack(edges)))
+        return np.column_stack((keys // n, keys % n))
+    return np.zeros((0, 2), dtype=np.int64)
+
+
+def getSegmentPairs(coords, owners, tolerance=0.0, chunk=1000000):
+    """Return arrays a, b and distance of the pairs of segments from different lines closer than tolerance
+    :param coords: array (M,4) with x1, y1, x2, y2 of each segment
+    :param owners: array (M,) with the line of each segment
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    owners = np.asarray(owners, dtype=np.int64)
+    seg_a = []
+    seg_b = []
+    dist = []
+    for a, b in iterCandidatePairs(coords, tolerance, chunk):
+        keep = owners[a] != owners[b]
+        a = a[keep]
+        b = b[keep]
+        d = getSegmentsGap(coords[a], coords[b])
+        near = d <= tolerance
+        seg_a.append(a[near])
+        seg_b.append(b[near])
+        dist.append(d[near])
+    if seg_a:
+        return np.concatenate(seg_a), np.concatenate(seg_b), np.concatenate(dist)
+    return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+
+def testSegmentsIntersect(seg_a, seg_b, tolerance=0.0):
+    """Vectorised test of pairs of segments, returns boolean array
+    :param seg_a: array (M,4) with x1, y1, x2, y2
+    :param seg_b: array (M,4) with x1, y1, x2, y2
+    :param tolerance: segments closer than this distance are considered intersecting
+    """
+    p1 = seg_a[:, 0:2]
+    p2 = seg_a[:, 2:4]
+    p3 = seg_b[:, 0:2]
+    p4 = seg_b[:, 2:4]
+    d1 = _orientation(p3, p4, p1)
+    d2 = _orientation(p3, p4, p2)
+    d3 = _orientation(p1, p2, p3)
+    d4 = _orientation(p1, p2, p4)
+    proper = (((d1 > 0) & (d2 < 0)) | ((d1 < 0) & (d2 > 0))) & (((d3 > 0) & (d4 < 0)) | ((d3 < 0) & (d4 > 0)))
+    # touching and collinear cases resolve to a zero distance between the segments
+    near = ~proper
+    if near.any():
+        dist = getSegmentsDistance(seg_a[near], seg_b[near])
+        proper[near] = dist <= tolerance
+    return proper
+
+
+def getSegmentsGap(seg_a, seg_b):
+    """Return minimum distance between pairs of segments, zero where they cross"""
+    dist = np.zeros(len(seg_a), dtype=np.float64)
+    if len(seg_a) > 0:
+        near = ~testSegmentsIntersect(seg_a, seg_b)
+        dist[near] = getSegmentsDistance(seg_a[near], seg_b[near])
+    return dist
+
+
+def getCollinearOverlaps(seg_a, seg_b, tolerance=1e-9):
+    """Return length shared by pairs of collinear segments, zero for segments that are not collinear"""
+    dx = seg_a[:, 2] - seg_a[:, 0]
+    dy = seg_a[:, 3] - seg_a[:, 1]
+    length = np.hypot(dx, dy)
+    overlap = np.zeros(len(seg_a), dtype=np.float64)
+    valid = length > 0
+    if not valid.any():
+        return overlap
+    ux = dx[valid] / length[valid]
+    uy = dy[valid] / length[valid]
+    a = seg_a[valid]
+    b = seg_b[valid]
+    # distance of the end points of b from the line through a, and their position along a
+    off1 = np.abs((b[:, 0] - a[:, 0]) * uy - (b[:, 1] - a[:, 1]) * ux)
+    off2 = np.abs((b[:, 2] - a[:, 0]) * uy - (b[:, 3] - a[:, 1]) * ux)
+    t1 = (b[:, 0] - a[:, 0]) * ux + (b[:, 1] - a[:, 1]) * uy
+    t2 = (b[:, 2] - a[:, 0]) * ux + (b[:, 3] - a[:, 1]) * uy
+    shared = np.minimum(length[valid], np.maximum(t1, t2)) - np.maximum(0.0, np.minimum(t1, t2))
+    shared[(off1 > tolerance) | (off2 > tolerance) | (shared < tolerance)] = 0.0
+    overlap[valid] = shared
+    return overlap
+
+
+def testEqualLines(vertices, vptr, pairs):
+    """Vectorised test of pairs of lines with the same vertices, in the same or reverse order
+    :param vertices: array (V,2) with the packed vertices of all the lines
+    :param vptr: array (N+1,) with the position of the first vertex of each line
+    :param pairs: array (E,2) of line index pairs
+    """
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    a = pairs[:, 0]
+    b = pairs[:, 1]
+    cnt = vptr[a + 1] - vptr[a]
+    equal = (cnt == vptr[b + 1] - vptr[b]) & (cnt > 0)
+    if not equal.any():
+        return equal
+    a = a[equal]
+    b = b[equal]
+    cnt = cnt[equal]
+    total = int(cnt.sum())
+    first = np.cumsum(cnt) - cnt
+    offset = np.arange(total) - np.repeat(first, cnt)
+    va = vertices[np.repeat(vptr[a], cnt) + offset]
+    forward = np.all(va == vertices[np.repeat(vptr[b], cnt) + offset], axis=1)
+    reverse = np.all(va == vertices[np.repeat(vptr[b + 1] - 1, cnt) - offset], axis=1)
+    equal[equal] = np.logical_and.reduceat(forward, first) | np.logical_and.reduceat(reverse, first)
+    return equal
+
+
+def getSegmentsDistance(seg_a, seg_b):
+    """Return minimum distance between pairs of non crossing segments"""
+    d = np.minimum(
+        np.minimum(getPointSegmentDistance(seg_a[:, 0:2], seg_b), getPointSegmentDistance(seg_a[:, 2:4], seg_b)),
+        np.minimum(getPointSegmentDistance(seg_b[:, 0:2], seg_a), getPointSegmentDistance(seg_b[:, 2:4], seg_a)))
+    return d
+
+
+def _orientation(a, b, c):
+    return (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
+
+
+def getPointSegmentDistance(pt, seg):
+    """Return distance between pairs of points (M,2) and segments (M,4)"""
+    dx = seg[:, 2] - seg[:, 0]
+    dy = seg[:, 3] - seg[:, 1]
+    length = dx * dx + dy * dy
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = ((pt[:, 0] - seg[:, 0]) * dx + (pt[:, 1] - seg[:, 1]) * dy) / length
+    t = np.where(length > 0, np.clip(t, 0.0, 1.0), 0.0)
+    px = seg[:, 0] + t * dx - pt[:, 0]
+    py = seg[:, 1] + t * dy - pt[:, 1]
+    return np.sqrt(px * px + py * py)
+
+
+def getEdgeKeys(n, edges):
+    """Return integer keys of undirected edges, independent of the order of the pair"""
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    return np.minimum(edges[:, 0], edges[:, 1]) * n + np.maximum(edges[:, 0], edges[:, 1])
+
+
+def updateEdges(n, edges, unlinks=None, links=None):
+    """Remove unlinks from and add links to an array of edges, using row indices"""
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    if unlinks is not None and len(unlinks) > 0:
+        keep = ~np.in1d(getEdgeKeys(n, edges), getEdgeKeys(n, unlinks))
+        edges = edges[keep]
+    if links is not None and len(links) > 0:
+        # add each link once, unless the lines are already joined
+        links = np.asarray(links, dtype=np.int64).reshape(-1, 2)
+        links = links[links[:, 0] != links[:, 1]]
+        keys, first = np.unique(getEdgeKeys(n, links), return_index=True)
+        first = first[~np.in1d(keys, getEdgeKeys(n, edges))]
+        edges = np.vstack((edges, links[np.sort(first)]))
+    return edges
+
+
+def buildAdjacency(n, edges):
+    """Return symmetric CSR adjacency (indptr, indices) of n nodes from array (E,2) of edges"""
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    keys = np.unique(getEdgeKeys(n, edges))
+    a = keys // n
+    b = keys % n
+    src = np.concatenate((a, b))
+    dst = np.concatenate((b, a))
+    order = np.lexsort((dst, src))
+    indices = dst[order]
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    return indptr, indices
+
+
+def getComponents(n, edges):
+    """Return array (N,) with the connected component of each node, labelled by its lowest node
+    union-find over arrays: every pass links the root of each edge end to the lowest root,
+    then compresses the paths so that every node points at its root
+    """
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    parent = np.arange(n, dtype=np.int64)
+    a = edges[:, 0]
+    b = edges[:, 1]
+    while True:
+        root_a = parent[a]
+        root_b = parent[b]
+        diff = root_a != root_b
+        if not diff.any():
+            break
+        low = np.minimum(root_a[diff], root_b[diff])
+        high = np.maximum(root_a[diff], root_b[diff])
+        np.minimum.at(parent, high, low)
+        # path compression
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+        # keep only the edges that still join different components
+        a = a[diff]
+        b = b[diff]
+    return parent
+
+
+#------------------------------
+# Topology cache functions
+#------------------------------
+# number of topologies kept in a cache folder
+CACHE_SIZE = 20
+
+
+def getContentKey(*items):
+    """Return hex digest identifying the content of arrays and values, e.g. the geometry of a map"""
+    digest = hashlib.sha1()
+    for item in items:
+        if isinstance(item, np.ndarray):
+            item = np.ascontiguousarray(item)
+            digest.update(str(item.dtype) + str(item.shape))
+            digest.update(item.view(np.uint8))
+        else:
+            digest.update(repr(item))
+    return digest.hexdigest()
+
+
+def loadTopology(path, key):
+    """Return dict of arrays cached under key in folder path, or None if not cached"""
+    filename = os.path.join(path, key + '.npz')
+    if not os.path.isfile(filename):
+        return None
+    try:
+        data = np.load(filename)
+        arrays = dict((name, data[name]) for name in data.files)
+        data.close()
+        # the most recently used files are kept
+        os.utime(filename, None)
+    except (IOError, OSError, ValueError):
+        return None
+    return arrays
+
+
+def saveTopology(path, key, arrays, size=CACHE_SIZE):
+    """Cache dict of arrays under key in folder path, removing the least recently used files"""
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        np.savez_compressed(os.path.join(path, key + '.npz'), **arrays)
+        files = sorted(glob.glob(os.path.join(path, '*.npz')), key=os.path.getmtime)
+        for filename in files[:-size]:
+            os.remove(filename)
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def getCachedLineIntersections(coords, path=None):
+    """Return array (E,2) of intersecting lines, as getLineIntersections, reusing the edges
+    cached in folder path if the lines have not changed since
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if not path:
+        return getLineIntersections(coords)
+    key = getContentKey('line intersections', coords)
+    cached = loadTopology(path, key)
+    if cached is not None:
+        return cached['edges']
+    edges = getLineIntersections(coords)
+    saveTopology(path, key, {'edges': edges})
+    return edges
+
+
+#------------------------------
+# Graph analysis functions
+#------------------------------
+def bfsBatch(indptr, indices, sources, radius=0, betweenness=False):
+    """Breadth-first search from a batch of sources at once
+    :return: depth array (B,N) with -1 for unreachable nodes, path count array (B,N) or None,
+    list of (parent, child) flat key arrays per level for the dependency accumulation
+    """
+    n = len(indptr) - 1
+    sources = np.asarray(sources, dtype=np.int64)
+    batch = len(sources)
+    depth = np.empty(batch * n, dtype=np.int32)
+    depth.fill(-1)
+    start = np.arange(batch, dtype=np.int64) * n + sources
+    depth[start] = 0
+    sigma = None
+    if betweenness:
+        sigma = np.zeros(batch * n, dtype=np.float64)
+        sigma[start] = 1.0
+    levels = []
+    frontier = start
+    d = 0
+    while frontier.size > 0 and (radius == 0 or d < radius):
+        b = frontier // n
+        v = frontier % n
+        deg = indptr[v + 1] - indptr[v]
+        total = int(deg.sum())
+        if total == 0:
+            break
+        offset = np.arange(total) - np.repeat(np.cumsum(deg) - deg, deg)
+        parent = np.repeat(frontier, deg)
+        child = np.repeat(b, deg) * n + indices[np.repeat(indptr[v], deg) + offset]
+        new = np.unique(child[depth[child] == -1])
+        depth[new] = d + 1
+        if betweenness:
+            dag = depth[child] == d + 1
+            parent = parent[dag]
+            child = child[dag]
+            np.add.at(sigma, child, sigma[parent])
+            levels.append((parent, child))
+        frontier = new
+        d += 1
+    depth = depth.reshape(batch, n)
+    if sigma is not None:
+        sigma = sigma.reshape(batch, n)
+    return depth, sigma, levels
+
+
+def dependencyBatch(sigma, levels, radius=0):
+    """Brandes dependency accumulation of a batch, restricted to nodes within radius"""
+    batch, n = sigma.shape
+    flat_sigma = sigma.ravel()
+    delta = np.zeros(batch * n, dtype=np.float64)
+    if radius > 0:
+        levels = levels[:radius]
+    for parent, child in reversed(levels):
+        coeff = flat_sigma[parent] / flat_sigma[child] * (1.0 + delta[child])
+        np.add.at(delta, parent, coeff)
+    delta = delta.reshape(batch, n)
+    return delta
+
+
+def getBatchSize(n, nnz, max_nodes=4000000, max_edges=4000000):
+    """Number of sources processed together, limiting the size of the batch arrays"""
+    size = min(max_nodes // max(n, 1), max_edges // max(nnz, 1))
+    return int(max(1, min(size, n)))
+
+
+def calcAxialDepths(indptr, indices, sources, radii, betweenness=False, fullset=False):
+    """Calculate depth totals and dependencies of a set of sources for every radius
+    :param radii: list of integer radius values, 0 is global
+    :return: dict of partial results by radius, betweenness arrays are indexed by node
+    """
+    n = len(indptr) - 1
+    max_radius = 0 if 0 in radii else max(radii)
+    sources = np.asarray(sources, dtype=np.int64)
+    partial = dict()
+    for r in radii:
+        partial[r] = {'td': np.zeros(len(sources)), 'nc': np.zeros(len(sources)),
+                      'hd': np.zeros(len(sources)), 'ent': np.zeros(len(sources)),
+                      'choice': np.zeros(n) if betweenness else None}
+    depth, sigma, levels = bfsBatch(indptr, indices, sources, max_radius, betweenness)
+    reached = depth >= 0
+    for r in radii:
+        if r == 0:
+            mask = reached
+        else:
+            mask = reached & (depth <= r)
+        d = np.where(mask, depth, 0).astype(np.float64)
+        partial[r]['td'] = d.sum(axis=1)
+        partial[r]['nc'] = mask.sum(axis=1).astype(np.float64)
+        if fullset:
+            with np.errstate(divide='ignore'):
+                partial[r]['hd'] = np.where(d > 0, 1.0 / d, 0.0).sum(axis=1)
+            partial[r]['ent'] = _calcEntropy(depth, mask, partial[r]['nc'])
+        if betweenness:
+            delta = dependencyBatch(sigma, levels, r)
+            delta[np.arange(len(sources)), sources] = 0.0
+            partial[r]['choice'] = delta.sum(axis=0)
+    return partial
+
+
+def _calcEntropy(depth, mask, nc):
+    # entropy of the distribution of nodes by depth
+    batch = depth.shape[0]
+    ent = np.zeros(batch)
+    max_depth = int(depth.max()) if depth.size else 0
+    if max_depth < 1:
+        return ent
+    rows = np.repeat(np.arange(batch), mask.sum(axis=1))
+    counts = np.zeros((batch, max_depth + 1))
+    np.add.at(counts, (rows, depth[mask]), 1.0)
+    counts = counts[:, 1:]
+    total = (nc - 1.0)[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = np.where(total > 0, counts / total, 0.0)
+        ent = -np.where(p > 0, p * np.log2(p), 0.0).sum(axis=1)
+    return ent
+
+
+def calcAxialIntegration(td, nc):
+    """Calculate mean depth and integration [HH] from total depth and node count, -1 where undefined"""
+    td = np.asarray(td, dtype=np.float64)
+    k = np.asarray(nc, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        md = np.where(k > 1, td / (k - 1.0), -1.0)
+        ra = 2.0 * (md - 1.0) / (k - 2.0)
+        dk = 2.0 * (k * (np.log2((k + 2.0) / 3.0) - 1.0) + 1.0) / ((k - 1.0) * (k - 2.0))
+        integration = np.where((k > 2) & (ra > 0), dk / ra, -1.0)
+    return md, integration
+
+
+def calcAxialMeasures(indptr, indices, radii, betweenness=True, fullset=False, progress=None, batch=None,
+                      processes=1):
+    """Calculate axial analysis measures of every node at the given radii
+    :param radii: list of integer radius values, 0 is global
+    :param progress: optional callable receiving the percentage done, returning False to abort
+    :param processes: number of worker processes, 0 uses all the available cores
+    :return: dict with measure names (as depthmapX) and corresponding arrays, None if aborted
+    """
+    n = len(indptr) - 1
+    radii = sorted(set(radii))
+    if not batch:
+        batch = getBatchSize(n, len(indices))
+    totals = dict()
+    for r in radii:
+        totals[r] = {'td': np.zeros(n), 'nc': np.zeros(n), 'hd': np.zeros(n), 'ent': np.zeros(n),
+                     'choice': np.zeros(n)}
+    graph = {'indptr': indptr, 'indices': indices}
+    totals = runSources(calcAxialChunk, graph, n, (radii, betweenness, fullset, batch), mergeAxialDepths, totals,
+                        progress, processes, batch)
+    if totals is None:
+        return None
+    return getAxialMeasures(indptr, totals, betweenness, fullset)
+
+
+def calcAxialChunk(graph, sources, radii, betweenness, fullset, batch):
+    """Calculate the partial results of a chunk of sources, in batches"""
+    indptr = graph['indptr']
+    indices = graph['indices']
+    n = len(indptr) - 1
+    chunk = dict()
+    for r in radii:
+        chunk[r] = {'td': np.zeros(len(sources)), 'nc': np.zeros(len(sources)), 'hd': np.zeros(len(sources)),
+                    'ent': np.zeros(len(sources)), 'choice': np.zeros(n) if betweenness else None}
+    for start in range(0, len(sources), batch):
+        partial = calcAxialDepths(indptr, indices, sources[start:start + batch], radii, betweenness, fullset)
+        mergeAxialDepths(chunk, partial, slice(start, start + batch))
+    return chunk
+
+
+def mergeAxialDepths(totals, partial, sources):
+    """Add the partial results of a set of sources to the totals"""
+    for r in partial.keys():
+        for key in ('td', 'nc', 'hd', 'ent'):
+            totals[r][key][sources] = partial[r][key]
+        if partial[r]['choice'] is not None:
+            if totals[r]['choice'] is None:
+                totals[r]['choice'] = partial[r]['choice']
+            else:
+                totals[r]['choice'] += partial[r]['choice']
+    return totals
+
+
+def getAxialMeasures(indptr, totals, betweenness=True, fullset=False):
+    """Convert the accumulated depth totals into depthmapX axial measures"""
+    n = len(indptr) - 1
+    measures = dict()
+    measures['Connectivity'] = np.diff(indptr)
+    for r in sorted(totals.keys()):
+        suffix = '' if r == 0 else ' R%d' % r
+        td = totals[r]['td']
+        nc = totals[r]['nc']
+        md, integration = calcAxialIntegration(td, nc)
+        measures['Mean Depth' + suffix] = md
+        measures['Integration [HH]' + suffix] = integration
+        measures['Node Count' + suffix] = nc.astype(np.int64)
+        if betweenness:
+            # every pair was counted from both ends
+            choice = totals[r]['choice'] / 2.0
+            measures['Choice' + suffix] = choice
+            with np.errstate(divide='ignore', invalid='ignore'):
+                measures['Choice [Norm]' + suffix] = np.where(nc > 2, choice / ((nc - 1.0) * (nc - 2.0) / 2.0), -1.0)
+        if fullset:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                measures['Harmonic Mean Depth' + suffix] = np.where(totals[r]['hd'] > 0,
+                                                                    (nc - 1.0) / totals[r]['hd'], -1.0)
+                measures['Integration [Tekl]' + suffix] = np.where((nc > 2) & (td - nc + 1.0 > 1.0),
+                                                                   np.log(0.5 * (nc - 2.0)) / np.log(td - nc + 1.0),
+                                                                   -1.0)
+            measures['Entropy' + suffix] = totals[r]['ent']
+    return measures
+
+
+#------------------------------
+# Segment analysis functions
+#------------------------------
+# number of angular bins in 180 degrees, as depthmapX tulip analysis
+TULIP_BINS = 1024
+# smallest number of segment states where following the straight chains at once is faster
+CHAIN_MIN_STATES = 64
+
+
+def getIntersectionParams(coords, edges):
+    """Return the position (0 to 1) of the intersection point along each line of the edges"""
+    a = coords[edges[:, 0]]
+    b = coords[edges[:, 1]]
+    r = a[:, 2:4] - a[:, 0:2]
+    s = b[:, 2:4] - b[:, 0:2]
+    qp = b[:, 0:2] - a[:, 0:2]
+    denom = r[:, 0] * s[:, 1] - r[:, 1] * s[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ta = (qp[:, 0] * s[:, 1] - qp[:, 1] * s[:, 0]) / denom
+        tb = (qp[:, 0] * r[:, 1] - qp[:, 1] * r[:, 0]) / denom
+    # parallel lines only touch at their closest end points
+    parallel = ~np.isfinite(ta) | ~np.isfinite(tb)
+    if parallel.any():
+        ends_a = [a[parallel][:, 0:2], a[parallel][:, 2:4]]
+        ends_b = [b[parallel][:, 0:2], b[parallel][:, 2:4]]
+        dist = np.column_stack([np.hypot(*(ends_a[i] - ends_b[j]).T) for i in (0, 1) for j in (0, 1)])
+        closest = np.argmin(dist, axis=1)
+        ta[parallel] = closest // 2
+        tb[parallel] = closest % 2
+    return np.clip(ta, 0.0, 1.0), np.clip(tb, 0.0, 1.0)
+
+
+def getTurnBins(dir_a, dir_b, bins=TULIP_BINS):
+    """Return the turn angle between travel directions, in angular bins of 180 degrees"""
+    norm = np.hypot(dir_a[:, 0], dir_a[:, 1]) * np.hypot(dir_b[:, 0], dir_b[:, 1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos = (dir_a[:, 0] * dir_b[:, 0] + dir_a[:, 1] * dir_b[:, 1]) / norm
+    angle = np.arccos(np.clip(np.nan_to_num(cos), -1.0, 1.0))
+    return np.round(angle / np.pi * bins).astype(np.int64)
+
+
+def buildSegmentGraph(coords, edges, tolerance=1e-9, bins=TULIP_BINS):
+    """Split lines into segments at their intersections and build the angular segment graph
+    The graph nodes are directed segment states: 2*s travels segment s from start to end, 2*s+1 from end to start.
+    :param coords: array (N,4) with x1, y1, x2, y2 of each line
+    :param edges: array (E,2) of intersecting lines, after removing unlinks
+    :return: dict of arrays with segment rows, coords and lengths, and CSR states graph with turn costs
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    n = len(coords)
+    ta, tb = getIntersectionParams(coords, edges)
+    # cut positions along every line, including the line ends
+    rows = np.concatenate((np.arange(n), np.arange(n), edges[:, 0], edges[:, 1]))
+    params = np.concatenate((np.zeros(n), np.ones(n), ta, tb))
+    params[params < tolerance] = 0.0
+    params[params > 1.0 - tolerance] = 1.0
+    order = np.lexsort((params, rows))
+    sorted_rows = rows[order]
+    sorted_params = params[order]
+    new = np.ones(len(order), dtype=bool)
+    new[1:] = (sorted_rows[1:] != sorted_rows[:-1]) | (sorted_params[1:] - sorted_params[:-1] > tolerance)
+    cut_id = np.empty(len(order), dtype=np.int64)
+    cut_id[order] = np.cumsum(new) - 1
+    cut_rows = sorted_rows[new]
+    cut_params = sorted_params[new]
+    first = np.ones(len(cut_rows), dtype=bool)
+    first[1:] = cut_rows[1:] != cut_rows[:-1]
+    last = np.ones(len(cut_rows), dtype=bool)
+    last[:-1] = cut_rows[1:] != cut_rows[:-1]
+    # segments lie between consecutive cuts of the same line
+    start_cuts = np.nonzero(~last)[0]
+    seg_rows = cut_rows[start_cuts]
+    t0 = cut_params[start_cuts]
+    t1 = cut_params[start_cuts + 1]
+    line = coords[seg_rows]
+    vec = line[:, 2:4] - line[:, 0:2]
+    seg_coords = np.column_stack((line[:, 0:2] + vec * t0[:, None], line[:, 0:2] + vec * t1[:, None]))
+    lengths = np.hypot(seg_coords[:, 2] - seg_coords[:, 0], seg_coords[:, 3] - seg_coords[:, 1])
+    # junctions between segments: consecutive segments of a line and segments of intersecting lines
+    cut_a = cut_id[2 * n:2 * n + len(edges)]
+    cut_b = cut_id[2 * n + len(edges):]
+    inner = np.nonzero(~first & ~last)[0]
+    # each cut has a segment ending at it (unless first) and a segment starting at it (unless last)
+    ending = np.where(first, -1, np.arange(len(cut_rows)) - cut_rows - 1)
+    starting = np.where(last, -1, np.arange(len(cut_rows)) - cut_rows)
+    # arriving state at a cut and leaving state from it
+    arrive = [np.where(ending >= 0, 2 * ending, -1), np.where(starting >= 0, 2 * starting + 1, -1)]
+    leave = [np.where(starting >= 0, 2 * starting, -1), np.where(ending >= 0, 2 * ending + 1, -1)]
+    src = []
+    dst = []
+    # same line continuation
+    for i in (0, 1):
+        for j in (0, 1):
+            src.append(arrive[i][inner])
+            dst.append(leave[j][inner])
+    # crossing lines, in both directions
+    for cuts_from, cuts_to in ((cut_a, cut_b), (cut_b, cut_a)):
+        for i in (0, 1):
+            for j in (0, 1):
+                src.append(arrive[i][cuts_from])
+                dst.append(leave[j][cuts_to])
+    src = np.concatenate(src)
+    dst = np.concatenate(dst)
+    valid = (src >= 0) & (dst >= 0) & ((src >> 1) != (dst >> 1))
+    keys = np.unique(src[valid] * (2 * len(seg_rows)) + dst[valid])
+    src = keys // (2 * len(seg_rows))
+    dst = keys % (2 * len(seg_rows))
+    # turn cost between the arriving and leaving directions of travel
+    seg_vec = seg_coords[:, 2:4] - seg_coords[:, 0:2]
+    dir_src = np.where((src % 2 == 0)[:, None], seg_vec[src >> 1], -seg_vec[src >> 1])
+    dir_dst = np.where((dst % 2 == 0)[:, None], seg_vec[dst >> 1], -seg_vec[dst >> 1])
+    costs = getTurnBins(dir_src, dir_dst, bins)
+    states = 2 * len(seg_rows)
+    indptr = np.zeros(states + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=states), out=indptr[1:])
+    connected = np.unique((src >> 1) * len(seg_rows) + (dst >> 1))
+    connectivity = np.bincount(connected // len(seg_rows), minlength=len(seg_rows))
+    return {'rows': seg_rows, 'coords': seg_coords, 'lengths': lengths, 'connectivity': connectivity,
+            'indptr': indptr, 'indices': dst, 'costs': costs}
+
+
+def getStateEdges(indptr, indices, states):
+    """Edges leaving a set of states of a batch search, as arrays of parent state, child state and edge position"""
+    size = len(indptr) - 1
+    local = states % size
+    deg = indptr[local + 1] - indptr[local]
+    total = int(deg.sum())
+    offset = np.arange(total) - np.repeat(np.cumsum(deg) - deg, deg)
+    pos = np.repeat(indptr[local], deg) + offset
+    return np.repeat(states, deg), np.repeat(states - local, deg) + indices[pos], pos
+
+
+def getRunSums(values, linked):
+    """Cumulative sums of values along runs, restarting wherever linked is False"""
+    if not np.any(linked):
+        return values
+    index = np.arange(len(values))
+    starts = np.maximum.accumulate(np.where(linked, 0, index))
+    sums = values.copy()
+    # add the preceding partial sums at doubling distances, without subtracting large totals
+    shift = 1
+    longest = int((index - starts).max()) if len(values) else 0
+    while shift <= longest:
+        previous = sums.copy()
+        valid = index - shift >= starts
+        sums[valid] += previous[index[valid] - shift]
+        shift *= 2
+    return sums
+
+
+def getStraightChains(graph):
+    """Order the states along the chains of zero cost (straight) transitions
+    :return: dict with the states in chain order ('order'), the position of each state in it ('index'), and by
+        position the end of its chain ('end') and the cumulative metric distance along the chain ('metric'),
+        None if the straight transitions branch, merge or form cycles
+    """
+    size = len(graph['indptr']) - 1
+    straight = graph['costs'] == 0
+    src = np.repeat(np.arange(size), np.diff(graph['indptr']))[straight]
+    dst = graph['indices'][straight]
+    if np.any(np.bincount(src, minlength=size) > 1) or np.any(np.bincount(dst, minlength=size) > 1):
+        return None
+    following = np.empty(size, dtype=np.int64)
+    following.fill(-1)
+    following[src] = dst
+    head = np.ones(size, dtype=bool)
+    head[dst] = False
+    chain = np.empty(size, dtype=np.int64)
+    chain.fill(-1)
+    position = np.zeros(size, dtype=np.int64)
+    states = np.nonzero(head)[0]
+    chain[states] = states
+    step = 0
+    while len(states) > 0:
+        position[states] = step
+        nxt = following[states]
+        valid = nxt >= 0
+        chain[nxt[valid]] = chain[states[valid]]
+        states = nxt[valid]
+        step += 1
+    if np.any(chain < 0):
+        return None
+    order = np.lexsort((position, chain))
+    index = np.empty(size, dtype=np.int64)
+    index[order] = np.arange(size)
+    lengths = graph['lengths']
+    first = position[order] == 0
+    heads = np.nonzero(first)[0]
+    end = np.repeat(np.append(heads[1:], size), np.diff(np.append(heads, size)))
+    # metric distance of the transition from the previous state of the chain
+    after = np.nonzero(~first)[0]
+    steps = np.zeros(size)
+    steps[after] = (lengths[order[after] >> 1] + lengths[order[after - 1] >> 1]) / 2.0
+    return {'order': order, 'index': index, 'end': end, 'metric': getRunSums(steps, ~first)}
+
+
+def searchSegmentBatch(graph, sources, radius=0, radius_type=2, bins=TULIP_BINS, chains=None):
+    """Angular shortest paths from a batch of source segments using a bucket queue (Dial's algorithm),
+    expanding each depth level of every source at once
+    :param radius: 0 for global, otherwise in segment steps, angular units (90 degrees) or map units
+    :param radius_type: 0 segment steps, 1 angular, 2 metric
+    :param chains: straight chains from getStraightChains, followed at once instead of one transition at a time
+    :return: dict of flat arrays by state of the batch (source * states + state), with angular bins ('dist', -1 if
+        not reached), path counts ('sigma') and settling order ('rank'), and the list of states settled together,
+        with the straight transitions linking each state to the one before
+    """
+    indptr = graph['indptr']
+    indices = graph['indices']
+    costs = graph['costs']
+    lengths = graph['lengths']
+    size = len(indptr) - 1
+    batch = len(sources)
+    dist = np.empty(batch * size, dtype=np.int64)
+    dist.fill(-1)
+    metric = np.zeros(batch * size)
+    steps = np.zeros(batch * size, dtype=np.int64)
+    sigma = np.zeros(batch * size)
+    rank = np.empty(batch * size, dtype=np.int64)
+    rank.fill(-1)
+    indegree = np.zeros(batch * size, dtype=np.int64)
+    start = np.column_stack((2 * sources, 2 * sources + 1)) + (np.arange(batch) * size)[:, None]
+    start = start.ravel()
+    dist[start] = 0
+    sigma[start] = 1.0
+    angular_radius = radius * bins / 2.0
+
+    def getMetric(v, w):
+        return metric[v] + (lengths[(v % size) >> 1] + lengths[(w % size) >> 1]) / 2.0
+
+    def outside(v, w, d):
+        if radius == 0:
+            return np.zeros(len(v), dtype=bool)
+        elif radius_type == 0:
+            return steps[v] + 1 > radius
+        elif radius_type == 1:
+            return np.zeros(len(v), dtype=bool) | (d > angular_radius)
+        return getMetric(v, w) > radius
+
+    def setDepth(v, w, d):
+        # the first transition reaching a state sets its depth, ties go to the shortest metric distance
+        m = getMetric(v, w)
+        order = np.lexsort((m, w))
+        w = w[order]
+        first = np.ones(len(w), dtype=bool)
+        first[1:] = w[1:] != w[:-1]
+        w = w[first]
+        v = v[order][first]
+        dist[w] = d if np.isscalar(d) else d[order][first]
+        metric[w] = m[order][first]
+        steps[w] = steps[v] + 1
+        sigma[w] = 0.0
+        return w
+
+    def getChainStates(keys):
+        return keys - keys % size + chains['order'][keys % size]
+
+    def getChainEnds(keys):
+        return keys - keys % size + chains['end'][keys % size]
+
+    def settleChains(level):
+        # follow the straight chains from the level states, up to the next level state, a settled state
+        # or the radius, then pass on the path counts along the chains
+        keys = np.sort(level - level % size + chains['index'][level % size])
+        ends = getChainEnds(keys)
+        count = np.minimum(ends, np.append(keys[1:], ends[-1])) - keys - 1
+        total = int(count.sum())
+        hop = np.arange(total) - np.repeat(np.cumsum(count) - count, count) + 1
+        entry = np.repeat(getChainStates(keys), count)
+        key = np.repeat(keys, count) + hop
+        state = getChainStates(key)
+        m = metric[entry] + chains['metric'][key % size] - chains['metric'][(key - hop) % size]
+        blocked = rank[state] >= 0
+        if radius > 0:
+            if radius_type == 0:
+                blocked |= steps[entry] + hop > radius
+            elif radius_type == 1:
+                blocked |= current > angular_radius
+            else:
+                blocked |= m > radius
+        # a chain stops at its first blocked state
+        blocked = np.cumsum(blocked)
+        reached = blocked == np.repeat(np.append(0, blocked)[np.cumsum(count) - count], count)
+        state = state[reached]
+        dist[state] = current
+        metric[state] = m[reached]
+        steps[state] = steps[entry[reached]] + hop[reached]
+        sigma[state] = 0.0
+        # the level in chain order, linked where a straight transition joins a state to the one before
+        keys = np.sort(np.concatenate((keys, key[reached])))
+        level = getChainStates(keys)
+        linked = np.zeros(len(level), dtype=bool)
+        linked[1:] = (keys[1:] == keys[:-1] + 1) & (getChainEnds(keys[1:]) == getChainEnds(keys[:-1]))
+        after = np.nonzero(linked)[0]
+        linked[after] = ~outside(level[after - 1], level[after], current)
+        sigma[level] = getRunSums(sigma[level], linked)
+        return level, linked
+
+    def settleLevel(level):
+        # add the states reached through straight transitions, then settle them in order so that their
+        # path counts are complete
+        new = level
+        while len(new) > 0:
+            v, w, pos = getStateEdges(indptr, indices, new)
+            valid = (costs[pos] == 0) & (rank[w] < 0) & (dist[w] != current)
+            v = v[valid]
+            w = w[valid]
+            valid = ~outside(v, w, current)
+            new = setDepth(v[valid], w[valid], current)
+            level = np.concatenate((level, new))
+        v, w, pos = getStateEdges(indptr, indices, level)
+        inner = (costs[pos] == 0) & (dist[w] == current)
+        inner[inner] = ~outside(v[inner], w[inner], current)
+        v = v[inner]
+        w = w[inner]
+        np.add.at(indegree, w, 1)
+        settled = level[indegree[level] == 0]
+        placed = 0
+        while placed < len(level):
+            if len(settled) == 0:
+                # straight cycles cannot be ordered
+                settled = level[rank[level] < 0]
+            rank[settled] = len(rounds)
+            rounds.append((settled, np.zeros(len(settled), dtype=bool)))
+            placed += len(settled)
+            step = rank[v] == rank[settled[0]]
+            np.add.at(sigma, w[step], sigma[v[step]])
+            np.subtract.at(indegree, w[step], 1)
+            settled = np.unique(w[step])
+            settled = settled[(indegree[settled] == 0) & (rank[settled] < 0)]
+        indegree[level] = 0
+        return level
+
+    buckets = [[] for i in range(bins + 1)]
+    buckets[0].append(start)
+    pending = 1
+    current = 0
+    rounds = []
+    while pending > 0:
+        bucket = buckets[current % (bins + 1)]
+        if not bucket:
+            current += 1
+            continue
+        pending -= len(bucket)
+        level = np.unique(np.concatenate(bucket))
+        del bucket[:]
+        level = level[(dist[level] == current) & (rank[level] < 0)]
+        if len(level) == 0:
+            current += 1
+            continue
+        if chains is not None:
+            level, linked = settleChains(level)
+            rank[level] = len(rounds)
+            rounds.append((level, linked))
+        else:
+            level = settleLevel(level)
+        # relax the turns to the states not yet settled
+        v, w, pos = getStateEdges(indptr, indices, level)
+        d = current + costs[pos]
+        valid = (d > current) & (rank[w] < 0)
+        valid[valid] = ~outside(v[valid], w[valid], d[valid])
+        v = v[valid]
+        w = w[valid]
+        d = d[valid]
+        if len(w) > 0:
+            order = np.lexsort((d, w))
+            first = np.ones(len(w), dtype=bool)
+            first[1:] = w[order][1:] != w[order][:-1]
+            best = d[order][first][np.cumsum(first) - 1]
+            improved = order[(d[order] == best) & ((dist[w[order]] < 0) | (best < dist[w[order]]))]
+            if len(improved) > 0:
+                reached = setDepth(v[improved], w[improved], d[improved])
+                depths = dist[reached]
+                order = np.argsort(depths, kind='mergesort')
+                reached = reached[order]
+                depths = depths[order]
+                cuts = (np.nonzero(depths[1:] != depths[:-1])[0] + 1).tolist()
+                for first, last in zip([0] + cuts, cuts + [len(depths)]):
+                    buckets[int(depths[first]) % (bins + 1)].append(reached[first:last])
+                    pending += 1
+            # every transition at the shortest depth adds its path count
+            shortest = d == dist[w]
+            np.add.at(sigma, w[shortest], sigma[v[shortest]])
+        current += 1
+    return {'dist': dist, 'metric': metric, 'steps': steps, 'sigma': sigma, 'rank': rank, 'rounds': rounds}
+
+
+def segmentDependencyBatch(graph, search, target, radius=0, radius_type=2, bins=TULIP_BINS):
+    """Brandes dependency accumulation of a batch search, in reverse settling order"""
+    lengths = graph['lengths']
+    size = len(graph['indptr']) - 1
+    dist = search['dist']
+    sigma = search['sigma']
+    rank = search['rank']
+    delta = np.zeros(len(dist))
+    angular_radius = radius * bins / 2.0
+    for states, linked in reversed(search['rounds']):
+        v, w, pos = getStateEdges(graph['indptr'], graph['indices'], states)
+        dag = (dist[w] >= 0) & (dist[w] == dist[v] + graph['costs'][pos]) & (rank[w] > rank[v])
+        v = v[dag]
+        w = w[dag]
+        if radius > 0:
+            if radius_type == 0:
+                inside = search['steps'][v] + 1 <= radius
+            elif radius_type == 1:
+                inside = dist[w] <= angular_radius
+            else:
+                inside = search['metric'][v] + (lengths[(v % size) >> 1] + lengths[(w % size) >> 1]) / 2.0 <= radius
+            v = v[inside]
+            w = w[inside]
+        np.add.at(delta, v, sigma[v] * (target[w] + delta[w]) / sigma[w])
+        if np.any(linked):
+            # pass the dependencies back along the straight chains, from the end of each chain
+            coeff = (target[states] + delta[states]) / sigma[states]
+            coeff = getRunSums(coeff[::-1], np.append(False, linked[:0:-1]))[::-1]
+            delta[states[:-1]] += sigma[states[:-1]] * np.where(linked[1:], coeff[1:], 0.0)
+    return delta
+
+
+def calcSegmentChunk(graph, sources, radii, radius_type, betweenness, bins=TULIP_BINS):
+    """Calculate the partial results of a chunk of source segments, in batches"""
+    size = len(graph['indptr']) - 1
+    segments = size // 2
+    chunk = dict()
+    batch = getBatchSize(size, len(graph['indices']), max_nodes=1000000)
+    if '_chains' not in graph:
+        graph['_chains'] = getStraightChains(graph) if size >= CHAIN_MIN_STATES else None
+    for r in radii:
+        chunk[r] = {'td': np.zeros(len(sources)), 'nc': np.zeros(len(sources)),
+                    'choice': np.zeros(segments) if betweenness else None}
+        for start in range(0, len(sources), batch):
+            batch_sources = np.asarray(sources[start:start + batch], dtype=np.int64)
+            search = searchSegmentBatch(graph, batch_sources, r, radius_type, bins, graph['_chains'])
+            # segment depth is the shortest of its two directions
+            dist = search['dist'].reshape(len(batch_sources), segments, 2)
+            reached = dist >= 0
+            seg_dist = np.where(reached, dist, np.iinfo(np.int64).max).min(axis=2)
+            seg_reached = reached.any(axis=2)
+            chunk[r]['td'][start:start + batch] = np.where(seg_reached, seg_dist, 0).sum(axis=1) * 2.0 / bins
+            chunk[r]['nc'][start:start + batch] = seg_reached.sum(axis=1)
+            if betweenness:
+                # each path ends at the shortest direction of the target segment
+                sigma = search['sigma'].reshape(len(batch_sources), segments, 2)
+                shortest = reached & (dist == seg_dist[:, :, None])
+                shortest[np.arange(len(batch_sources)), batch_sources] = False
+                seg_sigma = np.where(shortest, sigma, 0.0).sum(axis=2)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    target = np.where(shortest, sigma / seg_sigma[:, :, None], 0.0)
+                delta = segmentDependencyBatch(graph, search, target.ravel(), r, radius_type, bins)
+                delta = delta.reshape(len(batch_sources), segments, 2).sum(axis=2)
+                delta[np.arange(len(batch_sources)), batch_sources] = 0.0
+                chunk[r]['choice'] += delta.sum(axis=0)
+    return chunk
+
+
+def mergeSegmentDepths(totals, partial, sources):
+    """Add the partial results of a set of source segments to the totals"""
+    for r in partial.keys():
+        for key in ('td', 'nc'):
+            totals[r][key][sources] = partial[r][key]
+        if partial[r]['choice'] is not None:
+            totals[r]['choice'] += partial[r]['choice']
+    return totals
+
+
+def calcSegmentMeasures(graph, radii, radius_type=2, betweenness=True, progress=None, processes=1,
+                        bins=TULIP_BINS):
+    """Calculate angular segment analysis measures (tulip) of every segment at the given radii
+    :param graph: segment graph from buildSegmentGraph
+    :param radii: list of radius values, 0 is global
+    :param radius_type: 0 segment steps, 1 angular, 2 metric
+    :param progress: optional callable receiving the percentage done, returning False to abort
+    :param processes: number of worker processes, 0 uses all the available cores
+    :return: dict with measure names (as depthmapX) and corresponding arrays, None if aborted
+    """
+    segments = len(graph['lengths'])
+    radii = sorted(set(radii))
+    totals = dict()
+    for r in radii:
+        totals[r] = {'td': np.zeros(segments), 'nc': np.zeros(segments), 'choice': np.zeros(segments)}
+    shared = {'indptr': graph['indptr'], 'indices': graph['indices'], 'costs': graph['costs'],
+              'lengths': graph['lengths']}
+    totals = runSources(calcSegmentChunk, shared, segments, (radii, radius_type, betweenness, bins),
+                        mergeSegmentDepths, totals, progress, processes)
+    if totals is None:
+        return None
+    prefix = 'T%d ' % bins
+    measures = dict()
+    for r in radii:
+        if r == 0:
+            suffix = ''
+        elif radius_type == 2:
+            suffix = ' R%s metric' % r
+        elif radius_type == 1:
+            suffix = ' R%s angular' % r
+        else:
+            suffix = ' R%s' % r
+        td = totals[r]['td']
+        nc = totals[r]['nc']
+        measures[prefix + 'Total Depth' + suffix] = td
+        measures[prefix + 'Node Count' + suffix] = nc.astype(np.int64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            measures[prefix + 'Integration' + suffix] = np.where(td > 0, nc * nc / td, -1.0)
+        if betweenness:
+            # every pair was counted from both ends
+            measures[prefix + 'Choice' + suffix] = totals[r]['choice'] / 2.0
+    return measures
+
+
+def calcNormalisedSegment(attributes, columns):
+    """Calculate normalised angular choice (NACH) and integration (NAIN) of segment results
+    :param attributes: depthmapX result names, with choice (CH), node count (NC) and total depth (TD) columns
+    :param columns: list of result columns, in the order of the attributes
+    :return: names of the new attributes, and the list of their columns, -1 where undefined
+    """
+    choice = []
+    nc = []
+    td = []
+    nach = []
+    nain = []
+    # identify new attributes that need to be calculated
+    for i, attr in enumerate(attributes):
+        if 'CH' in attr:
+            choice.append(i)
+            nach.append(attr.replace('CH','NACH'))
+        if 'NC' in attr:
+            nc.append(i)
+        if 'TD' in attr:
+            td.append(i)
+            nain.append(attr.replace('TD','NAIN'))
+    new_attributes = []
+    new_attributes.extend(nach)
+    new_attributes.extend(nain)
+    if len(columns) == 0 or len(columns[0]) == 0:
+        return new_attributes, [[] for attr in new_attributes]
+    # calculate new values on whole columns
+    values = dict((j, np.array(columns[j], dtype=object).astype(np.float64)) for j in set(choice + nc + td))
+    new_columns = []
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i, j in enumerate(choice):
+            new_columns.append(np.log(values[j] + 1.0) / np.log(values[td[i]] + 3.0))
+        for i, j in enumerate(td):
+            if i < len(nc):
+                new_columns.append(values[nc[i]] ** 1.2 / values[j])
+            else:
+                new_columns.append(values[nc[i-len(nc)]] ** 1.2 / values[j])
+    # segments without depth have no normalised values
+    for column in new_columns:
+        column[~np.isfinite(column)] = -1.0
+    return new_attributes, [column.tolist() for column in new_columns]
+
+
+#------------------------------
+# Parallel analysis functions
+#------------------------------
+def getPythonExecutable():
+    """Return the python interpreter used to start the worker processes, None if it isn't found.
+    Inside QGIS sys.executable can be the application rather than python.
+    """
+    version = sys.version_info[:2]
+    if os.name == 'nt':
+        # pythonw doesn't open a console window
+        names = ['pythonw.exe', 'python.exe']
+        folders = [sys.exec_prefix]
+    else:
+        names = ['python%d.%d' % version, 'python%d' % version[0], 'python']
+        folders = [os.path.join(sys.exec_prefix, 'bin')]
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        folders.insert(0, os.path.dirname(sys.executable))
+    for folder in folders:
+        for name in names:
+            path = os.path.join(folder, name)
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def saveGraphArrays(graph, folder):
+    """Save the graph arrays in a folder, where the worker processes map them without copying
+    :return: dict of file paths by array name
+    """
+    files = dict()
+    for key, values in graph.items():
+        if key.startswith('_'):
+            # cached structures are rebuilt in each process
+            continue
+        files[key] = os.path.join(folder, '%s.npy' % key)
+        np.save(files[key], np.ascontiguousarray(values))
+    return files
+
+
+def startWorkerProcess(executable, files):
+    """Start a fresh python interpreter running this module as a worker process, reading the graph arrays.
+    It doesn't inherit the state of QGIS, so it can be started from any thread on every platform.
+    """
+    script = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+    env = dict(os.environ)
+    # the worker finds the same packages, e.g. numpy installed with QGIS
+    env['PYTHONPATH'] = os.pathsep.join(path for path in sys.path if isinstance(path, str) and os.path.isdir(path))
+    # no console window on windows
+    flags = 0x08000000 if os.name == 'nt' else 0
+    process = subprocess.Popen([executable, '-u', script], stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env,
+                               creationflags=flags)
+    pickle.dump(files, process.stdin, 2)
+    process.stdin.flush()
+    return process
+
+
+def _feedWorkerProcess(process, tasks, results):
+    # send the tasks to a worker process one at a time, putting (sources, success, partial results) in results
+    try:
+        while True:
+            try:
+                task = tasks.get_nowait()
+            except queue.Empty:
+                break
+            pickle.dump(task, process.stdin, 2)
+            process.stdin.flush()
+            success, partial = pickle.load(process.stdout)
+            results.put((task[1], success, partial))
+    except BaseException:
+        results.put((None, False, traceback.format_exc()))
+
+
+def stopWorkerProcess(process, kill=False):
+    try:
+        if kill:
+            process.kill()
+        else:
+            pickle.dump(None, process.stdin, 2)
+        process.stdin.close()
+    except (IOError, OSError):
+        pass
+    process.wait()
+
+
+def runWorkerProcess():
+    """Main loop of a worker process: reads (worker name, sources, args) tasks from stdin, and writes
+    (success, partial results or error) to stdout, until the task is None
+    """
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    # stdout only carries the results, anything else goes to stderr
+    sys.stdout = sys.stderr
+    files = pickle.load(stdin)
+    graph = dict((key, np.load(path, mmap_mode='r')) for key, path in files.items())
+    while True:
+        task = pickle.load(stdin)
+        if task is None:
+            break
+        name, sources, args = task
+        try:
+            result = (True, globals()[name](graph, sources, *args))
+        except Exception:
+            result = (False, traceback.format_exc())
+        pickle.dump(result, stdout, 2)
+        stdout.flush()
+
+
+def runSources(worker, graph, n, args, merge, totals, progress=None, processes=1, batch=1):
+    """Run the analysis of every source node in chunks, in worker processes if more than one
+    :param worker: function of this module worker(graph, sources, *args) returning the partial results
+    :param graph: dict of arrays with the graph, read by the worker processes
+    :param merge: function merge(totals, partial, sources) reducing the partial results
+    :param progress: optional callable receiving the percentage done, returning False to abort
+    :param processes: number of worker processes, 0 uses all the available cores.
+        Runs in this process if the python interpreter isn't found, see getPythonExecutable
+    :return: totals, None if aborted
+    """
+    if processes == 0:
+        processes = multiprocessing.cpu_count()
+    # many small chunks balance the load between processes
+    size = max(batch, n // max(1, processes * 8))
+    chunks = [np.arange(start, min(start + size, n)) for start in range(0, n, size)]
+    done = 0
+    executable = getPythonExecutable()
+    if processes < 2 or len(chunks) < 2 or executable is None:
+        for sources in chunks:
+            merge(totals, worker(graph, sources, *args), sources)
+            done += len(sources)
+            if progress and not progress(int(100.0 * done / n)):
+                return None
+        return totals
+    tasks = queue.Queue()
+    for sources in chunks:
+        tasks.put((worker.__name__, sources, args))
+    results = queue.Queue()
+    folder = tempfile.mkdtemp(prefix='esstools_')
+    workers = []
+    aborted = True
+    try:
+        files = saveGraphArrays(graph, folder)
+        for i in range(min(processes, len(chunks))):
+            process = startWorkerProcess(executable, files)
+            workers.append(process)
+            thread = threading.Thread(target=_feedWorkerProcess, args=(process, tasks, results))
+            thread.daemon = True
+            thread.start()
+        for i in range(len(chunks)):
+            sources, success, partial = results.get()
+            if not success:
+                raise RuntimeError("The analysis failed in a worker process:\n%s" % partial)
+            merge(totals, partial, sources)
+            done += len(sources)
+            if progress and not progress(int(100.0 * done / n)):
+                return None
+        aborted = False
+    finally:
+        for process in workers:
+            stopWorkerProcess(process, aborted)
+        shutil.rmtree(folder, ignore_errors=True)
+    return totals
+
+
+if __name__ == '__main__':
+    runWorkerProcess()
@@ -46,6 +46,7 @@ class Ui_ProjectDialog(object):
         self.dataTypeCombo.setObjectName(_fromUtf8("dataTypeCombo"))
         self.dataTypeCombo.addItem(_fromUtf8(""))
         self.dataTypeCombo.addItem(_fromUtf8(""))
+        self.dataTypeCombo.addItem(_fromUtf8(""))
         self.gridLayout.addWidget(self.dataTypeCombo, 0, 1, 1, 2)
         self.dataNewButton = QtGui.QPushButton(self.datastoreBox)
         self.dataNewButton.setObjectName(_fromUtf8("dataNewButton"))
@@ -87,6 +88,7 @@ class Ui_ProjectDialog(object):
         self.datastoreBox.setTitle(_translate("ProjectDialog", "Project data store", None))
         self.dataTypeCombo.setItemText(0, _translate("ProjectDialog", "Personal geodatabase", None))
         self.dataTypeCombo.setItemText(1, _translate("ProjectDialog", "Shape files folder", None))
+        self.dataTypeCombo.setItemText(2, _translate("ProjectDialog", "GeoPackage file", None))
         self.dataNewButton.setText(_translate("ProjectDialog", "New...", None))
         self.dataOpenButton.setText(_translate("ProjectDialog", "Open...", None))
         self.dataTypeLabel.setText(_translate("ProjectDialog", "Type", None))
@@ -80,6 +80,14 @@ class Ui_SettingsDialog(object):
         self.engineTestText.setReadOnly(True)
         self.engineTestText.setObjectName(_fromUtf8("engineTestText"))
         self.formLayout.setWidget(1, QtGui.QFormLayout.FieldRole, self.engineTestText)
+        self.analysisProcessesLabel = QtGui.QLabel(self.analysisTab)
+        self.analysisProcessesLabel.setObjectName(_fromUtf8("analysisProcessesLabel"))
+        self.formLayout.setWidget(2, QtGui.QFormLayout.LabelRole, self.analysisProcessesLabel)
+        self.analysisProcessesSpin = QtGui.QSpinBox(self.analysisTab)
+        self.analysisProcessesSpin.setMaximum(64)
+        self.analysisProcessesSpin.setProperty("value", 0)
+        self.analysisProcessesSpin.setObjectName(_fromUtf8("analysisProcessesSpin"))
+        self.formLayout.setWidget(2, QtGui.QFormLayout.FieldRole, self.analysisProcessesSpin)
         self.settingsTab.addTab(self.analysisTab, _fromUtf8(""))
         self.verticalLayout_2.addWidget(self.settingsTab)
         self.closeButtonBox = QtGui.QDialogButtonBox(SettingsDialog)
@@ -101,9 +109,12 @@ class Ui_SettingsDialog(object):
         self.unlinksThresholdLabel.setText(_translate("SettingsDialog", "Unlinks crossing threshold (m)", None))
         self.linksThresholdLabel.setText(_translate("SettingsDialog", "Links touch threshold (m)", None))
         self.settingsTab.setTabText(self.settingsTab.indexOf(self.editTab), _translate("SettingsDialog", "Layer verification", None))
-        self.engineHostLabel.setText(_translate("SettingsDialog", "Host IP", None))
-        self.engineHostEdit.setText(_translate("SettingsDialog", "localhost", None))
+        self.engineHostLabel.setText(_translate("SettingsDialog", "Hosts (host:port)", None))
+        self.engineHostEdit.setText(_translate("SettingsDialog", "localhost:31337", None))
         self.engineTestButton.setText(_translate("SettingsDialog", "Test", None))
+        self.analysisProcessesLabel.setText(_translate("SettingsDialog", "Built-in engine processes", None))
+        self.analysisProcessesSpin.setToolTip(_translate("SettingsDialog", "Number of processes used by the built-in analysis engine, 0 uses all the cores", None))
+        self.analysisProcessesSpin.setSpecialValueText(_translate("SettingsDialog", "All cores", None))
         self.settingsTab.setTabText(self.settingsTab.indexOf(self.analysisTab), _translate("SettingsDialog", "depthmapXnet", None))
 
 import resources_rc
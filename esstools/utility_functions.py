@@ -29,7 +29,15 @@ import psycopg2 as pgsql
 
 import os.path
 import math
-from itertools import izip_longest
+import struct
+from itertools import count, izip, izip_longest, tee
+
+# the GDAL python bindings are installed with QGIS, used to write GeoPackage files
+try:
+    from osgeo import gdal, ogr, osr
+    has_ogr = True
+except ImportError, e:
+    has_ogr = False
 
 
 #------------------------------
@@ -127,7 +135,11 @@ def getLayerPath(layer):
         path = uri.database()
     elif provider_type == 'ogr':
         uri = provider.dataSourceUri()
-        path = os.path.dirname(uri)
+        if isGeopackageLayer(layer):
+            # the path of a geopackage layer is the file, as for databases
+            path = uri.split('|')[0]
+        else:
+            path = os.path.dirname(uri)
     return path
 
 
@@ -366,6 +378,123 @@ def getFeatureListIds(layer, name, values=list):
     return features
 
 
+def getIdIndex(ids):
+    # dictionary with the row of each id in the list
+    return dict((id, row) for row, id in enumerate(ids))
+
+
+def getLinePairs(layer, rows):
+    # convert the line1, line2 pairs of line ids of a links or unlinks layer into pairs of rows
+    pairs = []
+    if layer and fieldExists(layer, 'line1') and fieldExists(layer, 'line2'):
+        request = QgsFeatureRequest().setSubsetOfAttributes(['line1', 'line2'], layer.pendingFields())
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        for feature in layer.getFeatures(request):
+            a = feature.attribute('line1')
+            b = feature.attribute('line2')
+            if a in rows and b in rows:
+                pairs.append((rows[a], rows[b]))
+    return pairs
+
+
+def getLayerIdIndex(layer, name=''):
+    """
+    Index the features of a layer by id, in the order they are read from the layer
+    :param layer: QgsVectorLayer
+    :param name: id field name, uses the feature id if empty
+    :return: dict of id: row, list of feature ids by row
+    """
+    fids = []
+    ids = []
+    if layer:
+        if name != '' and fieldExists(layer, name):
+            request = QgsFeatureRequest().setSubsetOfAttributes([getFieldIndex(layer, name)])
+            request.setFlags(QgsFeatureRequest.NoGeometry)
+            for feature in layer.getFeatures(request):
+                fids.append(feature.id())
+                ids.append(feature.attribute(name))
+        else:
+            request = QgsFeatureRequest().setSubsetOfAttributes([])
+            request.setFlags(QgsFeatureRequest.NoGeometry)
+            for feature in layer.getFeatures(request):
+                fids.append(feature.id())
+            ids = fids
+    return getIdIndex(ids), fids
+
+
+def getGeometryKey(geom, snap=0.0):
+    """
+    Normalised coordinates of a geometry, the same for geometries with the same vertices
+    in any direction, ring start or part order
+    :param geom: QgsGeometry
+    :param snap: grid size the coordinates are snapped to, exact coordinates if 0
+    :return: hashable tuple, None for empty geometry
+    """
+    if geom is None or geom.isGeosEmpty():
+        return None
+
+    def vertices(points):
+        if snap > 0:
+            return tuple((round(point.x()/snap), round(point.y()/snap)) for point in points)
+        return tuple((point.x(), point.y()) for point in points)
+
+    def ring(points):
+        # closed ring without the repeated vertex, starting at the lowest vertex
+        points = vertices(points)[:-1]
+        if not points:
+            return points
+        first = points.index(min(points))
+        forward = points[first:] + points[:first]
+        return min(forward, forward[:1] + tuple(reversed(forward[1:])))
+
+    gtype = geom.type()
+    if gtype == QGis.Point:
+        if geom.isMultipart():
+            parts = tuple(sorted(vertices(geom.asMultiPoint())))
+        else:
+            parts = vertices([geom.asPoint()])
+    elif gtype == QGis.Line:
+        if geom.isMultipart():
+            lines = geom.asMultiPolyline()
+        else:
+            lines = [geom.asPolyline()]
+        parts = tuple(sorted(min(line, tuple(reversed(line))) for line in (vertices(l) for l in lines)))
+    elif gtype == QGis.Polygon:
+        if geom.isMultipart():
+            polygons = geom.asMultiPolygon()
+        else:
+            polygons = [geom.asPolygon()]
+        parts = tuple(sorted((ring(rings[0]),) + tuple(sorted(ring(r) for r in rings[1:]))
+                             for rings in polygons if rings))
+    else:
+        return None
+    return gtype, parts
+
+
+def getDuplicateGeometries(features, snap=0.0):
+    """
+    Find features with equal geometry, grouping them by geometry key and confirming matches with GEOS
+    :param features: iterable of (id, QgsGeometry)
+    :param snap: grid size used for the geometry key
+    :return: dict of id: list of ids of the other features with equal geometry
+    """
+    groups = {}
+    for id, geom in features:
+        key = getGeometryKey(geom, snap)
+        if key is not None:
+            groups.setdefault(key, []).append((id, geom))
+    duplicates = {}
+    for group in groups.itervalues():
+        if len(group) < 2:
+            continue
+        for i, (id, geom) in enumerate(group):
+            for id_b, geom_b in group[i+1:]:
+                if id_b != id and geom.isGeosEqual(geom_b):
+                    duplicates.setdefault(id, []).append(id_b)
+                    duplicates.setdefault(id_b, []).append(id)
+    return duplicates
+
+
 def getAllFeatureIds(layer):
     ids = []
     if layer:
@@ -554,46 +683,9 @@ def createIndex(layer):
         return None
 
 
-# Function to build a topology from line layer
-def buildTopology(self, axial, unlinks, links):
-    index = createIndex(axial)
-    axial_links = []
-    unlinks_list = []
-    links_list = []
-    # get unlinks pairs
-    if unlinks:
-        features = unlinks.getFeatures(QgsFeatureRequest().setSubsetOfAttributes(['line1','line2'],unlinks.pendingFields()))
-        for feature in features:
-            unlinks_list.append((feature.attribute('line1'),feature.attribute('line2')))
-    # get links pairs
-    if links:
-        features = links.getFeatures(QgsFeatureRequest().setSubsetOfAttributes(['line1','line2'],links.pendingFields()))
-        for feature in features:
-            links_list.append((feature.attribute('line1'),feature.attribute('line2')))
-    # get axial intersections
-    features = axial.getFeatures(QgsFeatureRequest().setSubsetOfAttributes([]))
-    for feature in features:
-        geom = feature.geometry()
-        id = feature.id()
-        box = geom.boundingBox()
-        request = QgsFeatureRequest()
-        if index:
-            # should be faster to retrieve from index (if available)
-            ints = index.intersects(box)
-            request.setFilterFids(ints)
-        else:
-            # can retrieve objects using bounding box
-            request.setFilterRect(box)
-        request.setSubsetOfAttributes([])
-        targets = axial.getFeatures(request)
-        for target in targets:
-            geom_b = target.geometry()
-            id_b = target.id()
-            if not id_b == id and geom.intersects(geom_b):
-                # check if in the unlinks
-                if (id,id_b) not in unlinks_list and (id,id_b) not in unlinks_list:
-                    axial_links.append((id,id_b))
-    return axial_links
+# Function to get a folder for files kept between sessions, in the QGIS settings folder
+def getCachePath(name):
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), 'esst', name)
 
 
 #------------------------------
@@ -851,91 +943,119 @@ def createSpatialiteTable(connection, path, name, srid, attributes, types, geome
         fields=', %s'%fields
     header, data, error = executeSpatialiteQuery(connection,"""CREATE TABLE "%s" ( pk_id INTEGER PRIMARY KEY AUTOINCREMENT %s )""" % (name, fields))
     #Recover Geometry Column:
+    # the spatial index is created by insertSpatialiteValues, once the values are inserted, also if there are none
     if geometry:
         header, data, error = executeSpatialiteQuery(connection,"""SELECT RecoverGeometryColumn("%s",'geometry',%s,'%s',2)""" % (name,srid,geometry))
-        header,data, error = executeSpatialiteQuery(connection,"""SELECT CreateSpatialIndex("%s", "%s") """%(name,'geometry'))
     return True
 
 
-def insertSpatialiteValues(connection, name, attributes, values, coords=None):
-    # get table srid and geometry column info
-    geometry_attr = ''
-    srid = ''
-    geometry_type = ''
-    for table in listSpatialiteGeomTables(connection):
-        if table[0] == name:
-            geometry_attr = table[1]
-            geometry_type = table[2]
-            srid = table[4]
-    if geometry_attr == '':
-        return False
-    # iterate through values to populate geometry and attributes
-    if values:
-        for val in values:
-            geometry_values = ""
-            if geometry_type in (1,4) and len(coords) == 2:
-                WKT = "POINT(%s %s)" % (val[coords[0]],val[coords[1]])
-                geometry_values = 'CastToMulti(GeomFromText("%s",%s))'%(WKT,srid)
-            elif geometry_type in (2,5) and len(coords) == 4:
-                WKT = "LINESTRING(%s %s, %s %s)" % (val[coords[0]],val[coords[1]],val[coords[2]],val[coords[3]])
-                geometry_values = 'CastToMulti(GeomFromText("%s",%s))'%(WKT,srid)
-            #Create line in DB table
-            attr_values = ','.join(tuple([unicode(value) for value in val]))
-            if geometry_values == "":
-                header, data, error = executeSpatialiteQuery(connection,"""INSERT INTO "%s" (%s) VALUES (%s)""" % (name, ','.join(attributes), attr_values), commit=True)
-            else:
-                header, data, error = executeSpatialiteQuery(connection,"""INSERT INTO "%s" (%s,%s) VALUES (%s,%s)""" % (name, geometry_attr, ','.join(attributes), geometry_values, attr_values), commit=True)
+def getSpatialiteGeometryInfo(connection, name):
+    # geometry column, geometry type and srid of a table
+    query = """SELECT f_geometry_column, geometry_type, srid FROM geometry_columns WHERE lower(f_table_name) = lower(?)"""
+    header, data, error = executeSpatialiteQuery(connection, query, (name,))
+    if not data:
+        return '', 0, 0
+    return data[0][0], int(data[0][1]) % 1000, int(data[0][2])
+
+
+# spatialite blob geometry, little endian: start, endian, srid, mbr, mbr end, class, number of parts
+SPATIALITE_BLOB_HEADER = struct.Struct('<BBi4dBii')
+SPATIALITE_BLOB_PART = struct.Struct('<Bii')
+
+
+def getSpatialiteBlob(srid, geometry_type, parts):
+    """
+    Build the spatialite blob of a multi geometry, without calling spatialite
+    :param srid: srid of the geometry
+    :param geometry_type: geometry_columns type, 1 or 4 points, 2 or 5 lines, 3 or 6 polygons
+    :param parts: list of parts, each a list of (x, y) points. polygon parts are closed rings
+    :return: buffer to insert in a geometry column
+    """
+    xs = [point[0] for part in parts for point in part]
+    ys = [point[1] for part in parts for point in part]
+    geometry_type = (geometry_type - 1) % 3 + 1
+    blob = [SPATIALITE_BLOB_HEADER.pack(0x00, 0x01, srid, min(xs), min(ys), max(xs), max(ys), 0x7C,
+                                        geometry_type + 3, len(parts))]
+    for part in parts:
+        coords = [value for point in part for value in point[:2]]
+        if geometry_type == 1:
+            blob.append(struct.pack('<Bi', 0x69, 1))
+        elif geometry_type == 2:
+            blob.append(SPATIALITE_BLOB_PART.pack(0x69, 2, len(part)))
+        else:
+            blob.append(SPATIALITE_BLOB_PART.pack(0x69, 3, 1) + struct.pack('<i', len(part)))
+        blob.append(struct.pack('<%dd' % len(coords), *coords))
+    blob.append(chr(0xFE))
+    return sqlite.Binary(''.join(blob))
+
+
+def insertSpatialiteRows(connection, name, geometry_attr, blobs, attributes, values):
+    # insert the geometry blobs and attribute values in one transaction
+    # without rows the table stays empty, it still gets its spatial index
+    columns = []
+    if blobs is not None:
+        columns.append(geometry_attr)
+    if attributes:
+        columns.extend(attributes)
+    if blobs is not None and attributes:
+        rows = ([blob] + list(val) for blob, val in izip(blobs, values))
+    elif blobs is not None:
+        rows = ([blob] for blob in blobs)
     else:
+        rows = values
+    query = """INSERT INTO "%s" (%s) VALUES (%s)""" % (name, ','.join(['"%s"' % col for col in columns]),
+                                                       ','.join('?' * len(columns)))
+    cursor = connection.cursor()
+    try:
+        cursor.executemany(query, rows)
+        connection.commit()
+    except sqlite.Error, error:
+        connection.rollback()
+        cursor.close()
+        pop_up_error("The values could not be inserted. \n %s" % error)
         return False
-    #Commit changes to connection:
-    connection.commit()
-    #create spatial index
-    header, data, error = executeSpatialiteQuery(connection,"""SELECT CreateSpatialIndex("%s", "%s") """ % (name,'geometry'))
-    return True
+    cursor.close()
+    #create spatial index, after the insert so that it's built in one go
+    header, data, error = executeSpatialiteQuery(connection,"""SELECT CreateSpatialIndex("%s", "%s") """ % (name,geometry_attr), commit=True)
+    return error == ''
 
 
-def insertSpatialiteGeometry(connection, name, geometry, attributes=None, values=None):
-    # get table srid and geometry column
-    geometry_attr = ''
-    srid = ''
-    geometry_type = ''
-    for table in listSpatialiteGeomTables(connection):
-        if table[0] == name:
-            geometry_attr = table[1]
-            geometry_type = table[2]
-            srid = table[4]
+def insertSpatialiteValues(connection, name, attributes, values, coords=None):
+    # insert rows of values, with a point or line geometry from the coordinate columns
+    # the values can be any iterable of rows, it is read only once
+    geometry_attr, geometry_type, srid = getSpatialiteGeometryInfo(connection, name)
     if geometry_attr == '':
         return False
-    #
-    if geometry:
-        for i, geom in enumerate(geometry):
-            WKT = ""
-            if geometry_type in (1,4) and len(geom) == 2:
-                WKT = "POINT (%s %s)" % (geom[0],geom[1])
-            elif len(geom) > 2:
-                coords = []
-                for pair in grouper(geom,2):
-                    coords.append(pair)
-                if geometry_type in (2,5):
-                    WKT = "LINESTRING (%s)" % ','.join(coords)
-                else:
-                    WKT = "POLYGON ((%s))" % ','.join(coords)
-            else:
-                return False
-            geometry_values = 'CastToMulti(GeomFromText("%s",%s))'%(WKT,srid)
-            #Create line in DB table
-            if attributes:
-                attr_values = ','.join(tuple([unicode(value) for value in values[i]]))
-                header, data, error = executeSpatialiteQuery(connection,"""INSERT INTO "%s" (%s,%s) VALUES (%s,%s)""" % (name, geometry_attr, ','.join(attributes), geometry_values, attr_values))
-            else: #no attribute data, only geometry
-                header, data, error = executeSpatialiteQuery(connection,"""INSERT INTO "%s" (%s) VALUES (%s)""" % (name, geometry_attr, geometry_values))
-    else:
+    blobs = None
+    if coords and geometry_type in (1,4) and len(coords) == 2:
+        x, y = coords
+        values, points = tee(values)
+        blobs = (getSpatialiteBlob(srid, geometry_type, [[(float(val[x]), float(val[y]))]]) for val in points)
+    elif coords and geometry_type in (2,5) and len(coords) == 4:
+        x1, y1, x2, y2 = coords
+        values, points = tee(values)
+        blobs = (getSpatialiteBlob(srid, geometry_type, [[(float(val[x1]), float(val[y1])), (float(val[x2]), float(val[y2]))]])
+                 for val in points)
+    return insertSpatialiteRows(connection, name, geometry_attr, blobs, attributes, values)
+
+
+def insertSpatialiteGeometry(connection, name, geometry, attributes=None, values=None):
+    # insert geometries given as flat lists of coordinates, with optional attribute values
+    geometry_attr, geometry_type, srid = getSpatialiteGeometryInfo(connection, name)
+    if geometry_attr == '' or geometry is None:
         return False
-    #Commit changes to connection:
-    connection.commit()
-    #create spatial index
-    header, data, error = executeSpatialiteQuery(connection,"""SELECT CreateSpatialIndex("%s", "%s") """ % (name,'geometry'))
-    return True
+    blobs = []
+    for geom in geometry:
+        points = [(float(x), float(y)) for x, y in grouper(geom, 2)]
+        if geometry_type in (1,4) and len(points) == 1:
+            blobs.append(getSpatialiteBlob(srid, geometry_type, [points]))
+        elif geometry_type not in (1,4) and len(points) > 1:
+            if geometry_type in (3,6) and points[0] != points[-1]:
+                points.append(points[0])
+            blobs.append(getSpatialiteBlob(srid, geometry_type, [points]))
+        else:
+            return False
+    return insertSpatialiteRows(connection, name, geometry_attr, blobs, attributes, values)
 
 
 def addSpatialiteColumns(connection, name, columns, types):
@@ -983,8 +1103,21 @@ def dropSpatialiteColumns(connection, name, columns):
     return res
 
 
-def addSpatialiteAttributes(connection, name, attributes, types, values):
-    # add attributes with values to the layer
+def createSpatialiteLinePairs(connection, pairsname, name):
+    # temporary table of the distinct (least, greatest) line id pairs of a links or unlinks table
+    # the primary key indexes the pairs, for joins with the topology
+    header, data, error = executeSpatialiteQuery(connection, """DROP TABLE IF EXISTS "%s" """ % pairsname)
+    query = """CREATE TEMP TABLE "%s" (a_fid INTEGER NOT NULL, b_fid INTEGER NOT NULL, PRIMARY KEY (a_fid, b_fid))""" % pairsname
+    header, data, error = executeSpatialiteQuery(connection, query)
+    query = """INSERT OR IGNORE INTO "%s" (a_fid, b_fid) SELECT MIN(line1, line2), MAX(line1, line2) FROM %s """\
+            """WHERE line1 IS NOT NULL AND line2 IS NOT NULL""" % (pairsname, name)
+    header, data, error = executeSpatialiteQuery(connection, query, commit=True)
+    return pairsname
+
+
+def addSpatialiteAttributes(connection, name, attributes, types, values, ids=None, idcol='rowid'):
+    # add attributes with values to the layer, matching each row of values by its id in the id column
+    # without ids, the values are matched by position to the rowid
     fields = listSpatialiteColumns(connection, name)
     for i, attr in enumerate(attributes):
         #add new field if it doesn't exist
@@ -999,21 +1132,37 @@ def addSpatialiteAttributes(connection, name, attributes, types, values):
             if field_type != '':
                 query = """ALTER TABLE %s ADD COLUMN %s %s""" % (name, attr, field_type)
                 header, data, error = executeSpatialiteQuery(connection,query)
-    # update attribute values iterating over values
     fields = listSpatialiteColumns(connection, name)
-    for i, val in enumerate(values):
-        new_values = []
-        for j, attr in enumerate(attributes):
-            if attr in fields.keys():
-                if types[j] in (QVariant.Char,QVariant.String):
-                    new_values.append("""'%s' = '%s'""" % (attr,val[j]))
-                else:
-                    new_values.append("""'%s' = %s""" % (attr,val[j]))
-        if len(new_values) > 0:
-            query = """UPDATE "%s" SET %s WHERE rowid = %s""" % (name, ', '.join(new_values), i+1)
-            header, data, error = executeSpatialiteQuery(connection,query)
-            if error:
-                return False
+    columns = [j for j, attr in enumerate(attributes) if attr in fields.keys()]
+    if not columns:
+        return True
+    if ids is None:
+        ids = count(1)
+    # the key has the type of the id column, so that the updates can look it up in the index
+    key_type = fields.get(idcol, 'INTEGER').upper()
+    if idcol.lower() in ('rowid', 'oid', '_rowid_') or key_type in ('INT', 'INTEGER', 'BIGINT'):
+        key_type = 'INTEGER'
+    stagename = "temp_attributes"
+    cursor = connection.cursor()
+    try:
+        # stage the values in one transaction, then update all the rows in a single statement
+        cursor.execute("""DROP TABLE IF EXISTS "%s" """ % stagename)
+        cursor.execute("""CREATE TEMP TABLE "%s" (key %s PRIMARY KEY, %s)""" %
+                       (stagename, key_type, ', '.join(['"c%d"' % j for j in columns])))
+        query = """INSERT OR REPLACE INTO "%s" VALUES (%s)""" % (stagename, ','.join('?' * (len(columns) + 1)))
+        cursor.executemany(query, ([id] + [val[j] for j in columns] for id, val in izip(ids, values) if id is not None))
+        updates = ['"%s" = (SELECT "c%d" FROM "%s" WHERE key = "%s"."%s")' % (attributes[j], j, stagename, name, idcol)
+                   for j in columns]
+        query = """UPDATE "%s" SET %s WHERE "%s" IN (SELECT key FROM "%s")""" % (name, ', '.join(updates), idcol, stagename)
+        cursor.execute(query)
+        cursor.execute("""DROP TABLE "%s" """ % stagename)
+        connection.commit()
+    except sqlite.Error, error:
+        connection.rollback()
+        cursor.close()
+        pop_up_error("The analysis results could not be written. \n %s" % error)
+        return False
+    cursor.close()
     query = """SELECT UpdateLayerStatistics("%s")""" % name
     header, data, error = executeSpatialiteQuery(connection,query)
     #Commit changes to connection:
@@ -1021,7 +1170,13 @@ def addSpatialiteAttributes(connection, name, attributes, types, values):
     return True
 
 
-def copyLayerToSpatialite(connection, layer, path, name):
+def copyLayerToSpatialite(connection, layer, path, name, batch=10000, progress=None):
+    """
+    Copy a layer to a new table of a spatialite database
+    :param batch: number of features inserted at once
+    :param progress: optional callable receiving the percentage done, returning False to abort
+    :return: True if the layer was copied
+    """
     #Drop table
     header,data, error = executeSpatialiteQuery(connection,"""DROP TABLE IF EXISTS "%s" """ % name)
     #Get layer provider
@@ -1079,23 +1234,47 @@ def copyLayerToSpatialite(connection, layer, path, name):
     #Recover Geometry Column:
     if geometry:
         header, data, error=executeSpatialiteQuery(connection,"""SELECT RecoverGeometryColumn("%s",'geometry',%s,'%s',2)"""%(name,srid,geometry,))
-    # Retrieve every feature
-    for feat in layer.getFeatures():
-        #PKUID and Geometry
-        values_auto=['NULL'] #PKUID value
-        if geometry:
-            geom = feat.geometry()
-            WKT=geom.exportToWkt()
-            values_auto.append('CastToMulti(GeomFromText("%s",%s))'%(WKT,srid))
-        # show all attributes and their values
-        values=[]
-        for val in allAttrs: # All except PKUID
-            values.append(feat[val])
-        #Create line in DB table
-        if len(fields)>0:
-            header, data, error = executeSpatialiteQuery(connection,"""INSERT INTO "%s" VALUES (%s,%s)""" % (name,','.join([unicode(value).encode('utf-8') for value in values_auto]), ','.join('?'*len(values))), tuple([unicode(value) for value in values]))
-        else: #no attribute data
-            header, data, error = executeSpatialiteQuery(connection,"""INSERT INTO "%s" VALUES (%s)""" % (name,','.join([unicode(value).encode('utf-8') for value in values_auto])))
+    # stream the features in batches, with the geometry as wkb, in one transaction
+    request = QgsFeatureRequest().setSubsetOfAttributes(allAttrs)
+    values_auto = ['NULL'] #PKUID value
+    if geometry:
+        values_auto.append('CastToMulti(GeomFromWKB(?,%s))' % srid)
+    query = """INSERT INTO "%s" VALUES (%s)""" % (name, ','.join(values_auto + ['?'] * len(allAttrs)))
+    count = max(layer.featureCount(), 1)
+    done = 0
+    rows = []
+    cursor = connection.cursor()
+    try:
+        for feat in layer.getFeatures(request):
+            row = []
+            if geometry:
+                geom = feat.geometry()
+                row.append(sqlite.Binary(geom.asWkb()) if geom else None)
+            for val in allAttrs: # All except PKUID
+                value = feat[val]
+                if value == NULL:
+                    value = None
+                elif not isinstance(value, (int, long, float, basestring)):
+                    value = unicode(value)
+                row.append(value)
+            rows.append(row)
+            if len(rows) == batch:
+                cursor.executemany(query, rows)
+                done += len(rows)
+                rows = []
+                if progress and not progress(int(100.0 * done / count)):
+                    connection.rollback()
+                    cursor.close()
+                    executeSpatialiteQuery(connection, """DROP TABLE IF EXISTS "%s" """ % name, commit=True)
+                    return False
+        if rows:
+            cursor.executemany(query, rows)
+    except sqlite.Error, error:
+        connection.rollback()
+        cursor.close()
+        pop_up_error("The layer could not be copied. \n %s" % error)
+        return False
+    cursor.close()
     for date in mapinfoDate: #mapinfo compatibility: convert date in SQLITE format (2010/02/11 -> 2010-02-11 ) or rollback if any error
         header, data, error = executeSpatialiteQuery(connection,"""UPDATE OR ROLLBACK "%s" set '%s'=replace( "%s", '/' , '-' )  """%(name,date[1],date[1]))
     #Commit changes to connection:
@@ -1281,8 +1460,12 @@ def insertShapeFileGeometry(path, name, srid, geometry, attributes=None, values=
     pass
 
 
-def addShapeFileAttributes(layer, attributes, types, values):
-    # add attributes to the layer
+def addShapeFileAttributes(layer, attributes, types, values, fids=None, chunk=10000):
+    """
+    Add attributes with values to a layer, in a few calls to the provider
+    :param fids: feature id of each row of values, in the order of the features if None
+    :param chunk: number of features changed in each call
+    """
     attributes_pos = dict()
     res = False
     if layer:
@@ -1299,34 +1482,256 @@ def addShapeFileAttributes(layer, attributes, types, values):
                     # keep position of attributes that are added, since name can change
                     attributes_pos[i] = count
                     count += 1
+                else:
+                    attributes_pos[i] = fields.indexFromName(name)
             #apply changes if any made
             if res:
                 layer.updateFields()
-        # update attribute values by iterating the layer's features
+        # update attribute values with one map of feature id to attributes
         res = False
         if caps & QgsVectorDataProvider.ChangeAttributeValues:
-            #fields = provider.fields() #the fields must be retrieved again after the updateFields() method
-            iter = layer.getFeatures()
-            for i, feature in enumerate(iter):
-                fid = feature.id()
-                #to update the features the attribute/value pairs must be converted to a dictionary for each feature
-                attrs = {}
-                for j in attributes_pos.iterkeys():
-                    field_id = attributes_pos[j]
-                    val = values[i][j]
-                    attrs.update({field_id: val})
-                #update the layer with the corresponding dictionary
-                res = provider.changeAttributeValues({fid: attrs})
+            if fids is None:
+                request = QgsFeatureRequest().setSubsetOfAttributes([])
+                request.setFlags(QgsFeatureRequest.NoGeometry)
+                fids = [feature.id() for feature in layer.getFeatures(request)]
+            changes = dict()
+            for fid, val in izip(fids, values):
+                if fid is not None:
+                    changes[fid] = dict((field_id, val[j]) for j, field_id in attributes_pos.iteritems())
+            # each call to the provider is written to disk, the changes are applied in chunks
+            fids = changes.keys()
+            for start in xrange(0, len(fids), chunk):
+                res = provider.changeAttributeValues(dict((fid, changes[fid]) for fid in fids[start:start + chunk]))
+                if not res:
+                    break
             #apply changes if any made
             if res:
                 layer.updateFields()
     return res
 
 
+#---------------------------------------------
+# GeoPackage specific functions
+#---------------------------------------------
+# ogr multi geometry of each QGis geometry type: point, line, polygon
+GEOPACKAGE_GEOMETRY = {0: 4, 1: 5, 2: 6}
+
+
+def isGeopackageLayer(layer):
+    return layer.providerType() == 'ogr' and layer.dataProvider().dataSourceUri().split('|')[0].lower().endswith('.gpkg')
+
+
+def listGeopackages():
+    # get file name and path of the geopackages of open layers
+    res = dict()
+    res['idx'] = 0
+    res['name'] = []
+    res['path'] = []
+    layers = getVectorLayers('all', 'ogr')
+    for layer in layers:
+        if isGeopackageLayer(layer):
+            path = getLayerPath(layer)
+            if path not in res['path']:
+                res['name'].append(os.path.basename(path))
+                res['path'].append(path)
+    #case: no geopackages available
+    if len(res['name']) < 1:
+        res = None
+    #return the result even if empty
+    return res
+
+
+def createGeopackage(path):
+    if not has_ogr:
+        pop_up_error("Creating a GeoPackage requires the GDAL python bindings.")
+        return False
+    datasource = ogr.GetDriverByName('GPKG').CreateDataSource(path)
+    res = datasource is not None
+    datasource = None
+    return res
+
+
+def testGeopackageTableExists(path, name):
+    if not has_ogr or not os.path.isfile(path):
+        return False
+    datasource = ogr.Open(path)
+    exists = datasource is not None and datasource.GetLayerByName(name) is not None
+    datasource = None
+    return exists
+
+
+def getGeopackageLayer(path, name):
+    vlayer = QgsVectorLayer("%s|layername=%s" % (path, name), name, "ogr")
+    if not vlayer.isValid():
+        print "Layer failed to load!"
+        return None
+    return vlayer
+
+
+def getLineWkb(points):
+    # little endian wkb of a line from a list of (x, y) points
+    coords = [value for point in points for value in point]
+    return struct.pack('<BIi%dd' % len(coords), 1, 2, len(points), *coords)
+
+
+def getOgrFieldType(type):
+    # integer results can go beyond 32 bits, like the choice of large maps, they use 64 bit fields if available
+    if type == QVariant.Bool:
+        return ogr.OFTInteger
+    elif type in (QVariant.Int,QVariant.UInt):
+        return getattr(ogr, 'OFTInteger64', ogr.OFTInteger)
+    elif type in (QVariant.LongLong,QVariant.ULongLong):
+        return getattr(ogr, 'OFTInteger64', ogr.OFTReal)
+    elif type == QVariant.Double:
+        return ogr.OFTReal
+    return ogr.OFTString
+
+
+def setOgrFieldValue(feature, i, field_type, value):
+    # set the value with the python type of the field, NULL values are left unset
+    if value is None or value == NULL:
+        return
+    if field_type == ogr.OFTInteger:
+        value = int(value)
+        if not -2147483648 <= value <= 2147483647:
+            raise OverflowError("%d is out of the range of an integer field" % value)
+        feature.SetField(i, value)
+    elif field_type == getattr(ogr, 'OFTInteger64', None):
+        feature.SetFieldInteger64(i, long(value))
+    elif field_type == ogr.OFTReal:
+        feature.SetField(i, float(value))
+    else:
+        if not isinstance(value, basestring):
+            value = unicode(value)
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        feature.SetField(i, value)
+
+
+def writeGeopackageTable(path, name, srid, attributes, types, rows, geometry_type):
+    """
+    Write a table to a geopackage with a spatial index, replacing a table with the same name.
+    The features are inserted in one transaction, keeping the full attribute names.
+    :param srid: EPSG code of the geometry
+    :param rows: iterable of (wkb or None, list of values)
+    :param geometry_type: QGis geometry type, the geometry is stored as multi geometry
+    :return: True if the table was written
+    """
+    if not has_ogr:
+        pop_up_error("Writing a GeoPackage requires the GDAL python bindings.")
+        return False
+    driver = ogr.GetDriverByName('GPKG')
+    if os.path.isfile(path):
+        datasource = driver.Open(path, 1)
+    else:
+        datasource = driver.CreateDataSource(path)
+    if datasource is None:
+        pop_up_error("Unable to open the GeoPackage %s." % path)
+        return False
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(int(srid))
+    layer = datasource.CreateLayer(unicode(name).encode('utf-8'), srs, GEOPACKAGE_GEOMETRY.get(geometry_type, ogr.wkbUnknown),
+                                   ['OVERWRITE=YES', 'SPATIAL_INDEX=YES'])
+    if layer is None:
+        datasource = None
+        pop_up_error("Unable to create the table %s in the GeoPackage.\n%s" % (name, gdal.GetLastErrorMsg()))
+        return False
+    field_types = [getOgrFieldType(type) for type in types]
+    for i, attr in enumerate(attributes):
+        layer.CreateField(ogr.FieldDefn(unicode(attr).encode('utf-8'), field_types[i]))
+    definition = layer.GetLayerDefn()
+    res = True
+    message = ''
+    # one transaction for all the features, on the dataset with GDAL 2
+    transaction = layer
+    if hasattr(datasource, 'StartTransaction') and datasource.StartTransaction() == 0:
+        transaction = datasource
+    else:
+        layer.StartTransaction()
+    try:
+        for wkb, values in rows:
+            feature = ogr.Feature(definition)
+            if wkb:
+                feature.SetGeometry(ogr.ForceToMulti(ogr.CreateGeometryFromWkb(wkb)))
+            for i, value in enumerate(values):
+                setOgrFieldValue(feature, i, field_types[i], value)
+            if layer.CreateFeature(feature) != 0:
+                res = False
+                message = gdal.GetLastErrorMsg()
+                break
+    except (TypeError, ValueError, OverflowError, NotImplementedError, RuntimeError), e:
+        res = False
+        message = str(e)
+    if res and transaction.CommitTransaction() != 0:
+        res = False
+        message = gdal.GetLastErrorMsg()
+    if not res:
+        transaction.RollbackTransaction()
+        pop_up_error("Unable to write the features of the table %s in the GeoPackage.\n%s" % (name, message))
+    datasource = None
+    return res
+
+
 #---------------------------------------------
 # PostGIS database specific functions
 #---------------------------------------------
 
 # newfeature: create all PostGIS functions
 def listPostgisConnections():
-    pass
\ No newline at end of file
+    pass
+
+def executePostgisQuery(connection, query, params=None, commit=False):
+    """Execute query (string) with given parameters (tuple)
+    (optionnaly perform commit to save Db) and return result set [header,data]
+    or [error] error"""
+    query = unicode(query)
+    header = []
+    data = []
+    error = ''
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query, params)
+        if cursor.description is not None:
+            header = [item[0] for item in cursor.description]
+            data = cursor.fetchall()
+        if commit:
+            connection.commit()
+    except pgsql.Error, error:
+        connection.rollback()
+        pop_up_error("The SQL query seems to be invalid. \n %s" % error)
+    cursor.close()
+    #return the result even if empty
+    return header, data, error
+
+
+def getPostgisLayerName(layer):
+    # schema qualified and quoted table name of the layer
+    uri = QgsDataSourceURI(layer.dataProvider().dataSourceUri())
+    if uri.schema():
+        return '"%s"."%s"' % (uri.schema(), uri.table())
+    return '"%s"' % uri.table()
+
+
+def getPostgisGeometryColumn(layer):
+    uri = QgsDataSourceURI(layer.dataProvider().dataSourceUri())
+    return uri.geometryColumn()
+
+
+def getPostgisKeyColumn(layer):
+    # the column used by QGIS for the feature ids
+    uri = QgsDataSourceURI(layer.dataProvider().dataSourceUri())
+    return uri.keyColumn()
+
+
+def testPostgisSpatialIndex(layer):
+    # check that the geometry column has a GiST index, without changing the database
+    uri = QgsDataSourceURI(layer.dataProvider().dataSourceUri())
+    schema = uri.schema() or 'public'
+    connection = getLayerConnection(layer)
+    query = """SELECT indexdef FROM pg_indexes WHERE schemaname = %s AND tablename = %s"""
+    header, data, error = executePostgisQuery(connection, query, (schema, uri.table()))
+    connection.close()
+    for row in data:
+        if 'gist' in row[0].lower() and uri.geometryColumn() in row[0]:
+            return True
+    return False
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Tests of the built-in axial analysis on small graphs with known values, runnable without QGIS:
+#   python -m unittest discover tests
+
+import os
+import sys
+import math
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from esstools.network_functions import buildAdjacency, calcAxialMeasures, getLineIntersections
+
+
+def getIntegration(td, k):
+    # integration [HH] of one node, as in depthmapX
+    md = td / (k - 1.0)
+    ra = 2.0 * (md - 1.0) / (k - 2.0)
+    dk = 2.0 * (k * (math.log((k + 2.0) / 3.0, 2) - 1.0) + 1.0) / ((k - 1.0) * (k - 2.0))
+    return dk / ra
+
+
+class AxialAnalysisTest(unittest.TestCase):
+
+    def getMeasures(self, n, edges, radii=[0], batch=None):
+        indptr, indices = buildAdjacency(n, np.array(edges))
+        return calcAxialMeasures(indptr, indices, radii, True, True, batch=batch)
+
+    def testLine(self):
+        # 0 - 1 - 2
+        measures = self.getMeasures(3, [(0, 1), (1, 2)])
+        self.assertEqual(measures['Connectivity'].tolist(), [1, 2, 1])
+        self.assertEqual(measures['Node Count'].tolist(), [3, 3, 3])
+        np.testing.assert_allclose(measures['Mean Depth'], [1.5, 1.0, 1.5])
+        np.testing.assert_allclose(measures['Choice'], [0.0, 1.0, 0.0])
+        np.testing.assert_allclose(measures['Choice [Norm]'], [0.0, 1.0, 0.0])
+        # the middle line has zero relative asymmetry, integration is undefined
+        np.testing.assert_allclose(measures['Integration [HH]'], [getIntegration(3.0, 3), -1.0, getIntegration(3.0, 3)])
+        np.testing.assert_allclose(measures['Harmonic Mean Depth'], [2.0 / 1.5, 1.0, 2.0 / 1.5])
+        # the ends see one line at depth 1 and one at depth 2
+        np.testing.assert_allclose(measures['Entropy'], [1.0, 0.0, 1.0])
+
+    def testStar(self):
+        # line 0 crosses the lines 1 to 4
+        measures = self.getMeasures(5, [(0, i) for i in range(1, 5)], [0, 1])
+        self.assertEqual(measures['Connectivity'].tolist(), [4, 1, 1, 1, 1])
+        np.testing.assert_allclose(measures['Mean Depth'], [1.0] + [7.0 / 4.0] * 4)
+        np.testing.assert_allclose(measures['Integration [HH]'], [-1.0] + [getIntegration(7.0, 5)] * 4)
+        # the centre is on the path between every pair of the other lines
+        np.testing.assert_allclose(measures['Choice'], [6.0, 0.0, 0.0, 0.0, 0.0])
+        np.testing.assert_allclose(measures['Choice [Norm]'], [1.0, 0.0, 0.0, 0.0, 0.0])
+        self.assertEqual(measures['Node Count R1'].tolist(), [5, 2, 2, 2, 2])
+        np.testing.assert_allclose(measures['Mean Depth R1'], [1.0] * 5)
+        # with radius 1 there are no paths through the centre
+        np.testing.assert_allclose(measures['Choice R1'], [0.0] * 5)
+
+    def testGrid(self):
+        # three horizontal lines crossing three vertical lines
+        coords = [(-1.0, float(i), 3.0, float(i)) for i in range(3)] + \
+                 [(float(i), -1.0, float(i), 3.0) for i in range(3)]
+        edges = getLineIntersections(np.array(coords))
+        self.assertEqual(len(edges), 9)
+        measures = self.getMeasures(6, edges, batch=2)
+        self.assertEqual(measures['Connectivity'].tolist(), [3] * 6)
+        self.assertEqual(measures['Node Count'].tolist(), [6] * 6)
+        np.testing.assert_allclose(measures['Mean Depth'], [7.0 / 5.0] * 6)
+        np.testing.assert_allclose(measures['Integration [HH]'], [getIntegration(7.0, 6)] * 6)
+        # each pair of parallel lines has three shortest paths, one through each crossing line
+        np.testing.assert_allclose(measures['Choice'], [1.0] * 6)
+        # log(0.5 * (k - 2)) / log(td - k + 1) = log(2) / log(2)
+        np.testing.assert_allclose(measures['Integration [Tekl]'], [1.0] * 6)
+
+    def testIsolatedLine(self):
+        measures = self.getMeasures(3, [(0, 1)])
+        self.assertEqual(measures['Node Count'].tolist(), [2, 2, 1])
+        np.testing.assert_allclose(measures['Mean Depth'], [1.0, 1.0, -1.0])
+        np.testing.assert_allclose(measures['Integration [HH]'], [-1.0, -1.0, -1.0])
+
+    def testBatches(self):
+        # the results don't depend on the number of sources searched together
+        edges = [(i, i + 1) for i in range(9)] + [(0, 5), (3, 8)]
+        single = self.getMeasures(10, edges, [0, 2], batch=1)
+        full = self.getMeasures(10, edges, [0, 2], batch=10)
+        for name in single.keys():
+            np.testing.assert_allclose(single[name], full[name], err_msg=name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Tests of the normalised segment measures (NACH and NAIN), runnable without QGIS:
+#   python -m unittest discover tests
+
+import os
+import sys
+import math
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from esstools.network_functions import calcNormalisedSegment
+
+
+def scalarNormalisedSegment(attributes, values):
+    # row by row implementation of the normalised measures, as calculated before using numpy
+    choice = []
+    nc = []
+    td = []
+    nach = []
+    nain = []
+    for i, attr in enumerate(attributes):
+        if 'CH' in attr:
+            choice.append(i)
+            nach.append(attr.replace('CH','NACH'))
+        if 'NC' in attr:
+            nc.append(i)
+        if 'TD' in attr:
+            td.append(i)
+            nain.append(attr.replace('TD','NAIN'))
+    new_attributes = nach + nain
+    all_values = []
+    for feat in values:
+        feat = list(feat)
+        calc_values = []
+        for i, j in enumerate(choice):
+            calc_values.append(math.log(float(feat[j])+1.0)/math.log(float(feat[td[i]])+3.0))
+        for i, j in enumerate(td):
+            if i < len(nc):
+                calc_values.append((float(feat[nc[i]])**1.2)/float(feat[j]))
+            else:
+                calc_values.append((float(feat[nc[i-len(nc)]])**1.2)/float(feat[j]))
+        feat.extend(calc_values)
+        all_values.append(feat)
+    return new_attributes, all_values
+
+
+class NormalisedSegmentTest(unittest.TestCase):
+
+    # depthmapX segment results, with the names shortened by fixDepthmapNames
+    attributes = ['Ref', 'x1', 'y1', 'x2', 'y2', 'CH', 'NC', 'TD', 'CHr800m', 'NCr800m', 'TDr800m']
+
+    def getValues(self, rows):
+        generator = random.Random(1)
+        values = []
+        for ref in range(rows):
+            row = [str(ref)] + [generator.uniform(0, 1000) for i in range(4)]
+            for radius in range(2):
+                # depthmapX results mix integer and float cells, as strings or numbers
+                row.append(generator.randint(0, 100000))
+                row.append(str(generator.randint(1, 5000)))
+                row.append(generator.uniform(0.5, 10000.0))
+            values.append(row)
+        return values
+
+    def getColumns(self, values):
+        return [list(column) for column in zip(*values)]
+
+    def testParity(self):
+        values = self.getValues(200)
+        names, columns = calcNormalisedSegment(self.attributes, self.getColumns(values))
+        scalar_names, scalar_results = scalarNormalisedSegment(self.attributes, values)
+        self.assertEqual(names, scalar_names)
+        self.assertEqual(names, ['NACH', 'NACHr800m', 'NAIN', 'NAINr800m'])
+        self.assertEqual(len(columns), len(names))
+        for column in columns:
+            self.assertEqual(len(column), len(scalar_results))
+        for i, scalar_row in enumerate(scalar_results):
+            for column, scalar_value in zip(columns, scalar_row[len(self.attributes):]):
+                self.assertAlmostEqual(column[i], scalar_value, places=9)
+
+    def testZeroTotalDepth(self):
+        values = self.getValues(3)
+        values[1][7] = 0
+        values[2][10] = '0'
+        names, columns = calcNormalisedSegment(self.attributes, self.getColumns(values))
+        self.assertEqual(columns[2][1], -1.0)
+        self.assertEqual(columns[3][2], -1.0)
+        # choice is still normalised when the total depth is zero
+        self.assertAlmostEqual(columns[0][1], math.log(float(values[1][5]) + 1.0) / math.log(3.0), places=9)
+        # the other rows keep their values
+        scalar_names, scalar_results = scalarNormalisedSegment(self.attributes, values[:1])
+        for column, scalar_value in zip(columns, scalar_results[0][len(self.attributes):]):
+            self.assertAlmostEqual(column[0], scalar_value, places=9)
+
+    def testNoValues(self):
+        names, columns = calcNormalisedSegment(self.attributes, [])
+        self.assertEqual(len(names), 4)
+        self.assertEqual(columns, [[], [], [], []])
+        names, columns = calcNormalisedSegment(self.attributes, [[] for attr in self.attributes])
+        self.assertEqual(columns, [[], [], [], []])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Tests of the analysis in worker processes, runnable without QGIS:
+#   python -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from esstools.network_functions import buildAdjacency, buildSegmentGraph, calcAxialMeasures, calcSegmentMeasures, \
+    getLineIntersections, getPythonExecutable
+
+
+def getGridLines(size):
+    # horizontal and vertical lines crossing each other, extending beyond the grid
+    coords = []
+    for i in range(size):
+        coords.append((-1.0, float(i), float(size), float(i)))
+        coords.append((float(i), -1.0, float(i), float(size)))
+    return np.array(coords, dtype=np.float64)
+
+
+@unittest.skipIf(getPythonExecutable() is None, "no python interpreter to start the worker processes")
+class ParallelAnalysisTest(unittest.TestCase):
+
+    def assertSameMeasures(self, serial, parallel):
+        self.assertEqual(sorted(serial.keys()), sorted(parallel.keys()))
+        for name in serial.keys():
+            np.testing.assert_allclose(parallel[name], serial[name], rtol=1e-9, atol=1e-9, err_msg=name)
+
+    def testAxialMeasures(self):
+        coords = getGridLines(12)
+        indptr, indices = buildAdjacency(len(coords), getLineIntersections(coords))
+        serial = calcAxialMeasures(indptr, indices, [0, 2], True, True, batch=3)
+        parallel = calcAxialMeasures(indptr, indices, [0, 2], True, True, batch=3, processes=3)
+        self.assertSameMeasures(serial, parallel)
+
+    def testSegmentMeasures(self):
+        coords = getGridLines(5)
+        graph = buildSegmentGraph(coords, getLineIntersections(coords))
+        serial = calcSegmentMeasures(graph, [0, 3.0], 2, True)
+        parallel = calcSegmentMeasures(graph, [0, 3.0], 2, True, processes=2)
+        self.assertSameMeasures(serial, parallel)
+
+    def testProgressAbort(self):
+        coords = getGridLines(12)
+        indptr, indices = buildAdjacency(len(coords), getLineIntersections(coords))
+        measures = calcAxialMeasures(indptr, indices, [0], progress=lambda value: False, batch=1, processes=2)
+        self.assertIsNone(measures)
+
+
+if __name__ == '__main__':
+    unittest.main()
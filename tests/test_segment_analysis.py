@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# Tests of the built-in angular segment analysis, against known values and a simple reference search,
+# runnable without QGIS:
+#   python -m unittest discover tests
+
+import os
+import sys
+import heapq
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from esstools.network_functions import TULIP_BINS, buildSegmentGraph, calcSegmentMeasures, getLineIntersections, \
+    getStraightChains, searchSegmentBatch
+
+
+def referenceSegmentMeasures(graph, radius=0, radius_type=2, bins=TULIP_BINS):
+    # one Dijkstra search per source segment over the directed segment states, ordered by angular then metric
+    # distance, followed by the Brandes dependency accumulation on the shortest paths within the radius
+    indptr = graph['indptr'].tolist()
+    indices = graph['indices'].tolist()
+    costs = graph['costs'].tolist()
+    lengths = graph['lengths'].tolist()
+    segments = len(lengths)
+    td = [0.0] * segments
+    nc = [0] * segments
+    choice = [0.0] * segments
+    angular_radius = radius * bins / 2.0
+
+    def getTurns(v):
+        return list(zip(indices[indptr[v]:indptr[v + 1]], costs[indptr[v]:indptr[v + 1]]))
+
+    for source in range(segments):
+        best = dict()
+        steps = dict()
+        heap = []
+        for state in (2 * source, 2 * source + 1):
+            best[state] = (0, 0.0)
+            steps[state] = 0
+            heapq.heappush(heap, (0, 0.0, state))
+
+        def outside(v, w, d):
+            if radius == 0:
+                return False
+            elif radius_type == 0:
+                return steps[v] + 1 > radius
+            elif radius_type == 1:
+                return d > angular_radius
+            return best[v][1] + (lengths[v >> 1] + lengths[w >> 1]) / 2.0 > radius
+
+        settled = set()
+        while heap:
+            d, m, v = heapq.heappop(heap)
+            if v in settled or (d, m) != best[v]:
+                continue
+            settled.add(v)
+            for w, cost in getTurns(v):
+                if w in settled or outside(v, w, d + cost):
+                    continue
+                key = (d + cost, m + (lengths[v >> 1] + lengths[w >> 1]) / 2.0)
+                if w not in best or key < best[w]:
+                    best[w] = key
+                    steps[w] = steps[v] + 1
+                    heapq.heappush(heap, key + (w,))
+        dist = dict((v, best[v][0]) for v in best)
+        preds = dict((v, []) for v in dist)
+        succs = dict((v, []) for v in dist)
+        for v in dist:
+            for w, cost in getTurns(v):
+                if w in dist and (w >> 1) != source and dist[v] + cost == dist[w] and not outside(v, w, dist[w]):
+                    preds[w].append(v)
+                    succs[v].append(w)
+        sigma = dict()
+
+        def getSigma(v):
+            if v not in sigma:
+                sigma[v] = 1.0 if (v >> 1) == source else sum(getSigma(u) for u in preds[v])
+            return sigma[v]
+
+        # segment depth is the shortest of its two directions
+        seg_dist = dict()
+        for v in dist:
+            seg_dist[v >> 1] = min(seg_dist.get(v >> 1, dist[v]), dist[v])
+        td[source] = sum(seg_dist.values()) * 2.0 / bins
+        nc[source] = len(seg_dist)
+        seg_sigma = dict()
+        for v in dist:
+            if dist[v] == seg_dist[v >> 1]:
+                seg_sigma[v >> 1] = seg_sigma.get(v >> 1, 0.0) + getSigma(v)
+        delta = dict()
+
+        def getDelta(v):
+            if v not in delta:
+                delta[v] = 0.0
+                for w in succs[v]:
+                    target = getSigma(w) / seg_sigma[w >> 1] if dist[w] == seg_dist[w >> 1] else 0.0
+                    delta[v] += getSigma(v) / getSigma(w) * (target + getDelta(w))
+            return delta[v]
+
+        for v in dist:
+            if (v >> 1) != source:
+                choice[v >> 1] += getDelta(v)
+    return np.array(td), np.array(nc), np.array(choice) / 2.0
+
+
+def getMeasureNames(radius, radius_type):
+    if radius == 0:
+        suffix = ''
+    elif radius_type == 2:
+        suffix = ' R%s metric' % radius
+    elif radius_type == 1:
+        suffix = ' R%s angular' % radius
+    else:
+        suffix = ' R%s' % radius
+    return ['T%d %s%s' % (TULIP_BINS, name, suffix) for name in ('Total Depth', 'Node Count', 'Choice', 'Integration')]
+
+
+class SegmentAnalysisTest(unittest.TestCase):
+
+    def getGraph(self, coords):
+        coords = np.array(coords, dtype=np.float64)
+        return buildSegmentGraph(coords, getLineIntersections(coords))
+
+    def getMeasures(self, graph, radius=0, radius_type=2):
+        measures = calcSegmentMeasures(graph, [radius], radius_type, True)
+        return [measures[name] for name in getMeasureNames(radius, radius_type)]
+
+    def testCross(self):
+        # two crossing lines make four segments, every other segment is one turn of 90 degrees away
+        graph = self.getGraph([(-1.0, 0.0, 1.0, 0.0), (0.0, -1.0, 0.0, 1.0)])
+        self.assertEqual(len(graph['lengths']), 4)
+        td, nc, choice, integration = self.getMeasures(graph)
+        np.testing.assert_allclose(td, [2.0] * 4)
+        self.assertEqual(nc.tolist(), [4] * 4)
+        np.testing.assert_allclose(choice, [0.0] * 4)
+        np.testing.assert_allclose(integration, [8.0] * 4)
+
+    def testStraightLines(self):
+        # three lines continuing each other, joined without turns
+        graph = self.getGraph([(0.0, 0.0, 1.0, 0.0), (1.0, 0.0, 2.0, 0.0), (2.0, 0.0, 3.0, 0.0)])
+        self.assertEqual(graph['costs'].tolist(), [0] * 4)
+        td, nc, choice, integration = self.getMeasures(graph)
+        np.testing.assert_allclose(td, [0.0] * 3)
+        self.assertEqual(nc.tolist(), [3] * 3)
+        np.testing.assert_allclose(choice, [0.0, 1.0, 0.0])
+        np.testing.assert_allclose(integration, [-1.0] * 3)
+        # the ends are 2 apart, between the centres of the segments
+        td, nc, choice, integration = self.getMeasures(graph, 1.5, 2)
+        self.assertEqual(nc.tolist(), [2, 3, 2])
+        np.testing.assert_allclose(choice, [0.0] * 3)
+        td, nc, choice, integration = self.getMeasures(graph, 1, 0)
+        self.assertEqual(nc.tolist(), [2, 3, 2])
+        td, nc, choice, integration = self.getMeasures(graph, 2, 0)
+        self.assertEqual(nc.tolist(), [3] * 3)
+        np.testing.assert_allclose(choice, [0.0, 1.0, 0.0])
+
+    def testTulipBins(self):
+        # a turn of 30 degrees is 170.67 bins of 180 / 1024 degrees, rounded to 171 bins
+        angle = np.radians(30.0)
+        graph = self.getGraph([(0.0, 0.0, 1.0, 0.0), (1.0, 0.0, 1.0 + np.cos(angle), np.sin(angle))])
+        self.assertEqual(graph['costs'].tolist(), [171, 171])
+        td, nc, choice, integration = self.getMeasures(graph)
+        np.testing.assert_allclose(td, [171.0 / 512.0] * 2)
+
+    def testAngularRadius(self):
+        # a path turning 45 degrees at each line, 0.5 angular depth per turn
+        points = [(0.0, 0.0), (1.0, 0.0)]
+        for i in range(1, 4):
+            angle = np.radians(45.0 * i)
+            points.append((points[-1][0] + np.cos(angle), points[-1][1] + np.sin(angle)))
+        graph = self.getGraph([points[i] + points[i + 1] for i in range(4)])
+        td, nc, choice, integration = self.getMeasures(graph)
+        np.testing.assert_allclose(td, [3.0, 2.0, 2.0, 3.0])
+        np.testing.assert_allclose(choice, [0.0, 2.0, 2.0, 0.0])
+        # the radius includes the lines at exactly 90 degrees
+        td, nc, choice, integration = self.getMeasures(graph, 1.0, 1)
+        self.assertEqual(nc.tolist(), [3, 4, 4, 3])
+        np.testing.assert_allclose(td, [1.5, 2.0, 2.0, 1.5])
+        np.testing.assert_allclose(choice, [0.0, 1.0, 1.0, 0.0])
+
+    def testReference(self):
+        # random lines, some of them on a coarse grid to have parallel and continuing lines
+        generator = np.random.RandomState(3)
+        for trial in range(12):
+            coords = generator.uniform(0, 10, (generator.randint(4, 14), 4))
+            if trial % 3 == 0:
+                coords = np.round(coords)
+            graph = self.getGraph(coords)
+            for radius_type, radius in ((0, 0), (0, 2), (0, 4), (1, 0.5), (1, 1.0), (2, 5.0), (2, 12.0)):
+                td, nc, choice, integration = self.getMeasures(graph, radius, radius_type)
+                ref_td, ref_nc, ref_choice = referenceSegmentMeasures(graph, radius, radius_type)
+                np.testing.assert_allclose(td, ref_td, err_msg='trial %d radius %s' % (trial, radius))
+                self.assertEqual(nc.tolist(), ref_nc.tolist())
+                np.testing.assert_allclose(choice, ref_choice, atol=1e-9, err_msg='trial %d radius %s' % (trial, radius))
+
+    def testGridReference(self):
+        # a grid has long chains of straight segments, searched with the chains above the size limit
+        coords = [(-1.0, float(i), 6.0, float(i)) for i in range(6)] + \
+                 [(float(i), -1.0, float(i), 6.0) for i in range(6)]
+        graph = self.getGraph(coords)
+        for radius_type, radius in ((0, 0), (0, 3), (1, 1.0), (2, 4.0)):
+            td, nc, choice, integration = self.getMeasures(graph, radius, radius_type)
+            ref_td, ref_nc, ref_choice = referenceSegmentMeasures(graph, radius, radius_type)
+            np.testing.assert_allclose(td, ref_td)
+            self.assertEqual(nc.tolist(), ref_nc.tolist())
+            np.testing.assert_allclose(choice, ref_choice, atol=1e-9)
+
+    def testChains(self):
+        # following the straight chains at once gives the same search as one transition at a time
+        coords = [(-1.0, float(i), 4.0, float(i)) for i in range(4)] + \
+                 [(float(i), -1.0, float(i), 4.0) for i in range(4)] + [(-1.0, -1.0, 4.0, 4.0)]
+        graph = self.getGraph(coords)
+        chains = getStraightChains(graph)
+        self.assertIsNotNone(chains)
+        sources = np.arange(len(graph['lengths']), dtype=np.int64)
+        for radius_type, radius in ((0, 0), (0, 3), (1, 1.0), (2, 3.0)):
+            search = searchSegmentBatch(graph, sources, radius, radius_type, chains=chains)
+            single = searchSegmentBatch(graph, sources, radius, radius_type)
+            self.assertEqual(search['dist'].tolist(), single['dist'].tolist())
+            np.testing.assert_allclose(search['sigma'], single['sigma'])
+            np.testing.assert_allclose(search['metric'], single['metric'])
+
+    def testBranchingChains(self):
+        # lines crossing at an angle rounded to no turn have straight transitions that branch
+        graph = self.getGraph([(0.0, 0.0, 2.0, 0.0), (0.0, -0.0001, 2.0, 0.0001)])
+        self.assertIsNone(getStraightChains(graph))
+        td, nc, choice, integration = self.getMeasures(graph)
+        ref_td, ref_nc, ref_choice = referenceSegmentMeasures(graph)
+        np.testing.assert_allclose(td, ref_td)
+        np.testing.assert_allclose(choice, ref_choice, atol=1e-9)
+
+
+if __name__ == '__main__':
+    unittest.main()